@@ -0,0 +1,312 @@
+"""NewtonSolver with the POEM_068 restart from successful outputs.
+Modified for the POEM_068 prototype. The modifications can be found by searching for the
+following comments in this file:
+
+- "EDIT-ARCHIVE": archive the outputs of several successful solves keyed by design point, and
+  restart from the nearest one.
+- "EDIT-SHARED": store the archive in a memory-mapped file shared by the processes that run the
+  same model.
+- "EDIT-PREDICT": extrapolate the initial guess from the last converged outputs and design points.
+"""
+
+import os
+from collections import deque
+
+import numpy as np
+
+from openmdao.solvers.nonlinear.newton import NewtonSolver
+
+from state_archive import StateArchive, SharedStateArchive
+
+
+class NewtonSolverCustom(NewtonSolver):
+    """
+    Newton solver that restarts from the successful outputs nearest to the current design point.
+
+    Parameters
+    ----------
+    **kwargs : dict
+        Options dictionary.
+
+    Attributes
+    ----------
+    _archive : StateArchive or None
+        Outputs of the last successful solves keyed by design point.
+    _archive_names : list or None
+        Absolute names of the inputs whose values key the archive, when option archive_keys is
+        None.
+    _last_key : ndarray or None
+        Key of the design point of the last solve.
+    _history : deque or None
+        Keys and outputs of the last successful solves, used by the predictor.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize all attributes.
+        """
+        super().__init__(**kwargs)
+
+        # EDIT-ARCHIVE
+        self._archive = None
+        self._archive_names = None
+        self._last_key = None
+
+        # EDIT-PREDICT
+        self._history = None
+
+    def _declare_options(self):
+        """
+        Declare options before kwargs are processed in the init method.
+        """
+        super()._declare_options()
+
+        # EDIT-ARCHIVE
+        self.options.declare('archive_size', types=int, default=0, lower=0,
+                             desc="Number of successful output vectors archived when "
+                             "restart_from_successful is True, each keyed by its design point. "
+                             "A restart then starts from the archived outputs nearest to the "
+                             "current design point instead of the last successful outputs. "
+                             "0 disables the archive.")
+        self.options.declare('archive_keys', types=list, default=None, allow_none=True,
+                             desc="Names of the variables, relative to the system, whose values "
+                             "define the design point of an archived solution. None uses the "
+                             "inputs of the system that are connected from outside of it.")
+        self.options.declare('archive_always', types=bool, default=False,
+                             desc="If True, also start a solve following a successful one from "
+                             "the nearest archived outputs when their design point is nearer "
+                             "than the design point of the previous solve.")
+
+        # EDIT-SHARED
+        self.options.declare('archive_dir', types=str, default=None, allow_none=True,
+                             desc="Directory of the memory-mapped files in which the archives "
+                             "are stored, one file per system pathname, so that the processes "
+                             "running the same model (e.g. the workers of a DOE) restart from "
+                             "each other's successful outputs. A directory in /dev/shm keeps "
+                             "them in shared memory. None keeps the archive in this process.")
+        self.options.declare('archive_id', types=str, default=None, allow_none=True,
+                             desc="Identifier of the model (e.g. of the run) stamped in the "
+                             "archive files of archive_dir. A file with another stamp, e.g. "
+                             "left by a previous run of a different model, is replaced instead "
+                             "of being read. None uses the pathname and the output names of "
+                             "the system.")
+
+        # EDIT-PREDICT
+        self.options.declare('predictor', values=[None, 'secant'], default=None, allow_none=True,
+                             desc="If 'secant', the initial guess of a solve is extrapolated to "
+                             "first order from the outputs and design points of the last "
+                             "successful solves (see archive_keys for the design point), "
+                             "instead of starting from the previous outputs.")
+        self.options.declare('predictor_depth', types=int, default=3, lower=2,
+                             desc="Number of successful solves used by the predictor.")
+
+    def _setup_solvers(self, system, depth):
+        """
+        Assign system instance, set depth, and optionally perform setup.
+
+        Parameters
+        ----------
+        system : System
+            pointer to the owning system.
+        depth : int
+            depth of the current system (already incremented).
+        """
+        super()._setup_solvers(system, depth)
+
+        # EDIT-ARCHIVE
+        # the vector sizes may have changed, so the archived outputs are dropped
+        if self._archive is not None:
+            self._archive.close()
+        self._archive = None
+        self._archive_names = None
+        self._last_key = None
+        if self.options['archive_size'] > 0:
+            # EDIT-SHARED
+            archive_dir = self.options['archive_dir']
+            if archive_dir is None:
+                self._archive = StateArchive(self.options['archive_size'])
+            else:
+                name = system.pathname if system.pathname else 'model'
+                if system.comm.size > 1:
+                    # each process stores its local part of the outputs
+                    name += f'.{system.comm.rank}'
+                archive_id = self.options['archive_id']
+                if archive_id is None:
+                    archive_id = ' '.join([name] + list(system._var_abs2meta['output']))
+                os.makedirs(archive_dir, exist_ok=True)
+                self._archive = SharedStateArchive(os.path.join(archive_dir, name + '.npy'),
+                                                   self.options['archive_size'],
+                                                   archive_id=archive_id)
+
+        # EDIT-PREDICT
+        self._history = deque(maxlen=self.options['predictor_depth'])
+
+    # EDIT-ARCHIVE
+    def _get_archive_key(self):
+        """
+        Return the values that define the current design point of the system.
+
+        Returns
+        -------
+        ndarray
+            Key of the design point.
+        """
+        system = self._system()
+        names = self.options['archive_keys']
+
+        if names is not None:
+            return np.concatenate([np.ravel(system.get_val(name)).real for name in names])
+
+        if self._archive_names is None:
+            # inputs whose source is outside of the system, i.e. that do not depend on the states
+            model = system._problem_meta['model_ref']()
+            conns = model._conn_global_abs_in2out
+            prefix = system.pathname + '.' if system.pathname else ''
+            self._archive_names = [name for name in system._var_abs2meta['input']
+                                   if not conns[name].startswith(prefix)]
+
+        if not self._archive_names:
+            return np.zeros(0)
+
+        inputs = system._inputs
+        return np.concatenate([inputs._abs_get_val(name).real for name in self._archive_names])
+
+    # EDIT-PREDICT
+    def _predict(self, key):
+        """
+        Extrapolate the outputs at a design point from the last successful solves.
+
+        The differences between the last design point and the previous ones are combined (in
+        the least-squares sense, each component scaled as in the archive) to match the step to
+        the new design point, and the same combination of output differences is added to the
+        last outputs.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the new design point.
+
+        Returns
+        -------
+        ndarray or None
+            Predicted outputs, clipped to the bounds enforced by the line search, or None if
+            there is not enough history to extrapolate.
+        """
+        if len(self._history) < 2:
+            return None
+
+        key0, outputs0 = self._history[-1]
+        if key0.size != key.size or key.size == 0:
+            return None
+
+        scale = 1.0 / (np.abs(key) + 1.0)
+        step = (key - key0) * scale
+        if not step.any():
+            return None
+
+        prev = list(self._history)[:-1]
+        dkeys = np.array([(k - key0) * scale for k, _ in prev])
+        douts = np.array([o - outputs0 for _, o in prev])
+
+        coefs = np.linalg.lstsq(dkeys.T, step, rcond=None)[0]
+        outputs = outputs0 + coefs.dot(douts)
+
+        if not np.all(np.isfinite(outputs)):
+            return None
+
+        # the extrapolation may leave the bounds of the outputs, as enforced by the line search
+        lower = getattr(self.linesearch, '_lower_bounds', None)
+        upper = getattr(self.linesearch, '_upper_bounds', None)
+        if lower is not None:
+            np.maximum(outputs, lower, out=outputs)
+        if upper is not None:
+            np.minimum(outputs, upper, out=outputs)
+
+        return outputs
+
+    def _solve_with_cache_check(self):
+        """
+        Solve the nonlinear system, possibly after updating the output vector.
+
+        The base class restarts a solve that follows a failure from the outputs of the last
+        successful solve. The outputs may instead come from the archive (the nearest archived
+        design point) or, after a success, from the predictor or the archive.
+        """
+        system = self._system()
+
+        # EDIT-ARCHIVE
+        use_cache = (self.options['restart_from_successful'] and self.options['maxiter'] > 1 and
+                     not system.under_approx)
+        # EDIT-PREDICT
+        use_predictor = self.options['predictor'] is not None and not system.under_approx
+
+        if not use_cache and not use_predictor:
+            self.solve()
+            return
+
+        key = None
+        if (use_cache and self._archive is not None) or use_predictor:
+            key = self._get_archive_key()
+
+        try:
+            self._restarted = False
+
+            # If we have a previous solver failure, we want to replace
+            # the outputs using the cache.
+            if use_cache and self._prev_fail:
+                # EDIT-ARCHIVE
+                # restart from the archived outputs nearest to the current design point (a view
+                # of the archive, copied into the output vector by set_val)
+                outputs = None
+                if key is not None and self._archive is not None:
+                    outputs, _ = self._archive.nearest(key)
+                if outputs is None:
+                    outputs = self._output_cache
+                if outputs is not None:
+                    system._outputs.set_val(outputs)
+                    self._restarted = True
+
+            # EDIT-PREDICT
+            elif use_predictor:
+                outputs = self._predict(key)
+                if outputs is not None:
+                    system._outputs.set_val(outputs)
+
+            # EDIT-ARCHIVE
+            # after a success, the previous outputs are replaced when an archived design point
+            # is nearer than the previous one
+            elif key is not None and self._archive is not None and \
+                    self.options['archive_always'] and \
+                    self._last_key is not None and self._last_key.size == key.size:
+                outputs, dist = self._archive.nearest(key)
+                if outputs is not None and dist < self._archive.distance(key, self._last_key):
+                    system._outputs.set_val(outputs)
+
+            if key is not None:
+                self._last_key = key
+
+            self.solve()
+
+            # If we make it here, the solver converged.
+            if use_cache:
+                self._prev_fail = False
+
+                # Save the outputs upon a successful solve
+                if self._output_cache is None:
+                    self._output_cache = system._outputs.asarray(copy=True)
+                else:
+                    self._output_cache[:] = system._outputs.asarray()
+
+                # EDIT-ARCHIVE
+                if self._archive is not None:
+                    self._archive.add(key, system._outputs.asarray())
+
+            # EDIT-PREDICT
+            if use_predictor:
+                self._history.append((key, system._outputs.asarray(copy=True)))
+
+        except Exception:
+            # The solver failed so we need to set the flag to True
+            if use_cache:
+                self._prev_fail = True
+            raise
@@ -0,0 +1,263 @@
+"""Profiler of the solver hierarchy of a model, used with the POEM_068 examples.
+
+`set_solver_print` shows the residual norms of every solver, but not where the time goes in a
+model with nested Newton solvers. SolverProfiler wraps the methods of every solver of a model
+(after setup) and attributes wall time and call counts to each solver in the hierarchy, split
+into:
+
+- 'residuals': residual evaluations (apply_nonlinear) requested by a nonlinear solver,
+- 'linearize': linearizations requested by a nonlinear solver (computing and assembling the
+  partial derivatives),
+- 'factorization <pathname> <solver>': linearizations of a linear solver (the LU factorization
+  of a DirectSolver),
+- 'linear solve <pathname> <solver>': linear solves,
+- 'linesearch': line searches.
+
+Since the nonlinear solvers of the subsystems are called from the solvers of their parents, the
+timings are recorded by call stack, e.g. ('TOC NL: Newton', 'TOC.fan NL: Newton', 'residuals').
+The stacks can be written in the "folded" format read by flame graph tools (flamegraph.pl,
+speedscope, ...) with `write_flamegraph`:
+
+    profiler = SolverProfiler(prob)
+    with profiler:
+        prob.run_model()
+    print(profiler)
+    profiler.write_flamegraph('solvers.folded')
+
+Under MPI, each process records its own calls.
+"""
+
+import time
+from functools import wraps
+
+
+class SolverProfiler(object):
+    """
+    Record the time spent in the solvers of a model by call stack.
+
+    Parameters
+    ----------
+    prob : Problem
+        Problem whose model solvers are profiled. It must be set up.
+
+    Attributes
+    ----------
+    _prob : Problem
+        Problem whose model solvers are profiled.
+    _stack : list
+        Names of the frames being executed.
+    _records : dict
+        Number of calls and total (inclusive) time in seconds, keyed by call stack.
+    _wrapped : list
+        Objects whose methods were wrapped, with the names of the wrapped methods.
+    _wrapped_ids : set
+        Ids of the solvers and line searches whose methods were wrapped, so that a solver shared
+        by several systems is only wrapped once.
+    """
+
+    def __init__(self, prob):
+        """
+        Initialize attributes.
+        """
+        self._prob = prob
+        self._stack = []
+        self._records = {}
+        self._wrapped = []
+        self._wrapped_ids = set()
+
+    def __enter__(self):
+        """
+        Start profiling.
+
+        Returns
+        -------
+        SolverProfiler
+            This profiler.
+        """
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Stop profiling.
+
+        Parameters
+        ----------
+        *args : list
+            Exception information, if any.
+        """
+        self.stop()
+
+    def reset(self):
+        """
+        Discard the recorded timings.
+        """
+        # the timed methods hold a reference to this dict, so it is cleared rather than replaced
+        self._records.clear()
+
+    def _wrap(self, obj, method_name, frame):
+        """
+        Replace a method of an object by a timed version.
+
+        Parameters
+        ----------
+        obj : Solver
+            Solver or line search.
+        method_name : str
+            Name of the method.
+        frame : str
+            Name of the frame recorded for the calls of the method.
+        """
+        method = getattr(obj, method_name)
+        stack = self._stack
+        records = self._records
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            stack.append(frame)
+            key = tuple(stack)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                rec = records.get(key)
+                if rec is None:
+                    records[key] = [1, elapsed]
+                else:
+                    rec[0] += 1
+                    rec[1] += elapsed
+
+        setattr(obj, method_name, timed)
+        self._wrapped.append((obj, method_name))
+
+    def _claim(self, obj):
+        """
+        Return True the first time a solver or line search is seen during start.
+
+        Parameters
+        ----------
+        obj : Solver or None
+            Solver or line search.
+
+        Returns
+        -------
+        bool
+            True if obj is not None and its methods have not been wrapped yet.
+        """
+        if obj is None or id(obj) in self._wrapped_ids:
+            return False
+        self._wrapped_ids.add(id(obj))
+        return True
+
+    def _wrap_linear_solver(self, ln, name):
+        """
+        Wrap the linearization and the solve of a linear solver.
+
+        Parameters
+        ----------
+        ln : LinearSolver
+            Linear solver.
+        name : str
+            Pathname of the owning system, 'model' for the top level.
+        """
+        self._wrap(ln, '_linearize', f"factorization {name} {ln.SOLVER}")
+        self._wrap(ln, 'solve', f"linear solve {name} {ln.SOLVER}")
+
+    def start(self):
+        """
+        Wrap the methods of all the solvers of the model.
+        """
+        if self._wrapped:
+            return
+
+        for system in self._prob.model.system_iter(include_self=True, recurse=True):
+            name = system.pathname if system.pathname else 'model'
+
+            nl = system.nonlinear_solver
+            if self._claim(nl):
+                self._wrap(nl, 'solve', f"{name} {nl.SOLVER}")
+                self._wrap(nl, '_run_apply', 'residuals')
+                self._wrap(nl, '_linearize', 'linearize')
+                ls = getattr(nl, 'linesearch', None)
+                if self._claim(ls):
+                    self._wrap(ls, 'solve', 'linesearch')
+                    self._wrap(ls, '_run_apply', 'residuals')
+
+                # a Newton or Broyden solver may have its own linear solver instead of the one of
+                # its system
+                nl_ln = getattr(nl, 'linear_solver', None)
+                if self._claim(nl_ln):
+                    self._wrap_linear_solver(nl_ln, name)
+
+            ln = system.linear_solver
+            if self._claim(ln):
+                self._wrap_linear_solver(ln, name)
+
+    def stop(self):
+        """
+        Restore the original methods of the solvers. The recorded timings are kept.
+        """
+        for obj, method_name in self._wrapped:
+            # the timed versions are instance attributes hiding the class methods
+            delattr(obj, method_name)
+        self._wrapped = []
+        self._wrapped_ids.clear()
+
+    def get_stats(self):
+        """
+        Return the recorded calls by call stack.
+
+        Returns
+        -------
+        dict
+            For each call stack (tuple of frame names), a dictionary with the number of 'calls',
+            the 'total' time including the nested frames and the 'self' time excluding them,
+            in seconds.
+        """
+        stats = {key: {'calls': calls, 'total': total, 'self': total}
+                 for key, (calls, total) in self._records.items()}
+
+        for key, (_, total) in self._records.items():
+            parent = stats.get(key[:-1])
+            if parent is not None:
+                parent['self'] -= total
+
+        return stats
+
+    def write_flamegraph(self, filename, unit=1e-6):
+        """
+        Write the self times in the folded stack format read by flame graph tools.
+
+        Each line holds the frames of one call stack separated by semicolons and the self time
+        of the stack, as an integer number of units.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file.
+        unit : float
+            Time unit in seconds, microseconds by default.
+        """
+        with open(filename, 'w') as f:
+            for key, stat in sorted(self.get_stats().items()):
+                count = int(round(max(stat['self'], 0.0) / unit))
+                if count > 0:
+                    f.write(f"{';'.join(key)} {count}\n")
+
+    def __str__(self):
+        """
+        Return the recorded calls as a table indented by call depth.
+
+        Returns
+        -------
+        str
+            Table of the calls, total and self times.
+        """
+        lines = [f"{'frame':<60} {'calls':>8} {'total (s)':>11} {'self (s)':>11}"]
+        for key, stat in sorted(self.get_stats().items()):
+            frame = '  ' * (len(key) - 1) + key[-1]
+            lines.append(f"{frame:<60} {stat['calls']:>8} {stat['total']:>11.4f} "
+                         f"{stat['self']:>11.4f}")
+        return '\n'.join(lines)
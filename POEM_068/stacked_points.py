@@ -0,0 +1,259 @@
+"""Stacked solution of the structurally identical points of a multipoint group.
+
+In a pyCycle MPCycle, each operating point is a separate subsystem with its own Newton solver
+and DirectSolver, and the points are solved one after another although they share the same
+structure. `stack_points`, called from the `configure` method of the multipoint group, finds the
+points with identical structure and solves them together with a single Newton solver on the
+multipoint group:
+
+- the Newton solvers of the stacked points are replaced by NonlinearRunOnce, and the multipoint
+  group gets a StackedNewtonSolver with the convergence options (maxiter, atol, rtol, iprint,
+  err_on_non_converge) and line search of the first stacked point, but not its archive options,
+- unless a linear solver was configured on the multipoint group, it gets a DirectSolver with an
+  assembled jacobian (CSC by default), factored in a single sparse LU factorization. The stacked
+  points are not coupled to each other, but the
+  off-design points take their design areas and map scalars from the design point, so the
+  jacobian is block lower triangular rather than block diagonal: its off-diagonal blocks couple
+  the design point (which is not stacked and keeps its own solver, called on every iteration
+  since solve_subsystems is set) to the off-design points, and the LU factors the whole coupled
+  matrix.
+
+Each Newton iteration then evaluates the residuals, linearizes and factors all the points in one
+pass, so the overhead of the solver calls is paid once per iteration instead of once per point.
+
+The price is that the points lose their individual robustness: they converge together, so the
+iterations stop only when the norm of the residuals of all the points is below tolerance (the
+points that converge quickly are evaluated until the slowest one converges), and the line search
+takes a single step length for all of them. With the point_fallback option (the default), when
+the stacked solve fails, the outputs are reset to their values before the solve and the
+subsystems are solved one after another as without stacking, each stacked point by its own
+original solver, so a point that does not converge with the others does not make all of them
+fail. The fallback requires err_on_non_converge, so that a failed solve raises an AnalysisError.
+
+    class MPhbtf(pyc.MPCycle):
+        def setup(self):
+            ...
+
+        def configure(self):
+            super().configure()
+            stack_points(self)
+"""
+
+from copy import deepcopy
+
+import openmdao.api as om
+
+from newton_custom import NewtonSolverCustom
+
+# options of the solver of the first point used by the solver of the stacked points
+_CONVERGENCE_OPTIONS = ['maxiter', 'atol', 'rtol', 'iprint', 'err_on_non_converge']
+
+
+class StackedNewtonSolver(NewtonSolverCustom):
+    """
+    Newton solver of stacked points that falls back to the solvers of the points on a failure.
+
+    Parameters
+    ----------
+    **kwargs : dict
+        Options dictionary.
+
+    Attributes
+    ----------
+    _point_solvers : dict
+        Original nonlinear solvers of the stacked points, keyed by point name.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize all attributes.
+        """
+        super().__init__(**kwargs)
+        self._point_solvers = {}
+
+    def _declare_options(self):
+        """
+        Declare options before kwargs are processed in the init method.
+        """
+        super()._declare_options()
+
+        self.options.declare('point_fallback', types=bool, default=True,
+                             desc="If True, when the stacked solve raises an AnalysisError, the "
+                             "outputs are reset and the subsystems are solved one after another, "
+                             "each stacked point by its own original nonlinear solver.")
+
+    def _setup_solvers(self, system, depth):
+        """
+        Assign system instance, set depth, and optionally perform setup.
+
+        Parameters
+        ----------
+        system : System
+            pointer to the owning system.
+        depth : int
+            depth of the current system (already incremented).
+        """
+        super()._setup_solvers(system, depth)
+
+        # the original solvers are no longer attached to the points, so they are set up here
+        for name, solver in self._point_solvers.items():
+            subsys = system._get_subsystem(name)
+            if subsys is not None:
+                solver._setup_solvers(subsys, depth + 1)
+
+    def _set_solver_print(self, level=2, type_='all'):
+        """
+        Control printing for solvers and subsolvers in the model.
+
+        Parameters
+        ----------
+        level : int
+            iprint level. Set to 2 to print residuals each iteration; set to 1
+            to print just the iteration totals; set to 0 to disable all printing
+            except for failures, and set to -1 to disable all printing including failures.
+        type_ : str
+            Type of solver to set: 'LN' for linear, 'NL' for nonlinear, or 'all' for all.
+        """
+        super()._set_solver_print(level=level, type_=type_)
+
+        # the original solvers are no longer reached through the points
+        for solver in self._point_solvers.values():
+            solver._set_solver_print(level=level, type_=type_)
+
+    def _solve(self):
+        """
+        Run the iterative solver, falling back to the solvers of the points on a failure.
+        """
+        system = self._system()
+        outputs = system._outputs.asarray(copy=True)
+
+        try:
+            super()._solve()
+        except om.AnalysisError:
+            if not self.options['point_fallback'] or not self._point_solvers:
+                raise
+
+            system._outputs.set_val(outputs)
+            self._solve_points()
+
+    def _solve_points(self):
+        """
+        Solve the subsystems one after another, the stacked points with their own solvers.
+        """
+        system = self._system()
+        for subsys in system._subsystems_myproc:
+            system._transfer('nonlinear', 'fwd', subsys.name)
+            solver = self._point_solvers.get(subsys.name)
+            if solver is None:
+                subsys._solve_nonlinear()
+            else:
+                # with the restart from the successful outputs of the point, if enabled
+                solver._solve_with_cache_check()
+
+
+def get_structure(system):
+    """
+    Return a hashable description of the structure of a system.
+
+    Two systems with the same structure have the same class and the same outputs (relative names
+    and shapes) in the same order.
+
+    Parameters
+    ----------
+    system : System
+        System whose structure is returned.
+
+    Returns
+    -------
+    tuple
+        Class name and tuple of (relative output name, shape) pairs.
+    """
+    meta = system.get_io_metadata(iotypes='output', metadata_keys=['shape'])
+    return (type(system).__name__, tuple((name, str(m['shape'])) for name, m in meta.items()))
+
+
+def find_identical_points(group, points=None):
+    """
+    Group the subsystems of a group by structure.
+
+    Parameters
+    ----------
+    group : Group
+        Multipoint group.
+    points : list of str or None
+        Names of the candidate subsystems. None uses all the subsystems that have a nonlinear
+        solver other than NonlinearRunOnce.
+
+    Returns
+    -------
+    list of list of str
+        Names of the subsystems with identical structure, one list per structure, in the order
+        in which the subsystems were added.
+    """
+    if points is None:
+        points = [s.name for s in group.system_iter(recurse=False)
+                  if s.nonlinear_solver is not None and
+                  not isinstance(s.nonlinear_solver, om.NonlinearRunOnce)]
+
+    stacks = {}
+    for name in points:
+        structure = get_structure(getattr(group, name))
+        stacks.setdefault(structure, []).append(name)
+
+    return list(stacks.values())
+
+
+def stack_points(group, points=None):
+    """
+    Solve the structurally identical points of a multipoint group together.
+
+    This must be called from the configure method of the group, after the points have set their
+    own solvers. Stacks of a single point are left unchanged. If the group already has a
+    NewtonSolver, it is kept and there is no fallback to the solvers of the points.
+
+    Parameters
+    ----------
+    group : Group
+        Multipoint group, e.g. a pyCycle MPCycle.
+    points : list of str or None
+        Names of the candidate points. None uses all the subsystems that have a nonlinear solver
+        other than NonlinearRunOnce.
+
+    Returns
+    -------
+    list of list of str
+        Names of the stacked points, one list per stack.
+    """
+    stacked = [names for names in find_identical_points(group, points) if len(names) > 1]
+    if not stacked:
+        return stacked
+
+    first = getattr(group, stacked[0][0]).nonlinear_solver
+
+    newton = group.nonlinear_solver
+    if not isinstance(newton, om.NewtonSolver):
+        newton = group.nonlinear_solver = StackedNewtonSolver()
+        # only the convergence options are copied from the first point, the archive options
+        # (and its files) stay with the solver of the point
+        for name in _CONVERGENCE_OPTIONS:
+            if name in first.options:
+                newton.options[name] = first.options[name]
+        if isinstance(first, om.NewtonSolver):
+            # a copy, since the original line search stays with the solver of the point
+            newton.linesearch = deepcopy(first.linesearch)
+
+    # the points must be converged by the group solver, each one evaluated once per iteration
+    newton.options['solve_subsystems'] = True
+
+    for names in stacked:
+        for name in names:
+            point = getattr(group, name)
+            if isinstance(newton, StackedNewtonSolver):
+                newton._point_solvers[name] = point.nonlinear_solver
+            point.nonlinear_solver = om.NonlinearRunOnce()
+
+    # the default LinearRunOnce cannot solve the Newton system, a configured solver is kept
+    if group.linear_solver is None or type(group.linear_solver) is om.LinearRunOnce:
+        group.linear_solver = om.DirectSolver(assemble_jac=True)
+
+    return stacked
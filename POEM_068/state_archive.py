@@ -0,0 +1,465 @@
+"""Archive of converged output vectors used by the POEM_068 prototype solver.
+
+The POEM_068 output cache only holds the outputs of the last successful solve. The archive keeps
+the outputs of several successful solves, each keyed by the values of the variables that define
+the design point of the solved system (by default, its inputs connected from outside of it).
+On a restart, the solver starts from the archived outputs whose key is nearest to the current
+design point.
+
+Keys and outputs are stored as rows of two preallocated 2-D arrays, so the nearest entry is found
+with a single vectorized distance computation. Each component of the key difference is divided by
+the magnitude of the current key (plus one), so that variables of very different magnitudes (e.g.
+an altitude in ft and a Mach number) contribute comparably to the distance. When the archive is
+full, the least recently used entry is evicted.
+
+SharedStateArchive keeps the same arrays in a memory-mapped .npy file, so that the processes
+evaluating the same model (e.g. the workers of a process pool running a DOE) share their
+converged outputs: each process maps the file and reads the archived outputs directly from the
+mapping, without (de)serializing them. Placing the file in /dev/shm keeps it in a shared-memory
+segment. Updates and lookups are serialized between processes with a lock file (on systems that
+provide fcntl, a warning is issued otherwise). The file is stamped with an identifier of the
+model, and a file with another stamp (e.g. left by a previous run of a different model) is
+replaced instead of being read.
+"""
+
+import os
+import warnings
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class StateArchive(object):
+    """
+    Store converged output vectors keyed by design points and return the nearest one.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of archived output vectors.
+    dist_tol : float
+        Scaled distance below which a new key replaces the archived entry instead of adding one.
+
+    Attributes
+    ----------
+    _size : int
+        Maximum number of archived output vectors.
+    _dist_tol : float
+        Scaled distance below which two keys are considered identical.
+    _count : int
+        Number of archived output vectors.
+    _keys : ndarray or None
+        Archived keys, one per row.
+    _outputs : ndarray or None
+        Archived output vectors, one per row.
+    _tick : int
+        Counter incremented on every add or lookup, used to order entries by last use.
+    _last_used : ndarray or None
+        Value of _tick when each entry was last added or returned.
+    """
+
+    def __init__(self, size=8, dist_tol=1e-12):
+        """
+        Initialize attributes.
+        """
+        if size < 1:
+            raise ValueError(f"The size of a state archive must be positive, got {size}.")
+
+        self._size = int(size)
+        self._dist_tol = dist_tol
+        self._count = 0
+        self._keys = None
+        self._outputs = None
+        self._tick = 0
+        self._last_used = None
+
+    def __len__(self):
+        """
+        Return the number of archived output vectors.
+
+        Returns
+        -------
+        int
+            Number of archived output vectors.
+        """
+        return self._count
+
+    def clear(self):
+        """
+        Remove all archived output vectors, keeping the allocated storage.
+        """
+        self._count = 0
+
+    def _distances(self, key):
+        """
+        Return the scaled distances between a key and the archived keys.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the design point.
+
+        Returns
+        -------
+        ndarray
+            Scaled distance to each archived key.
+        """
+        diff = (self._keys[:self._count] - key) / (np.abs(key) + 1.0)
+        return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def distance(self, key0, key1):
+        """
+        Return the scaled distance between two keys, as used for the archived keys.
+
+        Parameters
+        ----------
+        key0 : ndarray
+            Key from which the distance is measured (used for scaling).
+        key1 : ndarray
+            Other key.
+
+        Returns
+        -------
+        float
+            Scaled distance.
+        """
+        return np.linalg.norm((key1 - key0) / (np.abs(key0) + 1.0))
+
+    def _allocate(self, key_size, output_size):
+        """
+        Allocate an empty storage for keys and outputs of the given sizes.
+
+        Parameters
+        ----------
+        key_size : int
+            Size of the keys.
+        output_size : int
+            Size of the output vectors.
+        """
+        self._keys = np.empty((self._size, key_size))
+        self._outputs = np.empty((self._size, output_size))
+        self._last_used = np.zeros(self._size)
+        self._count = 0
+
+    def add(self, key, outputs):
+        """
+        Archive the converged outputs of a design point.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the design point.
+        outputs : ndarray
+            Converged output vector. It is copied.
+        """
+        key = np.asarray(key, dtype=float).ravel()
+
+        if self._keys is None or self._keys.shape[1] != key.size or \
+                self._outputs.shape[1] != outputs.size:
+            # first entry, or the sizes changed after a new setup
+            self._allocate(key.size, outputs.size)
+
+        self._tick += 1
+
+        if self._count > 0:
+            dist = self._distances(key)
+            idx = np.argmin(dist)
+            if dist[idx] <= self._dist_tol:
+                # same design point, keep the latest outputs
+                self._outputs[idx] = outputs
+                self._last_used[idx] = self._tick
+                return
+
+        if self._count < self._size:
+            idx = self._count
+            self._count += 1
+        else:
+            idx = np.argmin(self._last_used)
+
+        self._keys[idx] = key
+        self._outputs[idx] = outputs
+        self._last_used[idx] = self._tick
+
+    def nearest(self, key):
+        """
+        Return the archived outputs whose key is nearest to a design point.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the design point.
+
+        Returns
+        -------
+        ndarray or None
+            Archived outputs (not a copy), or None if the archive is empty or the key size does
+            not match.
+        float
+            Scaled distance to the design point, or inf if no outputs are returned.
+        """
+        key = np.asarray(key, dtype=float).ravel()
+        if self._count == 0 or self._keys.shape[1] != key.size:
+            return None, np.inf
+
+        dist = self._distances(key)
+        idx = np.argmin(dist)
+
+        self._tick += 1
+        self._last_used[idx] = self._tick
+
+        return self._outputs[idx], dist[idx]
+
+    def close(self):
+        """
+        Release the storage of the archive.
+        """
+        self._keys = self._outputs = self._last_used = None
+        self._count = 0
+
+
+class SharedStateArchive(StateArchive):
+    """
+    State archive stored in a memory-mapped file shared between processes.
+
+    The file holds a (size + 1)-by-(1 + key size + output size) float array (with at least 5
+    columns). The first row is a header with the use counter, the number of entries, the key and
+    output sizes and the stamp, and each other row holds the last use, the key and the outputs of
+    one entry. The file is recreated (and replaced atomically, so that the processes still mapping
+    the old file are not affected) when the key or output sizes or the stamp change.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the memory-mapped file. It is created if it does not exist.
+    size : int
+        Maximum number of archived output vectors, used when the file is created.
+    dist_tol : float
+        Scaled distance below which a new key replaces the archived entry instead of adding one.
+    archive_id : str
+        Identifier of the model stamped in the file. A file with another stamp is not read.
+
+    Attributes
+    ----------
+    _filename : str
+        Path of the memory-mapped file.
+    _stamp : float
+        Checksum of archive_id stored in the file header.
+    _table : memmap or None
+        Mapped content of the file.
+    _inode : int or None
+        Inode of the mapped file, used to detect that another process replaced it.
+    _lock_file : file or None
+        Open lock file.
+    """
+
+    def __init__(self, filename, size=8, dist_tol=1e-12, archive_id=''):
+        """
+        Initialize attributes.
+        """
+        if fcntl is None:
+            warnings.warn(f"fcntl is not available, so the updates of the shared state archive "
+                          f"'{filename}' are not serialized between processes.", RuntimeWarning)
+
+        self._filename = filename
+        self._stamp = float(zlib.crc32(archive_id.encode()))
+        self._table = None
+        self._inode = None
+        self._lock_file = None
+        super().__init__(size, dist_tol)
+
+    # the counters live in the header of the file so that all processes see the same values
+    @property
+    def _count(self):
+        """
+        Return the number of archived output vectors.
+
+        Returns
+        -------
+        int
+            Number of archived output vectors.
+        """
+        return 0 if self._table is None else int(self._table[0, 1])
+
+    @_count.setter
+    def _count(self, value):
+        if self._table is not None:
+            self._table[0, 1] = value
+
+    @property
+    def _tick(self):
+        """
+        Return the use counter.
+
+        Returns
+        -------
+        int
+            Use counter.
+        """
+        return 0 if self._table is None else int(self._table[0, 0])
+
+    @_tick.setter
+    def _tick(self, value):
+        if self._table is not None:
+            self._table[0, 0] = value
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold an exclusive lock on the archive file and map its current version.
+
+        Yields
+        ------
+        None
+        """
+        if fcntl is None:
+            self._attach()
+            yield
+            return
+
+        if self._lock_file is None:
+            self._lock_file = open(self._filename + '.lock', 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            self._attach()
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _attach(self):
+        """
+        Map the archive file if it exists and was not mapped yet or was replaced.
+        """
+        try:
+            inode = os.stat(self._filename).st_ino
+        except FileNotFoundError:
+            return
+
+        if inode != self._inode:
+            table = np.load(self._filename, mmap_mode='r+')
+            if table.shape[1] < 5 or table[0, 4] != self._stamp:
+                # written for another model, it is replaced by the next add
+                self._detach()
+            else:
+                self._set_table(table, inode)
+
+    def _detach(self):
+        """
+        Drop the mapping of the archive file.
+        """
+        self._table = self._inode = None
+        self._keys = self._outputs = self._last_used = None
+
+    def _set_table(self, table, inode):
+        """
+        Point the archive arrays to a mapped table.
+
+        Parameters
+        ----------
+        table : memmap
+            Mapped content of the archive file.
+        inode : int
+            Inode of the archive file.
+        """
+        key_size = int(table[0, 2])
+        output_size = int(table[0, 3])
+        self._table = table
+        self._inode = inode
+        self._size = table.shape[0] - 1
+        self._last_used = table[1:, 0]
+        self._keys = table[1:, 1:1 + key_size]
+        self._outputs = table[1:, 1 + key_size:1 + key_size + output_size]
+
+    def _allocate(self, key_size, output_size):
+        """
+        Create an empty archive file for keys and outputs of the given sizes.
+
+        Parameters
+        ----------
+        key_size : int
+            Size of the keys.
+        output_size : int
+            Size of the output vectors.
+        """
+        tmpname = f'{self._filename}.{os.getpid()}.tmp'
+        ncols = max(1 + key_size + output_size, 5)
+        table = np.lib.format.open_memmap(tmpname, mode='w+', dtype=float,
+                                          shape=(self._size + 1, ncols))
+        table[0, 2] = key_size
+        table[0, 3] = output_size
+        table[0, 4] = self._stamp
+        table.flush()
+        os.replace(tmpname, self._filename)
+        self._set_table(table, os.stat(self._filename).st_ino)
+
+    def __len__(self):
+        """
+        Return the number of archived output vectors, over all processes sharing the file.
+
+        Returns
+        -------
+        int
+            Number of archived output vectors.
+        """
+        with self._locked():
+            return self._count
+
+    def clear(self):
+        """
+        Remove all archived output vectors, for all processes sharing the file.
+        """
+        with self._locked():
+            super().clear()
+
+    def add(self, key, outputs):
+        """
+        Archive the converged outputs of a design point.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the design point.
+        outputs : ndarray
+            Converged output vector. It is copied into the file.
+        """
+        with self._locked():
+            super().add(key, outputs)
+
+    def nearest(self, key):
+        """
+        Return the archived outputs whose key is nearest to a design point.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the design point.
+
+        Returns
+        -------
+        ndarray or None
+            Read-only view of the archived outputs in the mapped file (not a copy), or None if
+            the archive is empty or the key size does not match. Another process may overwrite
+            the entry later, so it should be copied right away, e.g. into the output vector.
+        float
+            Scaled distance to the design point, or inf if no outputs are returned.
+        """
+        with self._locked():
+            outputs, dist = super().nearest(key)
+            if outputs is not None:
+                outputs = outputs.view()
+                outputs.flags.writeable = False
+            return outputs, dist
+
+    def close(self):
+        """
+        Drop the mapping and close the lock file. The archive file is kept for other processes.
+        """
+        self._detach()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
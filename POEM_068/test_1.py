@@ -1,6 +1,9 @@
 import openmdao.api as om
 import numpy as np
 
+# import the profiler of the solver hierarchy
+from solver_profiler import SolverProfiler
+
 
 class SubComp1(om.ExplicitComponent):
     def setup(self):
@@ -93,6 +96,9 @@ prob.set_solver_print(level=2, depth=1)
 prob.set_val("simple.coupling.sub_comp1.a", val=5.0)
 prob.set_val("simple.coupling.sub_comp2.b", val=10.0)
 
+profiler = SolverProfiler(prob)
+profiler.start()
+
 prob.run_model()
 
 prob.model.list_outputs()
@@ -108,3 +114,7 @@ except om.AnalysisError:
     prob.run_model()
 
 prob.model.list_outputs()
+
+profiler.stop()
+print(profiler)
+profiler.write_flamegraph("test_1_solvers.folded")
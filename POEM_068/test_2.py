@@ -1,10 +1,15 @@
 # Standard Python modules
 import sys
+import time
 
 # External modules
 import openmdao.api as om
 import pycycle.api as pyc
 
+# import custom Newton solver with the restart archive prototype
+from newton_custom import NewtonSolverCustom
+from stacked_points import stack_points
+
 
 class HBTF(pyc.Cycle):
     def initialize(self):
@@ -205,7 +210,7 @@ class HBTF(pyc.Cycle):
         self.pyc_connect_flow("bld3.cool4", "hpt.cool4", connect_stat=False)
 
         # Specify solver settings:
-        newton = self.nonlinear_solver = om.NewtonSolver()
+        newton = self.nonlinear_solver = NewtonSolverCustom()
         newton.options["atol"] = 1e-8
 
         # set this very small, so it never activates and we rely on atol
@@ -217,6 +222,7 @@ class HBTF(pyc.Cycle):
         newton.options["reraise_child_analysiserror"] = False
         newton.options["restart_from_successful"] = True
         newton.options["err_on_non_converge"] = True
+        newton.options["archive_size"] = 8
         ls = newton.linesearch = om.ArmijoGoldsteinLS()
         ls.options["maxiter"] = 3
         ls.options["rho"] = 0.75
@@ -301,6 +307,10 @@ def viewer(prob, pt, file=sys.stdout):
 
 
 class MPhbtf(pyc.MPCycle):
+    def initialize(self):
+        self.options.declare("stacked", default=True, types=bool, desc="Solve the off-design points together")
+        super().initialize()
+
     def setup(self):
 
         self.pyc_add_pnt("TOC", HBTF(thermo_method="TABULAR"))  # Create an instace of the High Bypass ratio Turbofan
@@ -326,6 +336,25 @@ class MPhbtf(pyc.MPCycle):
         self.set_input_defaults("TOC.LP_Nmech", 4666.1, units="rpm")
         self.set_input_defaults("TOC.HP_Nmech", 14705.7, units="rpm")
 
+        # --- Setup off-design points, solved together by stack_points ---
+        self.od_pts = ["OD_full_pwr", "OD_part_pwr"]
+        self.od_MNs = [0.8, 0.8]
+        self.od_alts = [35000.0, 35000.0]
+        self.od_T4s = [2850.0, 2700.0]
+
+        for i, pt in enumerate(self.od_pts):
+            self.pyc_add_pnt(pt, HBTF(design=False, thermo_method="TABULAR"))
+
+            self.set_input_defaults(pt + ".fc.MN", val=self.od_MNs[i])
+            self.set_input_defaults(pt + ".fc.alt", self.od_alts[i], units="ft")
+            self.set_input_defaults(pt + ".balance.rhs:FAR", self.od_T4s[i], units="degR")
+
+        # the off-design points take their areas and map scalars from the design point
+        self.pyc_use_default_des_od_conns()
+
+        self.pyc_connect_des_od("core_nozz.Throat:stat:area", "balance.rhs:W")
+        self.pyc_connect_des_od("byp_nozz.Throat:stat:area", "balance.rhs:BPR")
+
         # --- Set up bleed values -----
         self.pyc_add_cycle_param("inlet.ram_recovery", 0.9990)
         self.pyc_add_cycle_param("duct4.dPqP", 0.0048)
@@ -356,11 +385,20 @@ class MPhbtf(pyc.MPCycle):
 
         super().setup()
 
+    def configure(self):
+        super().configure()
+
+        # solve the points with identical structure (the off-design HBTF points) together
+        if self.options["stacked"]:
+            stack_points(self)
 
-if __name__ == "__main__":
 
+def run_points(stacked):
+    """
+    Run the multipoint model and return the problem, the wall time and the Newton iterations
+    """
     prob = om.Problem()
-    model = prob.model = MPhbtf()
+    prob.model = MPhbtf(stacked=stacked)
 
     prob.setup()
 
@@ -383,10 +421,42 @@ if __name__ == "__main__":
     # --- Design point initial guesses ---
     prob["TOC.balance.FAR"] = 0.025
 
+    # --- Off-design point initial guesses ---
+    for pt in prob.model.od_pts:
+        prob[pt + ".balance.FAR"] = 0.02467
+        prob[pt + ".balance.W"] = 300.0
+        prob[pt + ".balance.BPR"] = 5.105
+        prob[pt + ".balance.lp_Nmech"] = 5000.0
+        prob[pt + ".balance.hp_Nmech"] = 15000.0
+        prob[pt + ".hpt.PR"] = 3.0
+        prob[pt + ".lpt.PR"] = 4.0
+        prob[pt + ".fan.map.RlineMap"] = 2.0
+        prob[pt + ".lpc.map.RlineMap"] = 2.0
+        prob[pt + ".hpc.map.RlineMap"] = 2.0
+
     prob.set_solver_print(level=-1)
-    prob.set_solver_print(level=2, depth=2)
 
+    start = time.perf_counter()
     prob.run_model()
+    elapsed = time.perf_counter() - start
+
+    # Newton iterations of each point, and of the multipoint group when the points are stacked
+    iters = {pt: prob.model._get_subsystem(pt).nonlinear_solver._iter_count for pt in ["TOC"] + prob.model.od_pts}
+    iters["model"] = prob.model.nonlinear_solver._iter_count
+
+    return prob, elapsed, iters
+
+
+if __name__ == "__main__":
+
+    # --- Compare the wall time and iterations of the sequential and stacked off-design points ---
+    for stacked in [False, True]:
+        prob, elapsed, iters = run_points(stacked)
+        print("stacked" if stacked else "unstacked", f"{elapsed:.3f} s", iters, flush=True)
+        for pt in prob.model.od_pts:
+            print(f"  {pt}: Fn = {prob.get_val(pt + '.perf.Fn')[0]:.3f}, TSFC = {prob.get_val(pt + '.perf.TSFC')[0]:.6f}")
+
+    prob.set_solver_print(level=2, depth=2)
 
     prob.set_val("TOC.splitter.BPR", -1.0)
     try:
@@ -0,0 +1,90 @@
+import tempfile
+
+import numpy as np
+import openmdao.api as om
+
+# import custom Newton solver with the restart archive prototype
+from newton_custom import NewtonSolverCustom
+
+
+class CubicComp(om.ImplicitComponent):
+    def setup(self):
+        self.add_input("a")
+        self.add_output("y", val=1.0, lower=0.0)
+
+        self.declare_partials("y", ["a", "y"])
+
+    def apply_nonlinear(self, inputs, outputs, residuals):
+        y = outputs["y"]
+        residuals["y"] = y**3 + y - inputs["a"]
+
+    def linearize(self, inputs, outputs, partials):
+        partials["y", "y"] = 3.0 * outputs["y"] ** 2 + 1.0
+        partials["y", "a"] = -1.0
+
+
+class CubicGroup(om.Group):
+    def initialize(self):
+        self.options.declare("solver_options", types=dict, default={})
+
+    def setup(self):
+        self.add_subsystem("cubic", CubicComp(), promotes=["*"])
+
+        newton = self.nonlinear_solver = NewtonSolverCustom(**self.options["solver_options"])
+        newton.options["atol"] = 1e-12
+        newton.options["rtol"] = 1e-99
+        newton.options["maxiter"] = 20
+        newton.options["err_on_non_converge"] = True
+        newton.options["solve_subsystems"] = False
+        newton.linesearch = om.BoundsEnforceLS()
+        self.linear_solver = om.DirectSolver()
+
+
+def build(**solver_options):
+    prob = om.Problem()
+    prob.model.add_subsystem("point", CubicGroup(solver_options=solver_options))
+    prob.setup()
+    prob.set_solver_print(level=-1)
+    return prob
+
+
+def solve_at(prob, a):
+    prob.set_val("point.a", a)
+    prob.run_model()
+    y = prob.get_val("point.y")[0]
+    assert abs(y**3 + y - a) < 1e-9, (a, y)
+    return prob.model.point.nonlinear_solver._iter_count
+
+
+# --- Consecutive solves with the restart from successful outputs and the archive ---
+for archive_dir in [None, tempfile.mkdtemp()]:
+    prob = build(restart_from_successful=True, archive_size=4, archive_dir=archive_dir)
+
+    solve_at(prob, 2.0)
+    solve_at(prob, 10.0)
+
+    # a failed solve, then a restart from the archived outputs nearest to the design point
+    prob.model.point.nonlinear_solver.options["maxiter"] = 2
+    try:
+        solve_at(prob, 500.0)
+    except om.AnalysisError:
+        pass
+    else:
+        raise AssertionError("the solve with maxiter=2 should have failed")
+
+    prob.model.point.nonlinear_solver.options["maxiter"] = 20
+    solve_at(prob, 10.5)
+
+    solver = prob.model.point.nonlinear_solver
+    assert solver._restarted and isinstance(solver._output_cache, np.ndarray)
+    print("restart", "shared" if archive_dir else "local", "archive: ok,", len(solver._archive), "entries")
+
+# --- Solves along a path with the secant predictor ---
+iters = {}
+for predictor in [None, "secant"]:
+    prob = build(predictor=predictor)
+    iters[predictor] = [solve_at(prob, a) for a in np.linspace(2.0, 4.0, 6)]
+
+print("Newton iterations without predictor:", iters[None])
+print("Newton iterations with secant predictor:", iters["secant"])
+assert sum(iters["secant"][2:]) < sum(iters[None][2:])
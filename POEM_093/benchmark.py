@@ -0,0 +1,214 @@
+"""
+Benchmark of the linear solution caching prototype on the OpenAeroStruct examples.
+
+The models of example1.py (min CD0 + CD1 s.t. CL constraints) and example2.py (min fuel burn
+s.t. L=W at each point) are built with their build_model functions for a configurable mesh size
+and number of flight points, and `compute_totals` is timed for every combination of:
+
+- the example (--examples)
+- the custom linear solver of the coupled groups, DirectSolverCustom or PETScKrylovCustom
+  (--solvers)
+- use_cache on and off (--cache)
+- the mesh size (--nx, --ny)
+- the number of flight points (--num-points)
+
+The flight conditions of the points are interpolated between the cruise and maneuver conditions
+of the examples, so 2 points give back the original models.
+
+Each case runs in its own process so that the peak memory and the solver statistics are not
+polluted by the other cases. The wall times, the solve counts and cache hit rate of the custom
+solvers (summed over the points) and the peak memory of each case are written to a JSON file:
+
+    python benchmark.py --solvers direct krylov --cache on off --ny 21 41 --num-points 2 4
+
+Use --repeat to run each case several times.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+# Statistics of the custom solvers that are summed over the points.
+STATS_KEYS = ['num_solves', 'num_misses', 'num_factorizations', 'num_iterations',
+              'factor_time', 'solve_time', 'cache_time']
+
+
+def build_problem(example, nx, ny, num_points, solver, use_cache):
+    """
+    Build the problem of example1.py or example2.py.
+
+    Parameters
+    ----------
+    example : int
+        1 or 2, the example to build.
+    nx : int
+        Number of chordwise nodal points.
+    ny : int
+        Number of spanwise nodal points for the half-span.
+    num_points : int
+        Number of flight points, at least 2.
+    solver : str
+        Linear solver of the coupled groups, 'direct' or 'krylov'.
+    use_cache : bool
+        Value of the use_cache option of the linear solvers.
+
+    Returns
+    -------
+    Problem
+        The problem, after setup.
+    list of LinearSolver
+        Linear solvers of the coupled groups.
+    """
+    # imported here so that only the process running the case loads OpenAeroStruct
+    import openmdao.api as om
+
+    import example1
+    import example2
+
+    build_model = {1: example1.build_model, 2: example2.build_model}[example]
+
+    prob = om.Problem()
+    point_names = build_model(prob.model, nx=nx, ny=ny, num_points=num_points)
+    prob.setup(mode="rev", check=False)
+
+    linear_solvers = example1.set_linear_solvers(prob, point_names, solver=solver,
+                                                 use_cache=use_cache, iprint=0)
+
+    return prob, linear_solvers
+
+
+def run_case(case):
+    """
+    Run one benchmark case in the current process.
+
+    Parameters
+    ----------
+    case : dict
+        Keyword arguments of build_problem.
+
+    Returns
+    -------
+    dict
+        The case, followed by the wall times, the solver statistics summed over the points and
+        the peak memory.
+    """
+    time0 = time.perf_counter()
+    prob, linear_solvers = build_problem(**case)
+    time1 = time.perf_counter()
+    prob.run_model()
+    time2 = time.perf_counter()
+    prob.compute_totals()
+    time3 = time.perf_counter()
+
+    result = dict(case)
+    result['setup_time'] = time1 - time0
+    result['run_model_time'] = time2 - time1
+    result['compute_totals_time'] = time3 - time2
+
+    all_stats = [linear_solver.stats.get_stats() for linear_solver in linear_solvers]
+    for key in STATS_KEYS:
+        result[key] = sum(stats[key] for stats in all_stats)
+    result['num_hits'] = {kind: sum(stats['num_hits'][kind] for stats in all_stats)
+                          for kind in all_stats[0]['num_hits']}
+    num_hits = sum(result['num_hits'].values())
+    result['hit_rate'] = num_hits / result['num_solves'] if result['num_solves'] else 0.0
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_memory_mb'] = maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+    return result
+
+
+def get_metadata():
+    """
+    Return the versions and platform information stored with the results.
+
+    Returns
+    -------
+    dict
+        Metadata.
+    """
+    metadata = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+    }
+    for package in ['scipy', 'openmdao', 'openaerostruct', 'petsc4py']:
+        try:
+            metadata[package] = __import__(package).__version__
+        except ImportError:
+            metadata[package] = None
+    return metadata
+
+
+def main(argv=None):
+    """
+    Run the benchmark sweep and write the results.
+
+    Parameters
+    ----------
+    argv : list of str or None
+        Command line arguments. Default is sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--examples', type=int, nargs='+', default=[1, 2], choices=[1, 2])
+    parser.add_argument('--solvers', nargs='+', default=['direct', 'krylov'],
+                        choices=['direct', 'krylov'])
+    parser.add_argument('--cache', nargs='+', default=['off', 'on'], choices=['off', 'on'])
+    parser.add_argument('--nx', type=int, nargs='+', default=[3])
+    parser.add_argument('--ny', type=int, nargs='+', default=[21])
+    parser.add_argument('--num-points', type=int, nargs='+', default=[2])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file in which the results are written.')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # run a single case in this (child) process and print the result as the last line
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    if min(args.num_points) < 2:
+        parser.error('--num-points must be at least 2')
+
+    results = []
+    for example, solver, cache, nx, ny, num_points in itertools.product(
+            args.examples, args.solvers, args.cache, args.nx, args.ny, args.num_points):
+        case = {'example': example, 'nx': nx, 'ny': ny, 'num_points': num_points,
+                'solver': solver, 'use_cache': cache == 'on'}
+
+        for repeat in range(args.repeat):
+            print('running', case, 'repeat', repeat, flush=True)
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                   '--case', json.dumps(case)],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  capture_output=True, text=True)
+            if proc.returncode == 0:
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+            else:
+                result = dict(case)
+                result['error'] = proc.stderr.strip().splitlines()[-1:]
+                print('    failed:', *result['error'])
+            result['repeat'] = repeat
+            results.append(result)
+
+    with open(args.output, 'w') as f:
+        json.dump({'metadata': get_metadata(), 'results': results}, f, indent=2)
+    print('results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
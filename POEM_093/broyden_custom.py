@@ -0,0 +1,105 @@
+"""BroydenSolver that keeps the inverse Jacobian as an operator.
+Modified for the POEM_093 prototype. The modifications can be found by searching for the
+"EDIT-INV" comments in this file.
+
+OpenMDAO's BroydenSolver asks its linear solver for a dense inverse Jacobian and applies the
+Broyden updates to it in place. With a DirectSolverCustom linear solver whose inverse_operator
+option is True, this solver instead keeps the inverse as a LinearOperator backed by the LU
+factors, and applies each Broyden update as a rank-one term of the operator, so that no n x n
+array is formed:
+
+    self.nonlinear_solver = BroydenSolverCustom()
+    self.linear_solver = DirectSolverCustom(inverse_operator=True)
+
+Under complex step, the dense inverse is used, as in BroydenSolver.
+"""
+
+import numpy as np
+
+from openmdao.solvers.nonlinear.broyden import BroydenSolver
+
+from direct_custom import DirectSolverCustom
+
+
+class BroydenSolverCustom(BroydenSolver):
+    """
+    Broyden solver that applies its updates as low-rank terms of an inverse Jacobian operator.
+
+    Parameters
+    ----------
+    **kwargs : dict
+        Options dictionary.
+    """
+
+    # EDIT-INV
+    def _setup_solvers(self, system, depth):
+        """
+        Assign system instance, set depth, and optionally perform setup.
+
+        Parameters
+        ----------
+        system : <System>
+            Pointer to the owning system.
+        depth : int
+            Depth of the current system (already incremented).
+        """
+        try:
+            super()._setup_solvers(system, depth)
+        except ValueError as err:
+            # BroydenSolver only accepts a DirectSolver when solving the full model, but
+            # DirectSolverCustom also provides _inverse. The check is the last step of the setup.
+            if not (self._full_inverse and isinstance(self.linear_solver, DirectSolverCustom)
+                    and 'Linear solver must be DirectSolver' in str(err)):
+                raise
+
+    # EDIT-INV
+    def _iter_initialize(self):
+        """
+        Perform any necessary pre-processing operations.
+
+        Returns
+        -------
+        float
+            Initial relative error in the user-specified residuals.
+        float
+            Initial absolute error in the user-specified residuals.
+        """
+        # The inverse Jacobian is converted to complex under complex step, which the operator
+        # does not support, so it is formed as a dense array.
+        if self._system().under_complex_step and hasattr(self.Gm, 'rank_one_update'):
+            self.Gm = self.Gm.dot(np.eye(self.size))
+
+        return super()._iter_initialize()
+
+    # EDIT-INV
+    def _update_inverse_jacobian(self):
+        """
+        Update the inverse Jacobian for a new Broyden iteration.
+
+        When the inverse Jacobian is an operator of DirectSolverCustom, the (second method)
+        Broyden update Gm + (dx - Gm dfx) dfx^T / ||dfx||^2 is added as a rank-one term instead
+        of updating a dense array.
+
+        Returns
+        -------
+        ndarray or LinearOperator
+            Updated inverse Jacobian.
+        """
+        Gm = self.Gm
+
+        # A new Jacobian is computed (and factored) by the base class, which also handles dense
+        # inverse Jacobians.
+        if self._recompute_jacobian or not self.options['update_broyden'] or \
+                not hasattr(Gm, 'rank_one_update'):
+            return super()._update_inverse_jacobian()
+
+        dfxm = self.delta_fxm
+        fact = np.linalg.norm(dfxm)
+
+        # Sometimes you can get stuck, particularly when enforcing bounds in a linesearch.
+        # Make sure we don't update in this case because of divide by zero.
+        if fact > self.options['atol']:
+            dxm = self.delta_xm
+            Gm = Gm.rank_one_update(dxm - Gm.dot(dfxm), dfxm / fact ** 2)
+
+        return Gm
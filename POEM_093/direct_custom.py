@@ -1,6 +1,18 @@
 """LinearSolver that uses linalg.solve or LU factor/solve.
-Modified to use solution caching.
-The modifications can be found by searching for "EDIT-CACHE" comments in this file.
+Modified for the POEM_093 prototype. The modifications can be found by searching for the
+following comments in this file:
+
+- "EDIT-CACHE": solution caching.
+- "EDIT-BLOCK": solve for multiple right-hand sides at once.
+- "EDIT-COLOR": build the matrix with a column coloring when there is no assembled jacobian.
+- "EDIT-LAG": reuse (lag) the LU factors while the matrix barely changes.
+- "EDIT-ORDER": reuse the fill-reducing ordering of sparse matrices.
+- "EDIT-STATS": counters and timers of the solves, cache hits and factorizations.
+- "EDIT-DIAG": diagnose singular sparse matrices without converting them to dense, and map
+  matrix rows to variables with precomputed offsets.
+- "EDIT-INV": return the inverse Jacobian as an operator backed by the LU factors.
+- "EDIT-BUILD": build the matrix with the seeds set in place in the linear vector.
+- "EDIT-MIXED": factor in single precision and refine the solutions in double precision.
 """
 
 import warnings
@@ -11,13 +23,354 @@ import scipy.sparse.linalg
 from scipy.sparse import csc_matrix
 
 from openmdao.solvers.solver import LinearSolver
-from openmdao.matrices.dense_matrix import DenseMatrix
-from openmdao.utils.array_utils import identity_column_iter
 
 import time
 
+from solution_cache import SolutionCache, CACHE_MODES, get_unscale_factors
+from solver_stats import SolverStats
 
-def index_to_varname(system, loc):
+
+# EDIT-ORDER
+class _OrderedSparseLU(object):
+    """
+    Sparse LU factorization that reuses a fill-reducing column ordering.
+
+    scipy's SuperLU interface does not separate the symbolic and numeric factorizations, so the
+    column ordering computed by the first splu call is cached with the column-permuted sparsity
+    structure. Later matrices with the same sparsity pattern are permuted with a single gather
+    of their data and factored with the 'NATURAL' ordering, which skips the ordering step.
+
+    Parameters
+    ----------
+    matrix : csc_matrix
+        Matrix whose sparsity pattern is cached.
+    perm_c : ndarray
+        Column permutation returned by splu for matrix.
+
+    Attributes
+    ----------
+    _indptr : ndarray
+        Index pointer of the original sparsity pattern.
+    _indices : ndarray
+        Row indices of the original sparsity pattern.
+    _order : ndarray
+        Column order, such that the permuted matrix is matrix[:, _order].
+    _perm_indptr : ndarray
+        Index pointer of the permuted sparsity pattern.
+    _perm_indices : ndarray
+        Row indices of the permuted sparsity pattern.
+    _data_idx : ndarray
+        Indices of the original data for each nonzero of the permuted matrix.
+    _lu : SuperLU or None
+        Factorization of the permuted matrix.
+    """
+
+    def __init__(self, matrix, perm_c):
+        """
+        Compute the permuted sparsity structure.
+        """
+        self._indptr = matrix.indptr.copy()
+        self._indices = matrix.indices.copy()
+        self._order = np.argsort(perm_c)
+
+        # Permute a matrix holding the (1-based) position of each nonzero to find the gather
+        # indices of the data.
+        pos = csc_matrix((np.arange(1, matrix.nnz + 1), matrix.indices, matrix.indptr),
+                         shape=matrix.shape)[:, self._order]
+        self._perm_indptr = pos.indptr
+        self._perm_indices = pos.indices
+        self._data_idx = pos.data - 1
+        self._lu = None
+
+    def matches(self, matrix):
+        """
+        Return True if matrix has the cached sparsity pattern.
+
+        Parameters
+        ----------
+        matrix : csc_matrix
+            Matrix to check.
+
+        Returns
+        -------
+        bool
+            True if the sparsity pattern is the same.
+        """
+        return (np.array_equal(matrix.indptr, self._indptr) and
+                np.array_equal(matrix.indices, self._indices))
+
+    def factor(self, matrix):
+        """
+        Factor matrix with the cached column ordering.
+
+        Parameters
+        ----------
+        matrix : csc_matrix
+            Matrix with the cached sparsity pattern.
+
+        Returns
+        -------
+        _OrderedSparseLU
+            This object, holding the new factorization.
+        """
+        permuted = csc_matrix((matrix.data[self._data_idx], self._perm_indices,
+                               self._perm_indptr), shape=matrix.shape)
+        self._lu = scipy.sparse.linalg.splu(permuted, permc_spec='NATURAL')
+        return self
+
+    def solve(self, rhs, trans='N'):
+        """
+        Solve the linear system with the factored matrix.
+
+        Parameters
+        ----------
+        rhs : ndarray
+            Right-hand side(s), with shape (n,) or (n, m).
+        trans : str
+            'N' to solve with the matrix, 'T' to solve with its transpose.
+
+        Returns
+        -------
+        ndarray
+            Solution(s) with the same shape as rhs.
+        """
+        if trans == 'N':
+            # A[:, order] y = b, so x[order] = y
+            y = self._lu.solve(rhs, trans)
+            sol = np.empty_like(y)
+            sol[self._order] = y
+            return sol
+
+        # A[:, order]^T = A^T[order, :], so the RHS rows are permuted instead.
+        return self._lu.solve(rhs[self._order], trans)
+
+
+def _greedy_column_coloring(pattern):
+    """
+    Compute a column coloring of a sparsity pattern.
+
+    Columns of the same color have no nonzero row in common, so they can be computed together
+    with a single matrix-vector product.
+
+    Parameters
+    ----------
+    pattern : csc_matrix
+        Sparsity pattern of the matrix.
+
+    Returns
+    -------
+    list of ndarray
+        Column indices for each color.
+    """
+    nrows, ncols = pattern.shape
+    indptr = pattern.indptr
+    indices = pattern.indices
+
+    # Color the densest columns first, which usually gives fewer colors.
+    order = np.argsort(-np.diff(indptr), kind='stable')
+
+    row_masks = []
+    col_colors = np.empty(ncols, dtype=int)
+    for col in order:
+        rows = indices[indptr[col]:indptr[col + 1]]
+        for color, mask in enumerate(row_masks):
+            if not np.any(mask[rows]):
+                break
+        else:
+            color = len(row_masks)
+            row_masks.append(np.zeros(nrows, dtype=bool))
+        row_masks[color][rows] = True
+        col_colors[col] = color
+
+    return [np.flatnonzero(col_colors == color) for color in range(len(row_masks))]
+
+
+# EDIT-INV
+class _LUInverseOperator(scipy.sparse.linalg.LinearOperator):
+    """
+    Inverse Jacobian applied with the LU factors of a DirectSolverCustom, plus low-rank terms.
+
+    The operator is G = A^-1 + U V^T, where A^-1 is applied by back-substitution and the
+    columns of U and V are added by rank_one_update (e.g., by Broyden updates), so no n x n
+    array is formed. It uses the current factors of the solver, so it is only valid until the
+    solver is linearized or factored again.
+
+    Parameters
+    ----------
+    solver : DirectSolverCustom
+        Solver whose LU factors are applied.
+    size : int
+        Size of the matrix.
+    us : ndarray or None
+        (size, r) array of the left vectors of the low-rank terms.
+    vs : ndarray or None
+        (size, r) array of the right vectors of the low-rank terms.
+
+    Attributes
+    ----------
+    _solver : DirectSolverCustom
+        Solver whose LU factors are applied.
+    _us : ndarray
+        Left vectors of the low-rank terms, one per column.
+    _vs : ndarray
+        Right vectors of the low-rank terms, one per column.
+    """
+
+    def __init__(self, solver, size, us=None, vs=None):
+        """
+        Initialize attributes.
+        """
+        super().__init__(dtype=float, shape=(size, size))
+        self._solver = solver
+        self._us = np.zeros((size, 0)) if us is None else us
+        self._vs = np.zeros((size, 0)) if vs is None else vs
+
+    def _matmat(self, x):
+        """
+        Apply the operator to the columns of x.
+
+        Parameters
+        ----------
+        x : ndarray
+            (size, m) array.
+
+        Returns
+        -------
+        ndarray
+            (size, m) array.
+        """
+        return self._solver._factor_solve(x, 'fwd') + self._us.dot(self._vs.T.dot(x))
+
+    def _rmatmat(self, x):
+        """
+        Apply the transposed operator to the columns of x.
+
+        Parameters
+        ----------
+        x : ndarray
+            (size, m) array.
+
+        Returns
+        -------
+        ndarray
+            (size, m) array.
+        """
+        return self._solver._factor_solve(x, 'rev') + self._vs.dot(self._us.T.dot(x))
+
+    def _matvec(self, x):
+        """
+        Apply the operator to a vector.
+
+        Parameters
+        ----------
+        x : ndarray
+            Vector of length size, or (size, 1) array.
+
+        Returns
+        -------
+        ndarray
+            Result with the same shape as x.
+        """
+        return self._matmat(x.reshape(-1, 1)).reshape(x.shape)
+
+    def _rmatvec(self, x):
+        """
+        Apply the transposed operator to a vector.
+
+        Parameters
+        ----------
+        x : ndarray
+            Vector of length size, or (size, 1) array.
+
+        Returns
+        -------
+        ndarray
+            Result with the same shape as x.
+        """
+        return self._rmatmat(x.reshape(-1, 1)).reshape(x.shape)
+
+    def rank_one_update(self, u, v):
+        """
+        Return the operator plus the rank-one term outer(u, v).
+
+        Parameters
+        ----------
+        u : ndarray
+            Left vector.
+        v : ndarray
+            Right vector.
+
+        Returns
+        -------
+        _LUInverseOperator
+            The updated operator. The current operator is not modified.
+        """
+        return _LUInverseOperator(self._solver, self.shape[0],
+                                  np.column_stack((self._us, u)), np.column_stack((self._vs, v)))
+
+
+# EDIT-DIAG
+def get_var_offsets(system):
+    """
+    Return the offsets of the output variables in the rows of the matrix.
+
+    Parameters
+    ----------
+    system : <System>
+        System containing the Directsolver.
+
+    Returns
+    -------
+    ndarray
+        Cumulative offsets, with variable i in rows offsets[i]:offsets[i + 1].
+    list of str
+        Absolute names of the output variables.
+    """
+    varsizes = np.sum(system._owned_sizes, axis=0)
+    offsets = np.zeros(varsizes.size + 1, dtype=int)
+    np.cumsum(varsizes, out=offsets[1:])
+    return offsets, list(system._var_allprocs_abs2meta['output'])
+
+
+# EDIT-DIAG
+def indices_to_varnames(system, locs, var_offsets=None):
+    """
+    Given matrix locations, return the names of the variables associated with those indices.
+
+    Parameters
+    ----------
+    system : <System>
+        System containing the Directsolver.
+    locs : array_like of int
+        Indices of rows or columns.
+    var_offsets : tuple or None
+        Offsets and names returned by get_var_offsets. Computed if None.
+
+    Returns
+    -------
+    list of str
+        Strings containing variable absolute name (and promoted name if there is one) and index.
+    """
+    offsets, names = get_var_offsets(system) if var_offsets is None else var_offsets
+    locs = np.asarray(locs, dtype=int)
+
+    # side='right' skips the variables of size zero that start at the same row
+    var_idxs = np.searchsorted(offsets, locs, side='right') - 1
+    abs2prom = system._var_allprocs_abs2prom['output']
+
+    name_strings = []
+    for loc, i in zip(locs, var_idxs):
+        name = names[i]
+        varname = abs2prom[name]
+        if varname == name:
+            name_strings.append("'{}' index {}.".format(varname, loc - offsets[i]))
+        else:
+            name_strings.append("'{}' ('{}') index {}.".format(varname, name, loc - offsets[i]))
+
+    return name_strings
+
+
+def index_to_varname(system, loc, var_offsets=None):
     """
     Given a matrix location, return the name of the variable associated with that index.
 
@@ -27,30 +380,19 @@ def index_to_varname(system, loc):
         System containing the Directsolver.
     loc : int
         Index of row or column.
+    var_offsets : tuple or None
+        Offsets and names returned by get_var_offsets. Computed if None.
 
     Returns
     -------
     str
         String containing variable absolute name (and promoted name if there is one) and index.
     """
-    start = end = 0
-    varsizes = np.sum(system._owned_sizes, axis=0)
-    for i, name in enumerate(system._var_allprocs_abs2meta['output']):
-        end += varsizes[i]
-        if loc < end:
-            varname = system._var_allprocs_abs2prom['output'][name]
-            break
-        start = end
-
-    if varname == name:
-        name_string = "'{}' index {}.".format(varname, loc - start)
-    else:
-        name_string = "'{}' ('{}') index {}.".format(varname, name, loc - start)
-
-    return name_string
+    # EDIT-DIAG
+    return indices_to_varnames(system, [loc], var_offsets)[0]
 
 
-def loc_to_error_msg(system, loc_txt, loc):
+def loc_to_error_msg(system, loc_txt, loc, var_offsets=None):
     """
     Given a matrix location, format a coherent error message when matrix is singular.
 
@@ -62,18 +404,59 @@ def loc_to_error_msg(system, loc_txt, loc):
         Either 'row' or 'col'.
     loc : int
         Index of row or column.
+    var_offsets : tuple or None
+        Offsets and names returned by get_var_offsets. Computed if None.
 
     Returns
     -------
     str
         New error string.
     """
-    names = index_to_varname(system, loc)
+    names = index_to_varname(system, loc, var_offsets)
     msg = "Singular entry found in {} for {} associated with state/residual " + names
     return msg.format(system.msginfo, loc_txt)
 
 
-def format_singular_error(system, matrix):
+# EDIT-DIAG
+def _sparse_left_null_vector(matrix, maxiter=4):
+    """
+    Estimate the left null vector of a singular sparse matrix.
+
+    A few steps of inverse iteration are performed with the LU factors of the slightly shifted
+    transposed matrix, which converge to the eigenvector of the transposed matrix with the
+    eigenvalue closest to zero. If the shifted matrix cannot be factored either, the left
+    singular vector of the smallest singular value is computed with svds.
+
+    Parameters
+    ----------
+    matrix : csc_matrix
+        Singular square matrix.
+    maxiter : int
+        Number of inverse iterations.
+
+    Returns
+    -------
+    ndarray
+        Unit vector u such that matrix.T.dot(u) is (nearly) zero.
+    """
+    n = matrix.shape[0]
+    shift = 1e-10 * np.abs(matrix.data).max()
+    u = np.random.default_rng(0).standard_normal(n)
+
+    try:
+        lu = scipy.sparse.linalg.splu(csc_matrix(matrix + shift * scipy.sparse.identity(n)))
+    except RuntimeError:
+        u, _, _ = scipy.sparse.linalg.svds(matrix, k=1, which='SM', v0=u)
+        return u[:, 0]
+
+    for _ in range(maxiter):
+        u = lu.solve(u, 'T')
+        u /= np.linalg.norm(u)
+
+    return u
+
+
+def format_singular_error(system, matrix, var_offsets=None):
     """
     Format a coherent error message for any ill-conditioned mmatrix.
 
@@ -81,23 +464,46 @@ def format_singular_error(system, matrix):
     ----------
     system : <System>
         System containing the Directsolver.
-    matrix : ndarray
+    matrix : ndarray or sparse matrix
         Matrix of interest.
+    var_offsets : tuple or None
+        Offsets and names returned by get_var_offsets. Computed if None.
 
     Returns
     -------
     str
         New error string.
     """
-    if scipy.sparse.issparse(matrix):
-        matrix = matrix.toarray()
+    # EDIT-DIAG
+    # --- find the empty rows and columns of sparse matrices from their index arrays ---
+    sparse = scipy.sparse.issparse(matrix) and min(matrix.shape) > 2
+    if sparse:
+        matrix = csc_matrix(matrix)
+
+        if np.any(np.isnan(matrix.data)):
+            # There is a nan in the matrix.
+            return format_nan_error(system, matrix, var_offsets)
+
+        # explicitly stored zeros do not count as entries
+        nonzero = matrix.data != 0.0
+        row_counts = np.bincount(matrix.indices[nonzero], minlength=matrix.shape[0])
+        counts = np.concatenate(([0], np.cumsum(nonzero)))
+        col_counts = counts[matrix.indptr[1:]] - counts[matrix.indptr[:-1]]
+
+        zero_rows = np.where(row_counts == 0)[0]
+        zero_cols = np.where(col_counts == 0)[0]
+
+    else:
+        if scipy.sparse.issparse(matrix):
+            matrix = matrix.toarray()
+
+        if np.any(np.isnan(matrix)):
+            # There is a nan in the matrix.
+            return format_nan_error(system, matrix, var_offsets)
 
-    if np.any(np.isnan(matrix)):
-        # There is a nan in the matrix.
-        return format_nan_error(system, matrix)
+        zero_rows = np.where(~matrix.any(axis=1))[0]
+        zero_cols = np.where(~matrix.any(axis=0))[0]
 
-    zero_rows = np.where(~matrix.any(axis=1))[0]
-    zero_cols = np.where(~matrix.any(axis=0))[0]
     if zero_cols.size <= zero_rows.size:
 
         if zero_rows.size == 0:
@@ -105,7 +511,15 @@ def format_singular_error(system, matrix):
 
             # SVD gives us some information that may help locate the source of the problem.
             try:
-                u, _, _ = np.linalg.svd(matrix)
+                if sparse:
+                    # EDIT-DIAG
+                    # The iterative estimate is only accurate to a relative tolerance.
+                    u_sing = np.abs(_sparse_left_null_vector(matrix))
+                    tol = 1e-8 * u_sing.max()
+                else:
+                    u, _, _ = np.linalg.svd(matrix)
+                    u_sing = np.abs(u[:, -1])
+                    tol = 1e-15
 
             except Exception as err:
                 msg = f"Jacobian in '{system.pathname}' is not full rank, but OpenMDAO was " + \
@@ -115,15 +529,12 @@ def format_singular_error(system, matrix):
             # Nonzero elements in the left singular vector show the rows that contribute strongly to
             # the singular subspace. Note that sometimes extra rows/cols are included in the set,
             # currently don't have a good way to pare them down.
-            tol = 1e-15
-            u_sing = np.abs(u[:, -1])
             left_idx = np.where(u_sing > tol)[0]
 
             msg = "Jacobian in '{}' is not full rank. The following set of states/residuals " + \
                   "contains one or more equations that is a linear combination of the others: \n"
 
-            for loc in left_idx:
-                name = index_to_varname(system, loc)
+            for name in indices_to_varnames(system, left_idx, var_offsets):
                 msg += ' ' + name + '\n'
 
             if len(left_idx) > 2:
@@ -137,10 +548,10 @@ def format_singular_error(system, matrix):
         loc_txt = "column"
         loc = zero_cols[0]
 
-    return loc_to_error_msg(system, loc_txt, loc)
+    return loc_to_error_msg(system, loc_txt, loc, var_offsets)
 
 
-def format_nan_error(system, matrix):
+def format_nan_error(system, matrix, var_offsets=None):
     """
     Format a coherent error message when the matrix contains NaN.
 
@@ -148,8 +559,10 @@ def format_nan_error(system, matrix):
     ----------
     system : <System>
         System containing the Directsolver.
-    matrix : ndarray
+    matrix : ndarray or sparse matrix
         Matrix of interest.
+    var_offsets : tuple or None
+        Offsets and names returned by get_var_offsets. Computed if None.
 
     Returns
     -------
@@ -158,18 +571,20 @@ def format_nan_error(system, matrix):
     """
     # Because of how we built the matrix, a NaN in a comp causes the whole row to be NaN, so we
     # need to associate each index with a variable.
-    varsizes = np.sum(system._owned_sizes, axis=0)
+    offsets, names = get_var_offsets(system) if var_offsets is None else var_offsets
 
-    nanrows = np.zeros(matrix.shape[0], dtype=bool)
-    nanrows[np.where(np.isnan(matrix))[0]] = True
+    if scipy.sparse.issparse(matrix):
+        # EDIT-DIAG
+        matrix = matrix.tocoo()
+        nanrows = matrix.row[np.isnan(matrix.data)]
+    else:
+        nanrows = np.where(np.isnan(matrix))[0]
 
-    varnames = []
-    start = end = 0
-    for i, name in enumerate(system._var_allprocs_abs2meta['output']):
-        end += varsizes[i]
-        if np.any(nanrows[start:end]):
-            varnames.append("'%s'" % system._var_allprocs_abs2prom['output'][name])
-        start = end
+    # EDIT-DIAG
+    # --- map all the NaN rows to their variables at once ---
+    var_idxs = np.unique(np.searchsorted(offsets, nanrows, side='right') - 1)
+    abs2prom = system._var_allprocs_abs2prom['output']
+    varnames = ["'%s'" % abs2prom[names[i]] for i in var_idxs]
 
     msg = "NaN entries found in {} for rows associated with states/residuals [{}]."
     return msg.format(system.msginfo, ', '.join(varnames))
@@ -183,10 +598,79 @@ class DirectSolverCustom(LinearSolver):
     ----------
     **kwargs : dict
         Options dictionary.
+
+    Attributes
+    ----------
+    stats : SolverStats
+        Counters and timers of the solves, cache hits and factorizations.
+    _cache : SolutionCache or None
+        Cache of RHS vectors and solutions, used when the use_cache option is True.
+    _unscale_factors : tuple or None
+        Factors converting the scaled (d_outputs, d_residuals) arrays to unscaled values, or
+        None if they must be recomputed.
+    _mtx_coloring : tuple or None
+        Sparsity pattern (csc_matrix) of the matrix built by matrix-vector products, the data
+        indices and rows of its nonzeros for each column color, and the seed of the product
+        used to check the colored matrices.
+    _factored_mtx : ndarray or csc_matrix or None
+        Copy of the matrix that was last factored, used to measure its drift.
+    _lagged_mtx : ndarray or csc_matrix or None
+        Current matrix when the LU factors are from an older matrix, or the assembled matrix
+        when they are in single precision, otherwise None.
+    _matfree_refine : bool
+        True if single precision factors are refined with residuals computed by apply_linear,
+        since the matrix built without an assembled jacobian is not kept.
+    _ordered_lu : _OrderedSparseLU or None
+        Cached column ordering of the sparse matrix pattern.
+    _var_offsets : tuple or None
+        Offsets of the output variables in the matrix rows and their names, used to report
+        errors.
+    _factor_dtype : dtype or None
+        Data type of the LU factors.
+    _lu : SuperLU or _OrderedSparseLU or None
+        LU factors of a sparse matrix.
+    _lup : tuple or None
+        LU factors and pivots of a dense matrix.
     """
 
     SOLVER = 'LN: Direct'
 
+    def __init__(self, **kwargs):
+        """
+        Declare the solver options.
+        """
+        super().__init__(**kwargs)
+
+        # EDIT-CACHE
+        self._cache = None
+
+        # EDIT-BLOCK
+        self._unscale_factors = None
+
+        # EDIT-COLOR
+        self._mtx_coloring = None
+
+        # EDIT-LAG
+        self._factored_mtx = None
+        self._lagged_mtx = None
+
+        # EDIT-ORDER
+        self._ordered_lu = None
+
+        # EDIT-STATS
+        self.stats = SolverStats(self.SOLVER)
+
+        # EDIT-DIAG
+        self._var_offsets = None
+
+        # EDIT-MIXED
+        self._factor_dtype = None
+        self._matfree_refine = False
+
+        # EDIT-INV
+        self._lu = None
+        self._lup = None
+
     def _declare_options(self):
         """
         Declare options before kwargs are processed in the init method.
@@ -199,6 +683,66 @@ class DirectSolverCustom(LinearSolver):
         # EDIT-CACHE
         # --- option for caching. Default: no cache ---
         self.options.declare('use_cache', types=bool, default=False)
+        self.options.declare('cache_size', types=int, default=None, allow_none=True, lower=0,
+                             desc='Maximum number of cached solutions. Default is no limit.')
+        self.options.declare('cache_bytes', types=int, default=None, allow_none=True, lower=0,
+                             desc='Maximum memory in bytes used by the cached RHS and solution '
+                             'vectors. Default is no limit.')
+        self.options.declare('cache_eviction', default='lru', values=['lru', 'lfu'],
+                             desc="Policy for evicting cached solutions when the cache is full, "
+                             "'lru' (least recently used) or 'lfu' (least frequently used).")
+        self.options.declare('cache_mode', default='parallel', values=CACHE_MODES,
+                             desc="Reuse a cached solution when the RHS is parallel to a cached "
+                             "RHS ('parallel'), or combine cached solutions when the RHS is in "
+                             "the span of the cached RHS vectors ('subspace').")
+
+        # EDIT-COLOR
+        self.options.declare('mtx_coloring', types=bool, default=False,
+                             desc="When there is no assembled jacobian, detect the sparsity "
+                             "pattern of the matrix on the first linearization and build it "
+                             "afterwards with one apply_linear per column color, in CSC format "
+                             "factored by splu. Each colored matrix is checked with one extra "
+                             "apply_linear, and the pattern is extended by an uncolored build "
+                             "if it missed nonzeros.")
+
+        # EDIT-LAG
+        self.options.declare('refactor_tol', types=float, default=None, allow_none=True,
+                             lower=0.0,
+                             desc="If set, keep the previous LU factors while the relative "
+                             "Frobenius norm of the change in the matrix since it was last "
+                             "factored is below this tolerance, and use them with iterative "
+                             "refinement. Default is None, which refactors on every "
+                             "linearization.")
+        self.options.declare('refine_maxiter', types=int, default=10, lower=1,
+                             desc="Maximum number of iterative refinement steps with lagged "
+                             "factors before falling back to a new factorization.")
+        self.options.declare('refine_rtol', types=float, default=1e-10, lower=0.0,
+                             desc="Relative residual tolerance of the iterative refinement.")
+
+        # EDIT-MIXED
+        self.options.declare('mixed_precision', types=bool, default=False,
+                             desc="If True, factor float64 matrices in float32, which halves "
+                             "the memory of the factors, and recover double precision "
+                             "solutions by iterative refinement (refine_maxiter, refine_rtol), "
+                             "with a float64 factorization if the refinement does not "
+                             "converge or the RHS is complex. Without an assembled jacobian, "
+                             "the refinement residuals are computed by apply_linear and the "
+                             "float64 matrix is not kept.")
+
+        # EDIT-ORDER
+        self.options.declare('reuse_ordering', types=bool, default=False,
+                             desc="For sparse matrices, compute the fill-reducing column "
+                             "ordering once per sparsity pattern and reuse it in later "
+                             "factorizations.")
+
+        # EDIT-INV
+        self.options.declare('inverse_operator', types=bool, default=False,
+                             desc="If True, _inverse factors the current matrix and returns a "
+                             "LinearOperator that applies the inverse Jacobian with the LU "
+                             "factors (and supports low-rank Broyden updates through "
+                             "rank_one_update) instead of forming the dense inverse. Used by "
+                             "BroydenSolverCustom. Under complex step, the dense inverse is "
+                             "returned.")
 
         # this solver does not iterate
         self.options.undeclare("maxiter")
@@ -224,6 +768,43 @@ class DirectSolverCustom(LinearSolver):
         super()._setup_solvers(system, depth)
         self._disallow_distrib_solve()
 
+        # EDIT-COLOR
+        self._mtx_coloring = None
+
+        # EDIT-LAG
+        self._factored_mtx = None
+        self._lagged_mtx = None
+
+        # EDIT-MIXED
+        self._matfree_refine = False
+
+        # EDIT-ORDER
+        self._ordered_lu = None
+
+        # EDIT-STATS
+        self.stats.name = self.msginfo
+
+        # EDIT-DIAG
+        self._var_offsets = None
+
+        # EDIT-BLOCK
+        # the sizes or scaling of the variables may have changed
+        self._unscale_factors = None
+
+    # EDIT-DIAG
+    def _get_var_offsets(self):
+        """
+        Return the offsets of the output variables in the matrix rows, computed once per setup.
+
+        Returns
+        -------
+        tuple
+            Offsets and names returned by get_var_offsets.
+        """
+        if self._var_offsets is None:
+            self._var_offsets = get_var_offsets(self._system())
+        return self._var_offsets
+
     def _linearize_children(self):
         """
         Return a flag that is True when we need to call linearize on our subsystems' solvers.
@@ -253,21 +834,28 @@ class DirectSolverCustom(LinearSolver):
         x_data = xvec.asarray(copy=True)
 
         nmtx = x_data.size
-        seed = np.zeros(x_data.size)
         mtx = np.empty((nmtx, nmtx), dtype=b_data.dtype)
         scope_out, scope_in = system._get_matvec_scope()
 
+        # EDIT-BUILD
+        # --- set the seeds in place instead of copying a full identity column every time ---
+        x_arr = xvec.asarray()
+        b_arr = bvec.asarray()
+        x_arr[:] = 0.0
+
         # Assemble the Jacobian by running the identity matrix through apply_linear
-        for i, seed in enumerate(identity_column_iter(seed)):
-            # set value of x vector to provided value
-            xvec.set_val(seed)
+        for i in range(nmtx):
+            # set value of x vector to the i-th column of identity
+            x_arr[i] = 1.0
 
             # apply linear
             system._apply_linear(self._assembled_jac, self._rel_systems, 'fwd',
                                  scope_out, scope_in)
 
+            x_arr[i] = 0.0
+
             # put new value in out_vec
-            mtx[:, i] = bvec.asarray()
+            mtx[:, i] = b_arr
 
         # Restore the backed-up vectors
         bvec.set_val(b_data)
@@ -275,78 +863,329 @@ class DirectSolverCustom(LinearSolver):
 
         return mtx
 
-    def _linearize(self):
+    # EDIT-COLOR
+    def _set_coloring(self, pattern):
         """
-        Perform factorization.
+        Compute the column coloring of a sparsity pattern and store it.
+
+        Parameters
+        ----------
+        pattern : csc_matrix
+            Sparsity pattern (boolean, sorted indices) of the matrix.
         """
-        time0 = time.time()
+        col_of_nz = np.repeat(np.arange(pattern.shape[1]), np.diff(pattern.indptr))
+
+        colors = []
+        for cols in _greedy_column_coloring(pattern):
+            nz_idx = np.flatnonzero(np.isin(col_of_nz, cols))
+            colors.append((cols, nz_idx, pattern.indices[nz_idx]))
 
+        # random seed with entries in [0.5, 1.5), used to check the colored matrices
+        check_seed = np.random.default_rng(0).random(pattern.shape[1]) + 0.5
+
+        self._mtx_coloring = (pattern, colors, check_seed)
+
+    # EDIT-COLOR
+    def _build_colored_mtx(self):
+        """
+        Assemble a sparse Jacobian matrix by matrix-vector-products with colored seeds.
+
+        On the first call, the matrix is built column by column to detect its sparsity pattern
+        and compute a column coloring. Since an entry that happens to be zero in that matrix is
+        missing from the pattern, every colored matrix is checked against one product with a
+        random seed. On a mismatch, the matrix is built again column by column, its nonzeros are
+        added to the pattern and the coloring is recomputed.
+
+        Returns
+        -------
+        csc_matrix
+            Jacobian matrix.
+        """
         system = self._system()
-        nproc = system.comm.size
+        bvec = system._dresiduals
+        xvec = system._doutputs
 
-        if self._assembled_jac is not None:
-            matrix = self._assembled_jac._int_mtx._matrix
+        if self._mtx_coloring is not None:
+            pattern, colors, check_seed = self._mtx_coloring
 
-            if matrix is None:
-                # this happens if we're not rank 0 when using owned_sizes
-                self._lu = self._lup = None
+            # First make a backup of the vectors
+            b_data = bvec.asarray(copy=True)
+            x_data = xvec.asarray(copy=True)
 
-            # Perform dense or sparse lu factorization.
-            elif isinstance(matrix, csc_matrix):
-                try:
-                    self._lu = scipy.sparse.linalg.splu(matrix)
-                except RuntimeError as err:
-                    raise RuntimeError(format_singular_error(system, matrix))
+            seed = np.zeros(x_data.size)
+            data = np.empty(pattern.nnz, dtype=b_data.dtype)
+            scope_out, scope_in = system._get_matvec_scope()
 
-            elif isinstance(matrix, np.ndarray):  # dense
-                # During LU decomposition, detect singularities and warn user.
-                with warnings.catch_warnings():
-                    if self.options['err_on_singular']:
-                        warnings.simplefilter('error', RuntimeWarning)
-                    try:
-                        self._lup = scipy.linalg.lu_factor(matrix)
-                    except RuntimeWarning as err:
-                        raise RuntimeError(format_singular_error(system, matrix))
+            # Each product gives all the nonzeros of the columns of one color.
+            for cols, nz_idx, nz_rows in colors:
+                seed[:] = 0.0
+                seed[cols] = 1.0
+                xvec.set_val(seed)
 
-                    # NaN in matrix.
-                    except ValueError as err:
-                        raise RuntimeError(format_nan_error(system, matrix))
+                system._apply_linear(self._assembled_jac, self._rel_systems, 'fwd',
+                                     scope_out, scope_in)
+
+                data[nz_idx] = bvec.asarray()[nz_rows]
+
+            # One uncolored product detects the nonzeros that are missing from the pattern.
+            xvec.set_val(check_seed)
+            system._apply_linear(self._assembled_jac, self._rel_systems, 'fwd',
+                                 scope_out, scope_in)
+            expected = bvec.asarray(copy=True)
+
+            # Restore the backed-up vectors
+            bvec.set_val(b_data)
+            xvec.set_val(x_data)
+
+            mtx = csc_matrix((data, pattern.indices, pattern.indptr), shape=pattern.shape)
+            error = np.linalg.norm(mtx.dot(check_seed) - expected)
+            if error <= 1e-10 * max(np.linalg.norm(expected), np.finfo(float).tiny):
+                return mtx
+
+        mtx = csc_matrix(self._build_mtx())
+        mtx.sort_indices()
+
+        pattern = csc_matrix((np.ones(mtx.nnz, dtype=bool), mtx.indices, mtx.indptr),
+                             shape=mtx.shape)
+        if self._mtx_coloring is not None:
+            # keep the nonzeros of the previous matrices, which may be zero in this one
+            pattern = (pattern + self._mtx_coloring[0]).astype(bool).tocsc()
+            pattern.sort_indices()
+
+        self._set_coloring(pattern)
+        return mtx
+
+    def _get_matrix(self):
+        """
+        Return the current matrix, from the assembled jacobian or built by matrix-vector products.
+
+        Returns
+        -------
+        ndarray or csc_matrix or None
+            Matrix, or None on the processes that do not hold the assembled matrix.
+        """
+        system = self._system()
+
+        if self._assembled_jac is not None:
+            matrix = self._assembled_jac._int_mtx._matrix
 
             # Note: calling scipy.sparse.linalg.splu on a COO actually transposes
             # the matrix during conversion to csc prior to LU decomp, so we can't use COO.
-            else:
+            if matrix is not None and not isinstance(matrix, (csc_matrix, np.ndarray)):
                 raise RuntimeError("Direct solver not implemented for matrix type %s"
                                    " in %s." % (type(self._assembled_jac._int_mtx),
                                                 system.msginfo))
+            return matrix
+
+        if system.comm.size > 1:
+            raise RuntimeError("DirectSolvers without an assembled jacobian are not supported "
+                               "when running under MPI if comm.size > 1.")
+
+        # EDIT-COLOR
+        if self.options['mtx_coloring']:
+            return self._build_colored_mtx()
+
+        return self._build_mtx()
+
+    # EDIT-MIXED
+    def _apply_mtx(self, x, mode):
+        """
+        Multiply a vector or a block of vectors by the scaled matrix (transposed in 'rev' mode).
+
+        Parameters
+        ----------
+        x : ndarray
+            Vector(s), with shape (n,) or (n, m), with the same scaling as d_outputs in 'fwd'
+            mode or d_residuals in 'rev' mode.
+        mode : str
+            'fwd' or 'rev'.
+
+        Returns
+        -------
+        ndarray
+            Product(s) with the same shape as x.
+        """
+        system = self._system()
+        if mode == 'fwd':
+            xvec, bvec = system._doutputs, system._dresiduals
         else:
-            if nproc > 1:
-                raise RuntimeError("DirectSolvers without an assembled jacobian are not supported "
-                                   "when running under MPI if comm.size > 1.")
+            xvec, bvec = system._dresiduals, system._doutputs
 
-            mtx = self._build_mtx()
+        # First make a backup of the vectors
+        b_data = bvec.asarray(copy=True)
+        x_data = xvec.asarray(copy=True)
+
+        scope_out, scope_in = system._get_matvec_scope()
+        x_cols = x.reshape((x.shape[0], -1))
+        out = np.empty(x_cols.shape, dtype=np.result_type(x, b_data))
+
+        for j in range(x_cols.shape[1]):
+            xvec.set_val(x_cols[:, j])
+            system._apply_linear(self._assembled_jac, self._rel_systems, mode,
+                                 scope_out, scope_in)
+            out[:, j] = bvec.asarray()
+
+        # Restore the backed-up vectors
+        bvec.set_val(b_data)
+        xvec.set_val(x_data)
+
+        return out.reshape(x.shape)
+
+    def _factor(self, matrix, mixed_precision=None):
+        """
+        Perform dense or sparse LU factorization of the given matrix.
+
+        Parameters
+        ----------
+        matrix : ndarray or csc_matrix
+            Matrix to factor.
+        mixed_precision : bool or None
+            Whether to factor a float64 matrix in float32. Default is the mixed_precision option.
+        """
+        system = self._system()
+        time0 = time.perf_counter()
+
+        # EDIT-MIXED
+        # --- factor a float32 copy of float64 matrices (not complex ones) ---
+        if mixed_precision is None:
+            mixed_precision = self.options['mixed_precision']
+        mixed_precision = mixed_precision and matrix.dtype == np.float64
+        factor_mtx = matrix.astype(np.float32) if mixed_precision else matrix
+        self._factor_dtype = factor_mtx.dtype
+
+        if isinstance(matrix, csc_matrix):
+            self._lup = None
+            try:
+                # EDIT-ORDER
+                if self.options['reuse_ordering']:
+                    self._lu = self._ordered_splu(factor_mtx)
+                else:
+                    self._lu = scipy.sparse.linalg.splu(factor_mtx)
+            except RuntimeError as err:
+                raise RuntimeError(format_singular_error(system, matrix,
+                                                         self._get_var_offsets()))
 
+        else:  # dense
             # During LU decomposition, detect singularities and warn user.
             with warnings.catch_warnings():
-
                 if self.options['err_on_singular']:
                     warnings.simplefilter('error', RuntimeWarning)
-
                 try:
-                    self._lup = scipy.linalg.lu_factor(mtx)
-
+                    self._lup = scipy.linalg.lu_factor(factor_mtx)
                 except RuntimeWarning as err:
-                    raise RuntimeError(format_singular_error(system, mtx))
+                    raise RuntimeError(format_singular_error(system, matrix,
+                                                             self._get_var_offsets()))
 
                 # NaN in matrix.
                 except ValueError as err:
-                    raise RuntimeError(format_nan_error(system, mtx))
+                    raise RuntimeError(format_nan_error(system, matrix,
+                                                        self._get_var_offsets()))
+
+        # EDIT-STATS
+        self.stats.record_factorization(time.perf_counter() - time0)
+
+        # EDIT-LAG
+        # --- keep a copy of the factored matrix to measure the drift of later ones ---
+        # EDIT-MIXED: single precision factors are refined against the assembled matrix, which
+        # is owned by the jacobian, or with apply_linear when the matrix was built here, so
+        # that the float64 matrix is not kept alongside the factors.
+        self._matfree_refine = mixed_precision and self._assembled_jac is None
+        self._lagged_mtx = matrix if mixed_precision and not self._matfree_refine else None
+        if self.options['refactor_tol'] is not None:
+            self._factored_mtx = matrix.copy()
+
+    # EDIT-ORDER
+    def _ordered_splu(self, matrix):
+        """
+        Perform sparse LU factorization, reusing the column ordering of the sparsity pattern.
+
+        Parameters
+        ----------
+        matrix : csc_matrix
+            Matrix to factor.
+
+        Returns
+        -------
+        SuperLU or _OrderedSparseLU
+            The factorization.
+        """
+        ordered_lu = self._ordered_lu
+        if ordered_lu is not None and ordered_lu.matches(matrix):
+            return ordered_lu.factor(matrix)
+
+        # New sparsity pattern: compute the ordering and cache it for the next factorizations.
+        lu = scipy.sparse.linalg.splu(matrix)
+        self._ordered_lu = _OrderedSparseLU(matrix, lu.perm_c)
+        return lu
+
+    # EDIT-LAG
+    def _get_drift(self, matrix):
+        """
+        Return the relative change of the matrix since it was last factored.
+
+        Parameters
+        ----------
+        matrix : ndarray or csc_matrix
+            Current matrix.
+
+        Returns
+        -------
+        float
+            Relative Frobenius norm of the difference, or inf if it cannot be compared.
+        """
+        old = self._factored_mtx
+        if old is None or type(old) is not type(matrix) or old.shape != matrix.shape:
+            return np.inf
+
+        if isinstance(matrix, csc_matrix):
+            if np.array_equal(old.indptr, matrix.indptr) and \
+               np.array_equal(old.indices, matrix.indices):
+                old_norm = np.linalg.norm(old.data)
+                diff_norm = np.linalg.norm(matrix.data - old.data)
+            else:
+                old_norm = scipy.sparse.linalg.norm(old)
+                diff_norm = scipy.sparse.linalg.norm(matrix - old)
+        else:
+            old_norm = np.linalg.norm(old)
+            diff_norm = np.linalg.norm(matrix - old)
+
+        if old_norm == 0.0:
+            return np.inf
+
+        return diff_norm / old_norm
+
+    def _linearize(self):
+        """
+        Perform factorization.
+        """
+        matrix = self._get_matrix()
+        if matrix is None:
+            # this happens if we're not rank 0 when using owned_sizes
+            self._lu = self._lup = None
+
+        # EDIT-LAG
+        # --- keep the previous factors if the matrix barely changed ---
+        if matrix is not None:
+            refactor_tol = self.options['refactor_tol']
+            if refactor_tol is not None and self._get_drift(matrix) <= refactor_tol:
+                # The stale factors are used as a preconditioner for iterative refinement
+                # against the current matrix.
+                self._lagged_mtx = matrix
+            else:
+                self._factor(matrix)
 
         # EDIT-CACHE
         # --- initialize cache ---
+        # The cached solutions are only valid for the current linearization.
         if self.options['use_cache']:
-            self._rhs_cache_list = []
-            self._sol_cache_list = []
-        
+            if self._cache is None:
+                self._cache = SolutionCache(max_size=self.options['cache_size'],
+                                            max_bytes=self.options['cache_bytes'],
+                                            eviction=self.options['cache_eviction'],
+                                            mode=self.options['cache_mode'])
+            else:
+                self._cache.clear()
+
     def _inverse(self):
         """
         Return the inverse Jacobian.
@@ -356,13 +1195,21 @@ class DirectSolverCustom(LinearSolver):
 
         Returns
         -------
-        ndarray
-            Inverse Jacobian.
+        ndarray or LinearOperator
+            Inverse Jacobian, as an operator if the inverse_operator option is True (except
+            under complex step).
         """
         system = self._system()
         iproc = system.comm.rank
         nproc = system.comm.size
 
+        # EDIT-INV
+        # --- apply the inverse with the LU factors of the current matrix ---
+        # The Broyden solver converts its inverse Jacobian to complex under complex step, which
+        # the operator does not support, so the dense inverse is returned then.
+        if self.options['inverse_operator'] and not system.under_complex_step:
+            return self._inverse_operator()
+
         if self._assembled_jac is not None:
 
             matrix = self._assembled_jac._int_mtx._matrix
@@ -381,17 +1228,20 @@ class DirectSolverCustom(LinearSolver):
                     try:
                         inv_jac = scipy.linalg.inv(matrix)
                     except RuntimeWarning as err:
-                        raise RuntimeError(format_singular_error(system, matrix))
+                        raise RuntimeError(format_singular_error(system, matrix,
+                                                                 self._get_var_offsets()))
 
                     # NaN in matrix.
                     except ValueError as err:
-                        raise RuntimeError(format_nan_error(system, matrix))
+                        raise RuntimeError(format_nan_error(system, matrix,
+                                                            self._get_var_offsets()))
 
             elif isinstance(matrix, csc_matrix):
                 try:
                     inv_jac = scipy.sparse.linalg.inv(matrix)
                 except RuntimeError as err:
-                    raise RuntimeError(format_singular_error(system, matrix))
+                    raise RuntimeError(format_singular_error(system, matrix,
+                                                             self._get_var_offsets()))
 
                 # to prevent broadcasting errors later, make sure inv_jac is 2D
                 # scipy.sparse.linalg.inv returns a shape (1,) array if matrix is shape (1,1)
@@ -417,14 +1267,51 @@ class DirectSolverCustom(LinearSolver):
                     inv_jac = scipy.linalg.inv(mtx)
 
                 except RuntimeWarning as err:
-                    raise RuntimeError(format_singular_error(system, mtx))
+                    raise RuntimeError(format_singular_error(system, mtx,
+                                                             self._get_var_offsets()))
 
                 # NaN in matrix.
                 except ValueError as err:
-                    raise RuntimeError(format_nan_error(system, mtx))
+                    raise RuntimeError(format_nan_error(system, mtx,
+                                                        self._get_var_offsets()))
 
         return inv_jac
 
+    # EDIT-INV
+    def _inverse_operator(self):
+        """
+        Return the inverse Jacobian as an operator backed by the LU factors.
+
+        The Broyden solver asks for the inverse without linearizing the linear solver, so the
+        current matrix is factored here, as _inverse inverts it.
+
+        Returns
+        -------
+        LinearOperator
+            Inverse Jacobian. Like the matrix returned by _inverse, it is unscaled when the
+            jacobian is assembled.
+        """
+        system = self._system()
+        size = np.sum(system._owned_sizes)
+
+        if self._assembled_jac is None and system.comm.size > 1:
+            raise RuntimeError("BroydenSolvers without an assembled jacobian are not supported "
+                               "when running under MPI if comm.size > 1.")
+
+        matrix = self._get_matrix()
+        if matrix is None:
+            # This happens if we're not rank 0 and owned_sizes are being used
+            return scipy.sparse.linalg.aslinearoperator(scipy.sparse.csc_matrix((size, size)))
+
+        self._factor(matrix)
+
+        # EDIT-CACHE
+        # The cached solutions were computed with the previous factors.
+        if self._cache is not None:
+            self._cache.clear()
+
+        return _LUInverseOperator(self, size)
+
     def solve(self, mode, rel_systems=None):
         """
         Run the solver.
@@ -436,7 +1323,7 @@ class DirectSolverCustom(LinearSolver):
         rel_systems : set of str
             Names of systems relevant to the current solve.
         """
-        time0 = time.time()
+        time0 = time.perf_counter()
 
         system = self._system()
 
@@ -447,65 +1334,238 @@ class DirectSolverCustom(LinearSolver):
         if mode == 'fwd':
             x_vec = d_outputs.asarray()
             b_vec = d_residuals.asarray()
-            trans_lu = 0
-            trans_splu = 'N'
         else:  # rev
             x_vec = d_residuals.asarray()
             b_vec = d_outputs.asarray()
-            trans_lu = 1
-            trans_splu = 'T'
 
         # EDIT-CACHE
         # --------------------------------------------------
         # --- check if we can reuse the cached solutions ---
         if self.options['use_cache']:
-            for i, rhs_cache in enumerate(self._rhs_cache_list):
-                # Check if the RHS vector is the same as a cached vector. This part is not necessary, but is less expensive than checking if two vectors are parallel.
-                if np.allclose(b_vec, rhs_cache, rtol=1e-12, atol=1e-12):
-                    x_vec[:] = self._sol_cache_list[i]
-                    print('*** use caching in DirectSolver with scaler = 1 | time = %.2E s ***' % (time.time() - time0))
-                    return
-                # Check if the RHS vector is equal to -1 * cached vector.
-                elif np.allclose(b_vec, -rhs_cache, rtol=1e-12, atol=1e-12):
-                    x_vec[:] = -self._sol_cache_list[i]
-                    print('*** use caching in DirectSolver with scaler = -1 | time = %.2E s ***' % (time.time() - time0))
-                    return
-
-                # Check if the RHS vector and a cached vector are parallel
-                # NOTE: the following parallel vector check may be inaccurate for some cases. maybe should tighten the tolerance?
-                dot_product = np.dot(b_vec, rhs_cache)
-                norm1 = np.linalg.norm(b_vec)
-                norm2 = np.linalg.norm(rhs_cache)
-                if np.isclose(abs(dot_product), norm1 * norm2, rtol=1e-100, atol=1e-15):
-                    # two vectors are parallel, thus we can use the cache.
-                    scaler = dot_product / norm2**2
-                    x_vec[:] = self._sol_cache_list[i] * scaler
-                    print('*** use caching in DirectSolver with scaler = %.2E | time = %.2E s ***' % (scaler, time.time() - time0))
-                    return
-
-        # TODO: reset cache optimization iteration
+            # fwd and rev solutions are solutions of different systems
+            self._cache.set_deriv_mode(mode)
+            # Compare b against all cached RHS vectors at once.
+            coefs = self._cache.lookup(b_vec)
+            if coefs is not None:
+                x_vec[:] = self._cache.solution(coefs)
+                # EDIT-STATS
+                self.stats.record_hit(self._cache.hit_kind(coefs), time.perf_counter() - time0)
+                return
         # --------------------------------------------------
 
+        time0 = time.perf_counter()
+
         # AssembledJacobians are unscaled.
         if self._assembled_jac is not None:
-            full_b = tmp = b_vec
-
             with system._unscaled_context(outputs=[d_outputs], residuals=[d_residuals]):
-                if isinstance(self._assembled_jac._int_mtx, DenseMatrix):
-                    arr = scipy.linalg.lu_solve(self._lup, full_b, trans=trans_lu)
-                else:
-                    arr = self._lu.solve(full_b, trans_splu)
-
-                x_vec[:] = arr
+                x_vec[:] = self._factor_solve(b_vec, mode)
 
         # matrix-vector-product generated jacobians are scaled.
         else:
-            x_vec[:] = scipy.linalg.lu_solve(self._lup, b_vec, trans=trans_lu)
+            x_vec[:] = self._factor_solve(b_vec, mode)
 
-        print('*** solved in DirectSolver | time = %.2E s ***' % (time.time() - time0))
+        # EDIT-STATS
+        self.stats.record_miss(time.perf_counter() - time0)
 
         # EDIT-CACHE
         # --- append the current solution to the cache ---
         if self.options['use_cache']:
-            self._rhs_cache_list.append(b_vec.copy())
-            self._sol_cache_list.append(x_vec.copy())
+            self._cache.add(b_vec, x_vec)
+
+    def _lu_solve(self, b, mode):
+        """
+        Apply the LU factors to a vector or a block of vectors.
+
+        Parameters
+        ----------
+        b : ndarray
+            Right-hand side(s), with shape (n,) or (n, m).
+        mode : str
+            'fwd' or 'rev'.
+
+        Returns
+        -------
+        ndarray
+            Solution(s) with the same shape as b.
+        """
+        # EDIT-MIXED
+        # --- real factors are applied to the real and imaginary parts of complex RHS ---
+        if np.iscomplexobj(b) and not np.issubdtype(self._factor_dtype, np.complexfloating):
+            return self._lu_solve(b.real, mode) + 1j * self._lu_solve(b.imag, mode)
+
+        # --- solve in single precision, with each RHS scaled to avoid underflow ---
+        if self._factor_dtype == np.float32 and b.dtype == np.float64:
+            scale = np.max(np.abs(b), axis=0)
+            scale = np.where(scale > 0.0, scale, 1.0)
+            b = (b / scale).astype(np.float32)
+        else:
+            scale = None
+
+        if self._lup is None:
+            x = self._lu.solve(b, 'N' if mode == 'fwd' else 'T')
+        else:
+            x = scipy.linalg.lu_solve(self._lup, b, trans=0 if mode == 'fwd' else 1)
+
+        if scale is not None:
+            x = x.astype(np.float64) * scale
+        return x
+
+    def _factor_solve(self, b, mode):
+        """
+        Solve with the LU factors, refining the solution when the factors are lagged or in
+        single precision.
+
+        Parameters
+        ----------
+        b : ndarray
+            Right-hand side(s), with shape (n,) or (n, m), consistent with the matrix scaling.
+        mode : str
+            'fwd' or 'rev'.
+
+        Returns
+        -------
+        ndarray
+            Solution(s) with the same shape as b.
+        """
+        # EDIT-MIXED
+        # --- complex RHS (e.g. under complex step) are solved with double precision factors ---
+        if self._factor_dtype == np.float32 and np.iscomplexobj(b):
+            self._refactor_full_precision()
+
+        x = self._lu_solve(b, mode)
+
+        # EDIT-LAG
+        # --- iterative refinement against the current matrix with the stale (or single
+        # precision) factors ---
+        if self._lagged_mtx is not None:
+            matrix = self._lagged_mtx.T if mode == 'rev' else self._lagged_mtx
+            apply_mtx = matrix.dot
+        elif self._matfree_refine:
+            # EDIT-MIXED: apply_linear overwrites the linear vectors, which b may be a view of
+            b = b.copy()
+
+            def apply_mtx(y):
+                return self._apply_mtx(y, mode)
+        else:
+            return x
+
+        tol = self.options['refine_rtol'] * np.linalg.norm(b, axis=0)
+        for _ in range(self.options['refine_maxiter']):
+            r = b - apply_mtx(x)
+            if np.all(np.linalg.norm(r, axis=0) <= tol):
+                return x
+            x += self._lu_solve(r, mode)
+
+        # Refinement did not converge, so the matrix has drifted too far (or is too
+        # ill-conditioned for single precision). Refactor it in full precision.
+        self._refactor_full_precision()
+        return self._lu_solve(b, mode)
+
+    def _refactor_full_precision(self):
+        """
+        Factor the current matrix in full precision, rebuilding it if it was not kept.
+        """
+        matrix = self._lagged_mtx
+        if matrix is None:
+            # EDIT-MIXED: the matrix built by matrix-vector products was not kept
+            matrix = self._get_matrix()
+        self._factor(matrix, mixed_precision=False)
+
+    # EDIT-BLOCK
+    def solve_block(self, rhs_block, mode='fwd'):
+        """
+        Solve the linear system for multiple right-hand sides at once.
+
+        All columns that are not found in the solution cache are solved with a single LU
+        back-substitution, so one matrix-matrix solve replaces one matrix-vector solve per
+        column.
+
+        Parameters
+        ----------
+        rhs_block : ndarray
+            (n, m) array whose columns are the right-hand sides, with the same scaling as
+            d_residuals in 'fwd' mode or d_outputs in 'rev' mode.
+        mode : str
+            'fwd' or 'rev'.
+
+        Returns
+        -------
+        ndarray
+            (n, m) array of solutions, with the same scaling as d_outputs in 'fwd' mode or
+            d_residuals in 'rev' mode.
+        """
+        time0 = time.perf_counter()
+
+        rhs_block = np.asarray(rhs_block)
+        if rhs_block.ndim == 1:
+            rhs_block = rhs_block[:, np.newaxis]
+
+        sol_block = np.empty(rhs_block.shape, dtype=np.result_type(rhs_block, float))
+        todo = np.arange(rhs_block.shape[1])
+
+        if self.options['use_cache']:
+            self._cache.set_deriv_mode(mode)
+            hits, coefs = self._cache.lookup_block(rhs_block)
+            if np.any(hits):
+                sol_block[:, hits] = self._cache.solution(coefs[:, hits])
+                todo = np.flatnonzero(~hits)
+
+                # EDIT-STATS
+                elapsed = (time.perf_counter() - time0) / np.count_nonzero(hits)
+                for j in np.flatnonzero(hits):
+                    self.stats.record_hit(self._cache.hit_kind(coefs[:, j]), elapsed)
+
+        if todo.size > 0:
+            time0 = time.perf_counter()
+            sol_block[:, todo] = self._back_solve(rhs_block[:, todo], mode)
+            self.stats.record_miss(time.perf_counter() - time0, count=todo.size)
+
+            if self.options['use_cache']:
+                for j in todo:
+                    self._cache.add(rhs_block[:, j], sol_block[:, j])
+
+        return sol_block
+
+    def _back_solve(self, rhs_block, mode):
+        """
+        Solve for a block of right-hand sides with the current LU factors.
+
+        Parameters
+        ----------
+        rhs_block : ndarray
+            (n, m) array of scaled right-hand sides.
+        mode : str
+            'fwd' or 'rev'.
+
+        Returns
+        -------
+        ndarray
+            (n, m) array of scaled solutions.
+        """
+        # matrix-vector-product generated jacobians are scaled.
+        if self._assembled_jac is None:
+            return self._factor_solve(rhs_block, mode)
+
+        # AssembledJacobians are unscaled.
+        out_factor, res_factor = self._get_unscale_factors()
+        if mode == 'fwd':
+            b_factor, x_factor = res_factor, out_factor
+        else:
+            b_factor, x_factor = out_factor, res_factor
+
+        full_b = rhs_block * b_factor[:, np.newaxis]
+
+        return self._factor_solve(full_b, mode) / x_factor[:, np.newaxis]
+
+    def _get_unscale_factors(self):
+        """
+        Return the factors that convert scaled d_outputs and d_residuals arrays to unscaled.
+
+        Returns
+        -------
+        tuple of (ndarray, ndarray)
+            Factors for d_outputs and d_residuals.
+        """
+        if self._unscale_factors is None:
+            self._unscale_factors = get_unscale_factors(self._system())
+        return self._unscale_factors
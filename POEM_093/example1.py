@@ -8,6 +8,10 @@ The optimization problem is (each point is labeled 0 and 1)
 min  CD0 + CD1
 s.t. CL0 = 0.6
      CL1 = CL0 + 0.2
+
+The model is built by build_model, which benchmark.py imports to rebuild it with other mesh
+sizes and numbers of flight points. Running this file sets up the driver, computes the totals
+and prints the statistics of the custom linear solvers.
 """
 
 import matplotlib.pyplot as plt
@@ -23,6 +27,14 @@ import openmdao.api as om
 from direct_custom import DirectSolverCustom
 from petsc_ksp_custom import PETScKrylovCustom
 
+# Cruise and maneuver conditions: Mach number, speed of sound [m/s], density [kg/m**3],
+# dynamic viscosity [kg/(m*s)] and load factor. The conditions of additional flight points are
+# interpolated between the two.
+FLIGHT_CONDITIONS = np.array([
+    [0.5, 310.95, 0.569, 1.56e-5, 1.0],
+    [0.3, 340.294, 1.225, 1.81206e-5, 2.5],
+])
+
 # Provide coordinates for a portion of an airfoil for the wingbox cross-section as an nparray with dtype=complex (to work with the complex-step approximation for derivatives).
 # These should be for an airfoil with the chord scaled to 1.
 # We use the 10% to 60% portion of the NASA SC2-0612 airfoil for this case
@@ -36,303 +48,443 @@ upper_y = np.array([ 0.0447,  0.046,  0.0472,  0.0484,  0.0495,  0.0505,  0.0514
 lower_y = np.array([-0.0447, -0.046, -0.0473, -0.0485, -0.0496, -0.0506, -0.0515, -0.0524, -0.0532, -0.054, -0.0547, -0.0554, -0.056, -0.0565, -0.057, -0.0575, -0.0579, -0.0583, -0.0586, -0.0589, -0.0592, -0.0594, -0.0595, -0.0596, -0.0597, -0.0598, -0.0598, -0.0598, -0.0598, -0.0597, -0.0596, -0.0594, -0.0592, -0.0589, -0.0586, -0.0582, -0.0578, -0.0573, -0.0567, -0.0561, -0.0554, -0.0546, -0.0538, -0.0529, -0.0519, -0.0509, -0.0497, -0.0485, -0.0472, -0.0458, -0.0444], dtype="complex128")
 # fmt: on
 
-# Here we create a custom mesh for the wing
-# It is evenly spaced with nx chordwise nodal points and ny spanwise nodal points for the half-span
-
-span = 28.42  # wing span in m
-root_chord = 3.34  # root chord in m
-
-nx = 3  # number of chordwise nodal points (should be odd)
-ny = 21  # number of spanwise nodal points for the half-span
-
-# Initialize the 3-D mesh object. Chordwise, spanwise, then the 3D coordinates.
-mesh = np.zeros((nx, ny, 3))
-
-# Start away from the symmetry plane and approach the plane as the array indices increase.
-# The form of this 3-D array can be very confusing initially.
-# For each node we are providing the x, y, and z coordinates.
-# x is chordwise, y is spanwise, and z is up.
-# For example (for a mesh with 5 chordwise nodes and 15 spanwise nodes for the half wing), the node for the leading edge at the tip would be specified as mesh[0, 0, :] = np.array([1.1356, -14.21, 0.])
-# and the node at the trailing edge at the root would be mesh[4, 14, :] = np.array([3.34, 0., 0.]).
-# We only provide the left half of the wing because we use symmetry.
-# Print the following mesh and elements of the mesh to better understand the form.
-
-mesh[:, :, 1] = np.linspace(-span / 2, 0, ny)
-mesh[0, :, 0] = 0.34 * root_chord * np.linspace(1.0, 0.0, ny)
-mesh[2, :, 0] = root_chord * (np.linspace(0.4, 1.0, ny) + 0.34 * np.linspace(1.0, 0.0, ny))
-mesh[1, :, 0] = (mesh[2, :, 0] + mesh[0, :, 0]) / 2
-
-# print(mesh)
-
-surf_dict = {
-    # Wing definition
-    "name": "wing",  # name of the surface
-    "symmetry": True,  # if true, model one half of wing
-    "S_ref_type": "wetted",  # how we compute the wing area,
-    # can be 'wetted' or 'projected'
-    "mesh": mesh,
-    "twist_cp": np.array([6.0, 7.0, 7.0, 7.0]),
-    "fem_model_type": "wingbox",
-    "data_x_upper": upper_x,
-    "data_x_lower": lower_x,
-    "data_y_upper": upper_y,
-    "data_y_lower": lower_y,
-    "spar_thickness_cp": np.array([0.004, 0.004, 0.004, 0.004]),  # [m]
-    "skin_thickness_cp": np.array([0.003, 0.006, 0.010, 0.012]),  # [m]
-    "original_wingbox_airfoil_t_over_c": 0.12,
-    # Aerodynamic deltas.
-    # These CL0 and CD0 values are added to the CL and CD
-    # obtained from aerodynamic analysis of the surface to get
-    # the total CL and CD.
-    # These CL0 and CD0 values do not vary wrt alpha.
-    # They can be used to account for things that are not included, such as contributions from the fuselage, nacelles, tail surfaces, etc.
-    "CL0": 0.0,
-    "CD0": 0.0142,
-    "with_viscous": True,  # if true, compute viscous drag
-    "with_wave": True,  # if true, compute wave drag
-    # Airfoil properties for viscous drag calculation
-    "k_lam": 0.05,  # percentage of chord with laminar
-    # flow, used for viscous drag
-    "c_max_t": 0.38,  # chordwise location of maximum thickness
-    "t_over_c_cp": np.array([0.1, 0.1, 0.15, 0.15]),
-    # Structural values are based on aluminum 7075
-    "E": 73.1e9,  # [Pa] Young's modulus
-    "G": (73.1e9 / 2 / 1.33),  # [Pa] shear modulus (calculated using E and the Poisson's ratio here)
-    "yield": (420.0e6 / 1.5),  # [Pa] allowable yield stress
-    "mrho": 2.78e3,  # [kg/m^3] material density
-    "strength_factor_for_upper_skin": 1.0,  # the yield stress is multiplied by this factor for the upper skin
-    "wing_weight_ratio": 1.25,
-    "exact_failure_constraint": False,  # if false, use KS function
-    "struct_weight_relief": True,
-    "distributed_fuel_weight": True,
-    "fuel_density": 803.0,  # [kg/m^3] fuel density (only needed if the fuel-in-wing volume constraint is used)
-    "Wf_reserve": 500.0,  # [kg] reserve fuel mass
-}
-
-surfaces = [surf_dict]
-
-# Create the problem and assign the model group
-prob = om.Problem()
-
-# Add problem information as an independent variables component
-indep_var_comp = om.IndepVarComp()
-indep_var_comp.add_output("v", val=np.array([0.5 * 310.95, 0.3 * 340.294]), units="m/s")
-indep_var_comp.add_output("alpha", val=0.0, units="deg")
-indep_var_comp.add_output("alpha_maneuver", val=0.0, units="deg")
-indep_var_comp.add_output("Mach_number", val=np.array([0.5, 0.3]))
-indep_var_comp.add_output(
-    "re",
-    val=np.array([0.569 * 310.95 * 0.5 * 1.0 / (1.56 * 1e-5), 1.225 * 340.294 * 0.3 * 1.0 / (1.81206 * 1e-5)]),
-    units="1/m",
-)
-indep_var_comp.add_output("rho", val=np.array([0.569, 1.225]), units="kg/m**3")
-indep_var_comp.add_output("CT", val=0.43 / 3600, units="1/s")
-indep_var_comp.add_output("R", val=2e6, units="m")
-indep_var_comp.add_output("W0", val=25400 + surf_dict["Wf_reserve"], units="kg")
-indep_var_comp.add_output("speed_of_sound", val=np.array([310.95, 340.294]), units="m/s")
-indep_var_comp.add_output("load_factor", val=np.array([1.0, 2.5]))
-indep_var_comp.add_output("empty_cg", val=np.zeros((3)), units="m")
-indep_var_comp.add_output("fuel_mass", val=3000.0, units="kg")
-
-prob.model.add_subsystem("prob_vars", indep_var_comp, promotes=["*"])
-
-# Loop over each surface in the surfaces list
-for surface in surfaces:
-    # Get the surface name and create a group to contain components
-    # only for this surface
-    name = surface["name"]
-
-    aerostruct_group = AerostructGeometry(surface=surface)
-
-    # Add group to the problem with the name of the surface.
-    prob.model.add_subsystem(name, aerostruct_group)
-
-# Loop through and add a certain number of aerostruct points
-for i in range(2):
-    point_name = "AS_point_{}".format(i)
-    # Connect the parameters within the model for each aerostruct point
-
-    # Create the aero point group and add it to the model
-    AS_point = AerostructPoint(surfaces=surfaces, internally_connect_fuelburn=False)
-
-    prob.model.add_subsystem(point_name, AS_point)
-
-    # Connect flow properties to the analysis point
-    prob.model.connect("v", point_name + ".v", src_indices=[i])
-    prob.model.connect("Mach_number", point_name + ".Mach_number", src_indices=[i])
-    prob.model.connect("re", point_name + ".re", src_indices=[i])
-    prob.model.connect("rho", point_name + ".rho", src_indices=[i])
-    prob.model.connect("CT", point_name + ".CT")
-    prob.model.connect("R", point_name + ".R")
-    prob.model.connect("W0", point_name + ".W0")
-    prob.model.connect("speed_of_sound", point_name + ".speed_of_sound", src_indices=[i])
-    prob.model.connect("empty_cg", point_name + ".empty_cg")
-    prob.model.connect("load_factor", point_name + ".load_factor", src_indices=[i])
-    prob.model.connect("fuel_mass", point_name + ".total_perf.L_equals_W.fuelburn")
-    prob.model.connect("fuel_mass", point_name + ".total_perf.CG.fuelburn")
 
+def build_mesh(nx=3, ny=21):
+    """
+    Build a custom mesh for the wing.
+
+    It is evenly spaced with nx chordwise nodal points and ny spanwise nodal points for the
+    half-span.
+
+    Parameters
+    ----------
+    nx : int
+        Number of chordwise nodal points (should be odd).
+    ny : int
+        Number of spanwise nodal points for the half-span.
+
+    Returns
+    -------
+    ndarray
+        (nx, ny, 3) mesh.
+    """
+    span = 28.42  # wing span in m
+    root_chord = 3.34  # root chord in m
+
+    # Initialize the 3-D mesh object. Chordwise, spanwise, then the 3D coordinates.
+    mesh = np.zeros((nx, ny, 3))
+
+    # Start away from the symmetry plane and approach the plane as the array indices increase.
+    # The form of this 3-D array can be very confusing initially.
+    # For each node we are providing the x, y, and z coordinates.
+    # x is chordwise, y is spanwise, and z is up.
+    # For example (for a mesh with 5 chordwise nodes and 15 spanwise nodes for the half wing), the node for the leading edge at the tip would be specified as mesh[0, 0, :] = np.array([1.1356, -14.21, 0.])
+    # and the node at the trailing edge at the root would be mesh[4, 14, :] = np.array([3.34, 0., 0.]).
+    # We only provide the left half of the wing because we use symmetry.
+    # Print the following mesh and elements of the mesh to better understand the form.
+
+    mesh[:, :, 1] = np.linspace(-span / 2, 0, ny)
+
+    # chordwise nodes evenly spaced between the leading and trailing edges
+    leading_edge = 0.34 * root_chord * np.linspace(1.0, 0.0, ny)
+    trailing_edge = root_chord * (np.linspace(0.4, 1.0, ny) + 0.34 * np.linspace(1.0, 0.0, ny))
+    for i in range(nx):
+        mesh[i, :, 0] = leading_edge + (trailing_edge - leading_edge) * i / (nx - 1)
+
+    return mesh
+
+
+def build_surface(nx=3, ny=21, distributed_fuel_weight=True):
+    """
+    Build the surface dictionary of the wing.
+
+    Parameters
+    ----------
+    nx : int
+        Number of chordwise nodal points.
+    ny : int
+        Number of spanwise nodal points for the half-span.
+    distributed_fuel_weight : bool
+        If True, the weight of the fuel is distributed over the wing.
+
+    Returns
+    -------
+    dict
+        The surface dictionary.
+    """
+    return {
+        # Wing definition
+        "name": "wing",  # name of the surface
+        "symmetry": True,  # if true, model one half of wing
+        "S_ref_type": "wetted",  # how we compute the wing area,
+        # can be 'wetted' or 'projected'
+        "mesh": build_mesh(nx, ny),
+        "twist_cp": np.array([6.0, 7.0, 7.0, 7.0]),
+        "fem_model_type": "wingbox",
+        "data_x_upper": upper_x,
+        "data_x_lower": lower_x,
+        "data_y_upper": upper_y,
+        "data_y_lower": lower_y,
+        "spar_thickness_cp": np.array([0.004, 0.004, 0.004, 0.004]),  # [m]
+        "skin_thickness_cp": np.array([0.003, 0.006, 0.010, 0.012]),  # [m]
+        "original_wingbox_airfoil_t_over_c": 0.12,
+        # Aerodynamic deltas.
+        # These CL0 and CD0 values are added to the CL and CD
+        # obtained from aerodynamic analysis of the surface to get
+        # the total CL and CD.
+        # These CL0 and CD0 values do not vary wrt alpha.
+        # They can be used to account for things that are not included, such as contributions from the fuselage, nacelles, tail surfaces, etc.
+        "CL0": 0.0,
+        "CD0": 0.0142,
+        "with_viscous": True,  # if true, compute viscous drag
+        "with_wave": True,  # if true, compute wave drag
+        # Airfoil properties for viscous drag calculation
+        "k_lam": 0.05,  # percentage of chord with laminar
+        # flow, used for viscous drag
+        "c_max_t": 0.38,  # chordwise location of maximum thickness
+        "t_over_c_cp": np.array([0.1, 0.1, 0.15, 0.15]),
+        # Structural values are based on aluminum 7075
+        "E": 73.1e9,  # [Pa] Young's modulus
+        "G": (73.1e9 / 2 / 1.33),  # [Pa] shear modulus (calculated using E and the Poisson's ratio here)
+        "yield": (420.0e6 / 1.5),  # [Pa] allowable yield stress
+        "mrho": 2.78e3,  # [kg/m^3] material density
+        "strength_factor_for_upper_skin": 1.0,  # the yield stress is multiplied by this factor for the upper skin
+        "wing_weight_ratio": 1.25,
+        "exact_failure_constraint": False,  # if false, use KS function
+        "struct_weight_relief": True,
+        "distributed_fuel_weight": distributed_fuel_weight,
+        "fuel_density": 803.0,  # [kg/m^3] fuel density (only needed if the fuel-in-wing volume constraint is used)
+        "Wf_reserve": 500.0,  # [kg] reserve fuel mass
+    }
+
+
+def add_points(model, surf_dict, num_points=2):
+    """
+    Add the flight conditions, the wing and the aerostruct points shared by both examples.
+
+    Point 0 is the cruise point and the last one the maneuver point. The fuelburn inputs of the
+    points are connected by the caller.
+
+    Parameters
+    ----------
+    model : Group
+        The model.
+    surf_dict : dict
+        The surface dictionary.
+    num_points : int
+        Number of flight points, at least 2.
+
+    Returns
+    -------
+    list of str
+        Names of the aerostruct points.
+    """
+    surfaces = [surf_dict]
+
+    # flight conditions interpolated between cruise and maneuver
+    t = np.linspace(0.0, 1.0, num_points)[:, np.newaxis]
+    mach, sos, rho, mu, load_factor = (FLIGHT_CONDITIONS[0] * (1.0 - t) +
+                                       FLIGHT_CONDITIONS[1] * t).T
+
+    # Add problem information as an independent variables component
+    indep_var_comp = om.IndepVarComp()
+    indep_var_comp.add_output("v", val=mach * sos, units="m/s")
+    indep_var_comp.add_output("alpha", val=0.0, units="deg")
+    indep_var_comp.add_output("alpha_maneuver", val=np.zeros(num_points - 1), units="deg")
+    indep_var_comp.add_output("Mach_number", val=mach)
+    indep_var_comp.add_output("re", val=rho * mach * sos / mu, units="1/m")
+    indep_var_comp.add_output("rho", val=rho, units="kg/m**3")
+    indep_var_comp.add_output("CT", val=0.43 / 3600, units="1/s")
+    indep_var_comp.add_output("R", val=2e6, units="m")
+    indep_var_comp.add_output("W0", val=25400 + surf_dict["Wf_reserve"], units="kg")
+    indep_var_comp.add_output("speed_of_sound", val=sos, units="m/s")
+    indep_var_comp.add_output("load_factor", val=load_factor)
+    indep_var_comp.add_output("empty_cg", val=np.zeros((3)), units="m")
+
+    model.add_subsystem("prob_vars", indep_var_comp, promotes=["*"])
+
+    # Loop over each surface in the surfaces list
     for surface in surfaces:
+        # Get the surface name and create a group to contain components
+        # only for this surface
         name = surface["name"]
 
-        if surf_dict["distributed_fuel_weight"]:
-            prob.model.connect("load_factor", point_name + ".coupled.load_factor", src_indices=[i])
-
-        com_name = point_name + "." + name + "_perf."
-        prob.model.connect(
-            name + ".local_stiff_transformed", point_name + ".coupled." + name + ".local_stiff_transformed"
-        )
-        prob.model.connect(name + ".nodes", point_name + ".coupled." + name + ".nodes")
-
-        # Connect aerodyamic mesh to coupled group mesh
-        prob.model.connect(name + ".mesh", point_name + ".coupled." + name + ".mesh")
-        if surf_dict["struct_weight_relief"]:
-            prob.model.connect(name + ".element_mass", point_name + ".coupled." + name + ".element_mass")
-
-        # Connect performance calculation variables
-        prob.model.connect(name + ".nodes", com_name + "nodes")
-        prob.model.connect(name + ".cg_location", point_name + "." + "total_perf." + name + "_cg_location")
-        prob.model.connect(name + ".structural_mass", point_name + "." + "total_perf." + name + "_structural_mass")
-
-        # Connect wingbox properties to von Mises stress calcs
-        prob.model.connect(name + ".Qz", com_name + "Qz")
-        prob.model.connect(name + ".J", com_name + "J")
-        prob.model.connect(name + ".A_enc", com_name + "A_enc")
-        prob.model.connect(name + ".htop", com_name + "htop")
-        prob.model.connect(name + ".hbottom", com_name + "hbottom")
-        prob.model.connect(name + ".hfront", com_name + "hfront")
-        prob.model.connect(name + ".hrear", com_name + "hrear")
-
-        prob.model.connect(name + ".spar_thickness", com_name + "spar_thickness")
-        prob.model.connect(name + ".t_over_c", com_name + "t_over_c")
-
-prob.model.connect("alpha", "AS_point_0" + ".alpha")
-prob.model.connect("alpha_maneuver", "AS_point_1" + ".alpha")
-
-# Here we add the fuel volume constraint componenet to the model
-prob.model.add_subsystem("fuel_vol_delta", WingboxFuelVolDelta(surface=surface))
-prob.model.connect("wing.struct_setup.fuel_vols", "fuel_vol_delta.fuel_vols")
-prob.model.connect("AS_point_0.fuelburn", "fuel_vol_delta.fuelburn")
-
-if surf_dict["distributed_fuel_weight"]:
-    prob.model.connect("wing.struct_setup.fuel_vols", "AS_point_0.coupled.wing.struct_states.fuel_vols")
-    prob.model.connect("fuel_mass", "AS_point_0.coupled.wing.struct_states.fuel_mass")
-
-    prob.model.connect("wing.struct_setup.fuel_vols", "AS_point_1.coupled.wing.struct_states.fuel_vols")
-    prob.model.connect("fuel_mass", "AS_point_1.coupled.wing.struct_states.fuel_mass")
-
-comp = om.ExecComp("fuel_diff = (fuel_mass - fuelburn) / fuelburn", units="kg")
-prob.model.add_subsystem("fuel_diff", comp, promotes_inputs=["fuel_mass"], promotes_outputs=["fuel_diff"])
-prob.model.connect("AS_point_0.fuelburn", "fuel_diff.fuelburn")
-
-
-## Use these settings if you do not have pyOptSparse or SNOPT
-prob.driver = om.ScipyOptimizeDriver()
-prob.driver = om.pyOptSparseDriver()
-prob.driver.options['optimizer'] = 'SNOPT'
-prob.driver.options['print_results'] = True
-prob.driver.opt_settings['Major iterations limit'] = 1
-
-# # The following are the optimizer settings used for the EngOpt conference paper
-# # Uncomment them if you can use SNOPT
-# prob.driver = om.pyOptSparseDriver()
-# prob.driver.options['optimizer'] = "SNOPT"
-# prob.driver.opt_settings['Major optimality tolerance'] = 5e-6
-# prob.driver.opt_settings['Major feasibility tolerance'] = 1e-8
-# prob.driver.opt_settings['Major iterations limit'] = 200
-
-recorder = om.SqliteRecorder("aerostruct.db")
-prob.driver.add_recorder(recorder)
-
-# We could also just use prob.driver.recording_options['includes']=['*'] here, but for large meshes the database file becomes extremely large. So we just select the variables we need.
-prob.driver.recording_options["includes"] = [
-    "alpha",
-    "rho",
-    "v",
-    "cg",
-    "AS_point_1.cg",
-    "AS_point_0.cg",
-    "AS_point_0.coupled.wing_loads.loads",
-    "AS_point_1.coupled.wing_loads.loads",
-    "AS_point_0.coupled.wing.normals",
-    "AS_point_1.coupled.wing.normals",
-    "AS_point_0.coupled.wing.widths",
-    "AS_point_1.coupled.wing.widths",
-    "AS_point_0.coupled.aero_states.wing_sec_forces",
-    "AS_point_1.coupled.aero_states.wing_sec_forces",
-    "AS_point_0.wing_perf.CL1",
-    "AS_point_1.wing_perf.CL1",
-    "AS_point_0.coupled.wing.S_ref",
-    "AS_point_1.coupled.wing.S_ref",
-    "wing.geometry.twist",
-    "wing.mesh",
-    "wing.skin_thickness",
-    "wing.spar_thickness",
-    "wing.t_over_c",
-    "wing.structural_mass",
-    "AS_point_0.wing_perf.vonmises",
-    "AS_point_1.wing_perf.vonmises",
-    "AS_point_0.coupled.wing.def_mesh",
-    "AS_point_1.coupled.wing.def_mesh",
-]
-
-prob.driver.recording_options["record_objectives"] = True
-prob.driver.recording_options["record_constraints"] = True
-prob.driver.recording_options["record_desvars"] = True
-prob.driver.recording_options["record_inputs"] = True
-
-# design variables
-prob.model.add_design_var("wing.twist_cp", lower=-15.0, upper=15.0, scaler=0.1)
-prob.model.add_design_var("wing.spar_thickness_cp", lower=0.003, upper=0.1, scaler=1e2)
-prob.model.add_design_var("wing.skin_thickness_cp", lower=0.003, upper=0.1, scaler=1e2)
-prob.model.add_design_var("wing.geometry.t_over_c_cp", lower=0.07, upper=0.2, scaler=10.0)
-prob.model.add_design_var("fuel_mass", lower=0.0, upper=2e5, scaler=1e-5)
-prob.model.add_design_var("alpha_maneuver", lower=-15.0, upper=15)
-
-# minimize sum of CD
-prob.model.add_subsystem('CD_sum_comp', om.AddSubtractComp('CD_sum', input_names=['CD0', 'CD1']), promotes_outputs=['CD_sum'])
-prob.model.connect('AS_point_0.CD', 'CD_sum_comp.CD0')
-prob.model.connect('AS_point_1.CD', 'CD_sum_comp.CD1')
-prob.model.add_objective('CD_sum')
-
-# --- CL constraints ---
-# CL0 = 0.6
-prob.model.add_constraint("AS_point_0.CL", equals=0.6)   # NOTE: derivatives order: <CD0, CD1>, CL1, -CL0, CL0)
-
-# CL1 - CLO = 0.2
-cl_diff_comp = om.ExecComp('CL_diff = CL1 - CL0 - 0.2', units=None)
-prob.model.add_subsystem('CL_diff_comp', cl_diff_comp, promotes_outputs=['CL_diff'])
-prob.model.connect('AS_point_0.CL', 'CL_diff_comp.CL0')
-prob.model.connect('AS_point_1.CL', 'CL_diff_comp.CL1')
-prob.model.add_constraint("CL_diff", equals=0.0)   # instead of CL1 = 0.8, impose CL1 = CL0 + 0.2
-
-# Set up the problem
-prob.setup(mode='rev', check=True)
-
-# ==============================
-#  Set linear solvers here
-# ==============================
-# --- Use Krylov solver for aerostructural coupled adjoint ---
-# prob.model.AS_point_0.coupled.linear_solver = om.PETScKrylov(iprint=2, assemble_jac=True)
-# prob.model.AS_point_0.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-# prob.model.AS_point_1.coupled.linear_solver = om.PETScKrylov(iprint=2, assemble_jac=True)
-# prob.model.AS_point_1.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-
-# --- Use Custom Krylov solver with solution caching ---
-prob.model.AS_point_0.coupled.linear_solver = PETScKrylovCustom(iprint=2, assemble_jac=True, use_cache=True)
-prob.model.AS_point_0.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-prob.model.AS_point_1.coupled.linear_solver = PETScKrylovCustom(iprint=2, assemble_jac=True, use_cache=True)
-prob.model.AS_point_1.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-
-# --- Use Custom Direct solver with solution caching ---
-# prob.model.AS_point_0.coupled.linear_solver = DirectSolverCustom(use_cache=True)
-# prob.model.AS_point_0.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-# prob.model.AS_point_1.coupled.linear_solver = DirectSolverCustom(use_cache=True)
-# prob.model.AS_point_1.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
-
-prob.run_model()
-
-print("\n --- compute totals --- \n")
-totals = prob.compute_totals()
-print('Derivatives of CL_diff w.r.t. twist_cp =', totals[('CL_diff_comp.CL_diff', 'wing.twist_cp')])
-
-# om.n2(prob)
\ No newline at end of file
+        aerostruct_group = AerostructGeometry(surface=surface)
+
+        # Add group to the problem with the name of the surface.
+        model.add_subsystem(name, aerostruct_group)
+
+    # Loop through and add a certain number of aerostruct points
+    point_names = ["AS_point_{}".format(i) for i in range(num_points)]
+    for i, point_name in enumerate(point_names):
+        # Connect the parameters within the model for each aerostruct point
+
+        # Create the aero point group and add it to the model
+        AS_point = AerostructPoint(surfaces=surfaces, internally_connect_fuelburn=False)
+
+        model.add_subsystem(point_name, AS_point)
+
+        # Connect flow properties to the analysis point
+        model.connect("v", point_name + ".v", src_indices=[i])
+        model.connect("Mach_number", point_name + ".Mach_number", src_indices=[i])
+        model.connect("re", point_name + ".re", src_indices=[i])
+        model.connect("rho", point_name + ".rho", src_indices=[i])
+        model.connect("CT", point_name + ".CT")
+        model.connect("R", point_name + ".R")
+        model.connect("W0", point_name + ".W0")
+        model.connect("speed_of_sound", point_name + ".speed_of_sound", src_indices=[i])
+        model.connect("empty_cg", point_name + ".empty_cg")
+        model.connect("load_factor", point_name + ".load_factor", src_indices=[i])
+
+        for surface in surfaces:
+            name = surface["name"]
+
+            if surf_dict["distributed_fuel_weight"]:
+                model.connect("load_factor", point_name + ".coupled.load_factor", src_indices=[i])
+
+            com_name = point_name + "." + name + "_perf."
+            model.connect(
+                name + ".local_stiff_transformed", point_name + ".coupled." + name + ".local_stiff_transformed"
+            )
+            model.connect(name + ".nodes", point_name + ".coupled." + name + ".nodes")
+
+            # Connect aerodyamic mesh to coupled group mesh
+            model.connect(name + ".mesh", point_name + ".coupled." + name + ".mesh")
+            if surf_dict["struct_weight_relief"]:
+                model.connect(name + ".element_mass", point_name + ".coupled." + name + ".element_mass")
+
+            # Connect performance calculation variables
+            model.connect(name + ".nodes", com_name + "nodes")
+            model.connect(name + ".cg_location", point_name + "." + "total_perf." + name + "_cg_location")
+            model.connect(name + ".structural_mass", point_name + "." + "total_perf." + name + "_structural_mass")
+
+            # Connect wingbox properties to von Mises stress calcs
+            model.connect(name + ".Qz", com_name + "Qz")
+            model.connect(name + ".J", com_name + "J")
+            model.connect(name + ".A_enc", com_name + "A_enc")
+            model.connect(name + ".htop", com_name + "htop")
+            model.connect(name + ".hbottom", com_name + "hbottom")
+            model.connect(name + ".hfront", com_name + "hfront")
+            model.connect(name + ".hrear", com_name + "hrear")
+
+            model.connect(name + ".spar_thickness", com_name + "spar_thickness")
+            model.connect(name + ".t_over_c", com_name + "t_over_c")
+
+        if i == 0:
+            model.connect("alpha", point_name + ".alpha")
+        else:
+            model.connect("alpha_maneuver", point_name + ".alpha", src_indices=[i - 1])
+
+    return point_names
+
+
+def build_model(model, nx=3, ny=21, num_points=2):
+    """
+    Add the components, design variables, objective and constraints of this example to model.
+
+    With more than 2 flight points, the CL constraints make CL rise linearly from CL0 to
+    CL0 + 0.2 at the last point.
+
+    Parameters
+    ----------
+    model : Group
+        The model.
+    nx : int
+        Number of chordwise nodal points.
+    ny : int
+        Number of spanwise nodal points for the half-span.
+    num_points : int
+        Number of flight points, at least 2.
+
+    Returns
+    -------
+    list of str
+        Names of the aerostruct points.
+    """
+    surf_dict = build_surface(nx, ny, distributed_fuel_weight=True)
+    point_names = add_points(model, surf_dict, num_points)
+
+    model.prob_vars.add_output("fuel_mass", val=3000.0, units="kg")
+
+    for point_name in point_names:
+        model.connect("fuel_mass", point_name + ".total_perf.L_equals_W.fuelburn")
+        model.connect("fuel_mass", point_name + ".total_perf.CG.fuelburn")
+
+    # Here we add the fuel volume constraint componenet to the model
+    model.add_subsystem("fuel_vol_delta", WingboxFuelVolDelta(surface=surf_dict))
+    model.connect("wing.struct_setup.fuel_vols", "fuel_vol_delta.fuel_vols")
+    model.connect("AS_point_0.fuelburn", "fuel_vol_delta.fuelburn")
+
+    if surf_dict["distributed_fuel_weight"]:
+        for point_name in point_names:
+            model.connect("wing.struct_setup.fuel_vols", point_name + ".coupled.wing.struct_states.fuel_vols")
+            model.connect("fuel_mass", point_name + ".coupled.wing.struct_states.fuel_mass")
+
+    comp = om.ExecComp("fuel_diff = (fuel_mass - fuelburn) / fuelburn", units="kg")
+    model.add_subsystem("fuel_diff", comp, promotes_inputs=["fuel_mass"], promotes_outputs=["fuel_diff"])
+    model.connect("AS_point_0.fuelburn", "fuel_diff.fuelburn")
+
+    # design variables
+    model.add_design_var("wing.twist_cp", lower=-15.0, upper=15.0, scaler=0.1)
+    model.add_design_var("wing.spar_thickness_cp", lower=0.003, upper=0.1, scaler=1e2)
+    model.add_design_var("wing.skin_thickness_cp", lower=0.003, upper=0.1, scaler=1e2)
+    model.add_design_var("wing.geometry.t_over_c_cp", lower=0.07, upper=0.2, scaler=10.0)
+    model.add_design_var("fuel_mass", lower=0.0, upper=2e5, scaler=1e-5)
+    model.add_design_var("alpha_maneuver", lower=-15.0, upper=15)
+
+    # minimize sum of CD
+    cd_names = ["CD{}".format(i) for i in range(num_points)]
+    model.add_subsystem('CD_sum_comp', om.AddSubtractComp('CD_sum', input_names=cd_names), promotes_outputs=['CD_sum'])
+    for cd_name, point_name in zip(cd_names, point_names):
+        model.connect(point_name + '.CD', 'CD_sum_comp.' + cd_name)
+    model.add_objective('CD_sum')
+
+    # --- CL constraints ---
+    # CL0 = 0.6
+    model.add_constraint("AS_point_0.CL", equals=0.6)   # NOTE: derivatives order: <CD0, CD1>, CL1, -CL0, CL0)
+
+    # CL1 - CLO = 0.2 (CLi - CL0 = 0.2 * i / (num_points - 1) with more points)
+    for i in range(1, num_points):
+        comp_name = 'CL_diff_comp{}'.format(i)
+        cl_diff_comp = om.ExecComp('CL_diff = CL1 - CL0 - {}'.format(0.2 * i / (num_points - 1)), units=None)
+        model.add_subsystem(comp_name, cl_diff_comp)
+        model.connect('AS_point_0.CL', comp_name + '.CL0')
+        model.connect(point_names[i] + '.CL', comp_name + '.CL1')
+        model.add_constraint(comp_name + '.CL_diff', equals=0.0)   # instead of CL1 = 0.8, impose CL1 = CL0 + 0.2
+
+    return point_names
+
+
+def set_driver(prob, point_names):
+    """
+    Set the driver and its recorder.
+
+    Parameters
+    ----------
+    prob : Problem
+        The problem.
+    point_names : list of str
+        Names of the aerostruct points.
+    """
+    ## Use these settings if you do not have pyOptSparse or SNOPT
+    prob.driver = om.ScipyOptimizeDriver()
+    prob.driver = om.pyOptSparseDriver()
+    prob.driver.options['optimizer'] = 'SNOPT'
+    prob.driver.options['print_results'] = True
+    prob.driver.opt_settings['Major iterations limit'] = 1
+
+    # # The following are the optimizer settings used for the EngOpt conference paper
+    # # Uncomment them if you can use SNOPT
+    # prob.driver = om.pyOptSparseDriver()
+    # prob.driver.options['optimizer'] = "SNOPT"
+    # prob.driver.opt_settings['Major optimality tolerance'] = 5e-6
+    # prob.driver.opt_settings['Major feasibility tolerance'] = 1e-8
+    # prob.driver.opt_settings['Major iterations limit'] = 200
+
+    recorder = om.SqliteRecorder("aerostruct.db")
+    prob.driver.add_recorder(recorder)
+
+    # We could also just use prob.driver.recording_options['includes']=['*'] here, but for large meshes the database file becomes extremely large. So we just select the variables we need.
+    includes = [
+        "alpha",
+        "rho",
+        "v",
+        "cg",
+        "wing.geometry.twist",
+        "wing.mesh",
+        "wing.skin_thickness",
+        "wing.spar_thickness",
+        "wing.t_over_c",
+        "wing.structural_mass",
+    ]
+    for point_name in point_names:
+        includes += [
+            point_name + ".cg",
+            point_name + ".coupled.wing_loads.loads",
+            point_name + ".coupled.wing.normals",
+            point_name + ".coupled.wing.widths",
+            point_name + ".coupled.aero_states.wing_sec_forces",
+            point_name + ".wing_perf.CL1",
+            point_name + ".coupled.wing.S_ref",
+            point_name + ".wing_perf.vonmises",
+            point_name + ".coupled.wing.def_mesh",
+        ]
+    prob.driver.recording_options["includes"] = includes
+
+    prob.driver.recording_options["record_objectives"] = True
+    prob.driver.recording_options["record_constraints"] = True
+    prob.driver.recording_options["record_desvars"] = True
+    prob.driver.recording_options["record_inputs"] = True
+
+
+def set_linear_solvers(prob, point_names, solver='krylov', use_cache=True, iprint=2):
+    """
+    Set the custom linear solvers of the coupled groups, after setup.
+
+    Parameters
+    ----------
+    prob : Problem
+        The problem.
+    point_names : list of str
+        Names of the aerostruct points.
+    solver : str
+        'krylov' for PETScKrylovCustom or 'direct' for DirectSolverCustom.
+    use_cache : bool
+        Value of the use_cache option of the linear solvers.
+    iprint : int
+        Print level of PETScKrylovCustom.
+
+    Returns
+    -------
+    list of LinearSolver
+        Linear solvers of the coupled groups.
+    """
+    linear_solvers = []
+    for point_name in point_names:
+        coupled = getattr(prob.model, point_name).coupled
+        if solver == 'direct':
+            coupled.linear_solver = DirectSolverCustom(use_cache=use_cache)
+        else:
+            coupled.linear_solver = PETScKrylovCustom(iprint=iprint, assemble_jac=True, use_cache=use_cache)
+        coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
+        linear_solvers.append(coupled.linear_solver)
+
+    return linear_solvers
+
+
+if __name__ == "__main__":
+    # Create the problem and assign the model group
+    prob = om.Problem()
+    point_names = build_model(prob.model)
+
+    set_driver(prob, point_names)
+
+    # Set up the problem
+    prob.setup(mode='rev', check=True)
+
+    # ==============================
+    #  Set linear solvers here
+    # ==============================
+    # --- Use Krylov solver for aerostructural coupled adjoint ---
+    # prob.model.AS_point_0.coupled.linear_solver = om.PETScKrylov(iprint=2, assemble_jac=True)
+    # prob.model.AS_point_0.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
+    # prob.model.AS_point_1.coupled.linear_solver = om.PETScKrylov(iprint=2, assemble_jac=True)
+    # prob.model.AS_point_1.coupled.linear_solver.precon = om.LinearRunOnce(iprint=-1)
+
+    # --- Use Custom Krylov solver with solution caching ---
+    linear_solvers = set_linear_solvers(prob, point_names, solver='krylov', use_cache=True)
+
+    # --- Use Custom Direct solver with solution caching ---
+    # linear_solvers = set_linear_solvers(prob, point_names, solver='direct', use_cache=True)
+
+    prob.run_model()
+
+    print("\n --- compute totals --- \n")
+    totals = prob.compute_totals()
+    print('Derivatives of CL_diff w.r.t. twist_cp =', totals[('CL_diff_comp1.CL_diff', 'wing.twist_cp')])
+
+    # statistics of the custom linear solvers (solves, cache hits, timings)
+    for linear_solver in linear_solvers:
+        print(linear_solver.stats)
+
+    # om.n2(prob)
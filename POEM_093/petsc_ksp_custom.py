@@ -1,9 +1,14 @@
 """LinearSolver that uses PetSC KSP to solve for a system's derivatives.
-Modified to use solution caching.
-The modifications can be found by searching for "EDIT-CACHE" comments in this file.
+Modified to use solution caching, Krylov subspace recycling, persistent PETSc vectors and a
+persistent KSP context, native PETSc preconditioners and matrices, and to record solver
+statistics.
+The modifications can be found by searching for "EDIT-CACHE", "EDIT-RECYCLE", "EDIT-VEC",
+"EDIT-KSP", "EDIT-PC", "EDIT-MAT" and "EDIT-STATS" comments in this file.
 """
 
 import numpy as np
+import scipy.linalg
+import scipy.sparse
 import os
 import sys
 import time
@@ -11,6 +16,9 @@ import time
 from openmdao.solvers.solver import LinearSolver
 from openmdao.utils.mpi import check_mpi_env
 
+from solution_cache import SolutionCache, CACHE_MODES, get_unscale_factors
+from solver_stats import SolverStats
+
 use_mpi = check_mpi_env()
 if use_mpi is not False:
     try:
@@ -23,6 +31,11 @@ if use_mpi is not False:
 else:
     PETSc = None
 
+# EDIT-PC
+# PETSc preconditioners that can be built from the assembled jacobian. 'python' uses the
+# OpenMDAO precon solver.
+PC_TYPES = ['python', 'none', 'jacobi', 'bjacobi', 'sor', 'ilu', 'icc', 'asm', 'gamg', 'lu']
+
 KSP_TYPES = [
     "richardson",
     "chebyshev",
@@ -105,6 +118,31 @@ def _get_petsc_vec_array_old(vec):
     return vec.getArray()
 
 
+# EDIT-VEC
+def _wrap_linear_vector(vec, comm):
+    """
+    Return a PETSc vector sharing the memory of an OpenMDAO vector.
+
+    Parameters
+    ----------
+    vec : <Vector>
+        OpenMDAO vector to wrap.
+    comm : MPI.Comm
+        Communicator of the owning system.
+
+    Returns
+    -------
+    PETSc.Vec or None
+        PETSc vector sharing the memory of vec, or None if the values of vec are not stored in a
+        contiguous array of PETSc scalars (e.g. the real part of a vector allocated for complex
+        step).
+    """
+    array = vec.asarray()
+    if array.dtype != PETSc.ScalarType or not array.flags.c_contiguous:
+        return None
+    return PETSc.Vec().createWithArray(array, comm=comm)
+
+
 if PETSc:
     try:
         petsc_version = petsc4py.__version__
@@ -118,6 +156,49 @@ else:
     _get_petsc_vec_array = _get_petsc_vec_array_old
 
 
+def _harmonic_ritz_space(W, AW, size):
+    """
+    Compute a recycle space of harmonic Ritz vectors from a set of vectors and their images.
+
+    The harmonic Ritz vectors with the smallest harmonic Ritz values approximate the
+    eigenvectors of the operator with the smallest eigenvalues, which are the directions that
+    slow down Krylov convergence the most (as in GCRO-DR).
+
+    Parameters
+    ----------
+    W : ndarray
+        Vectors spanning the search space, one per row.
+    AW : ndarray
+        The operator applied to each row of W.
+    size : int
+        Maximum dimension of the recycle space.
+
+    Returns
+    -------
+    tuple of (ndarray, ndarray) or None
+        Rows of U and C such that C = A U and the rows of C are orthonormal, or None if the
+        search space is empty.
+    """
+    # Orthonormalize the images (with column pivoting to drop dependent directions) and apply
+    # the same transformation to W, so that A * Wq = Q.
+    q, r, piv = scipy.linalg.qr(AW.T, mode='economic', pivoting=True)
+    diag = np.abs(np.diag(r))
+    if diag.size == 0 or diag[0] == 0.0:
+        return None
+    rank = np.count_nonzero(diag > 1e-12 * diag[0])
+    q = q[:, :rank]
+    Wq = scipy.linalg.solve_triangular(r[:rank, :rank], W[piv[:rank]], trans='T')
+
+    # Harmonic Ritz problem (AW)^T (AW) g = theta (AW)^T W g reduces to G g = g / theta.
+    vals, vecs = np.linalg.eig(q.T.dot(Wq.T))
+    sel = vecs[:, np.argsort(-np.abs(vals))[:size]]
+
+    # Real basis for the selected (possibly complex) eigenvectors.
+    basis = scipy.linalg.orth(np.hstack([sel.real, sel.imag]))[:, :size]
+
+    return basis.T.dot(Wq), basis.T.dot(q.T)
+
+
 class Monitor(object):
     """
     Prints output from PETSc's KSP solvers.
@@ -165,7 +246,9 @@ class Monitor(object):
         self._norm = norm
 
         self._solver._mpi_print(counter, norm, norm / self._norm0)
-        self._solver._iter_count += 1
+        # EDIT-STATS
+        # the monitor is also called for the initial residual (counter 0), which isn't an iteration
+        self._solver._iter_count = counter
 
 
 class PETScKrylovCustom(LinearSolver):
@@ -181,8 +264,39 @@ class PETScKrylovCustom(LinearSolver):
     ----------
     precon : Solver
         Preconditioner for linear solve. Default is None for no preconditioner.
+    stats : SolverStats
+        Counters and timers of the solves, cache hits and Krylov iterations.
     _ksp : dist
         Dictionary of KSP instances (keyed on vector name).
+    _cache : SolutionCache or None
+        Cache of RHS vectors and solutions, used when the use_cache option is True.
+    _recycle_space : tuple of (ndarray, ndarray) or None
+        Rows of U and C = A U (with orthonormal rows) spanning the recycled Krylov subspace.
+    _recycle_mode : str or None
+        Derivative mode for which the recycle space was computed.
+    _recycle_pairs : list or None
+        Krylov vectors and their images collected by mult during a solve with recycling.
+    _sol_array : ndarray or None
+        Work array for the solution, wrapped by _sol_petsc_vec.
+    _rhs_array : ndarray or None
+        Work array for the RHS, wrapped by _rhs_petsc_vec.
+    _sol_petsc_vec : PETSc.Vec or None
+        PETSc vector sharing the memory of _sol_array.
+    _rhs_petsc_vec : PETSc.Vec or None
+        PETSc vector sharing the memory of _rhs_array.
+    _linear_petsc_vecs : tuple or None
+        PETSc vectors sharing the memory of the d_outputs and d_residuals vectors of the system,
+        or None for a vector that can't be wrapped.
+    _ksp_tols : tuple or None
+        Iteration limit and tolerances last passed to the KSP context.
+    _petsc_jac : PETSc.Mat or None
+        Scaled assembled jacobian (transposed in rev mode) from which the native preconditioner
+        is built, and which is the KSP operator if native_mat is True.
+    _petsc_jac_mode : str or None
+        Derivative mode of _petsc_jac, or None if it must be rebuilt.
+    _unscale_factors : tuple or None
+        Factors converting the scaled (d_outputs, d_residuals) arrays to unscaled values, or
+        None if they must be recomputed.
     """
 
     SOLVER = 'LN: PETScKrylov'
@@ -203,6 +317,32 @@ class PETScKrylovCustom(LinearSolver):
         # initialize preconditioner to None
         self.precon = None
 
+        # EDIT-CACHE
+        self._cache = None
+
+        # EDIT-RECYCLE
+        self._recycle_space = None
+        self._recycle_mode = None
+        self._recycle_pairs = None
+
+        # EDIT-VEC
+        self._sol_array = None
+        self._rhs_array = None
+        self._sol_petsc_vec = None
+        self._rhs_petsc_vec = None
+        self._linear_petsc_vecs = None
+
+        # EDIT-KSP
+        self._ksp_tols = None
+
+        # EDIT-STATS
+        self.stats = SolverStats(self.SOLVER)
+
+        # EDIT-PC
+        self._petsc_jac = None
+        self._petsc_jac_mode = None
+        self._unscale_factors = None
+
     def _declare_options(self):
         """
         Declare options before kwargs are processed in the init method.
@@ -222,6 +362,47 @@ class PETScKrylovCustom(LinearSolver):
         # EDIT-CACHE
         # --- option for caching. Default: no cache ---
         self.options.declare('use_cache', types=bool, default=False)
+        self.options.declare('cache_size', types=int, default=None, allow_none=True, lower=0,
+                             desc='Maximum number of cached solutions. Default is no limit.')
+        self.options.declare('cache_bytes', types=int, default=None, allow_none=True, lower=0,
+                             desc='Maximum memory in bytes used by the cached RHS and solution '
+                             'vectors. Default is no limit.')
+        self.options.declare('cache_eviction', default='lru', values=['lru', 'lfu'],
+                             desc="Policy for evicting cached solutions when the cache is full, "
+                             "'lru' (least recently used) or 'lfu' (least frequently used).")
+        self.options.declare('cache_mode', default='parallel', values=CACHE_MODES,
+                             desc="Reuse a cached solution when the RHS is parallel to a cached "
+                             "RHS ('parallel'), or combine cached solutions when the RHS is in "
+                             "the span of the cached RHS vectors ('subspace').")
+
+        # EDIT-RECYCLE
+        self.options.declare('recycle', types=int, default=0, lower=0,
+                             desc='Dimension of the Krylov subspace that is kept between solves '
+                             'on the same linearization and deflated out of subsequent solves '
+                             '(GCRO-DR style). Default is 0, which disables recycling.')
+
+        # EDIT-KSP
+        self.options.declare('warm_start', types=bool, default=False,
+                             desc='When the RHS is not found in the cache, start the Krylov '
+                             'iterations from the combination of cached solutions closest to '
+                             'the solution. Requires use_cache=True; setup raises an error '
+                             'otherwise.')
+
+        # EDIT-PC
+        self.options.declare('pc_type', default='python', values=PC_TYPES,
+                             desc="Preconditioner. 'python' (default) applies the precon "
+                             "solver through OpenMDAO on every Krylov iteration. Any other "
+                             "value is a PETSc preconditioner built once per linearization "
+                             "from the assembled jacobian and applied natively by PETSc "
+                             "(requires assemble_jac=True and a single process); the precon "
+                             "solver is then not used.")
+
+        # EDIT-MAT
+        self.options.declare('native_mat', types=bool, default=False,
+                             desc="If True, hand the assembled jacobian to PETSc as an AIJ "
+                             "matrix, so that the Krylov matrix-vector products run in PETSc "
+                             "instead of calling apply_linear (requires assemble_jac=True and "
+                             "a single process, and is not compatible with recycle).")
 
         # changing the default maxiter from the base class
         self.options['maxiter'] = 100
@@ -252,6 +433,45 @@ class PETScKrylovCustom(LinearSolver):
         if self.precon is not None:
             self.precon._setup_solvers(self._system(), self._depth + 1)
 
+        # EDIT-VEC
+        # --- allocate the work arrays and the PETSc vectors wrapping them once ---
+        lsize = np.sum(system._var_sizes['output'][system.comm.rank, :])
+        self._sol_array = np.zeros(lsize)
+        self._rhs_array = np.zeros(lsize)
+        self._sol_petsc_vec = PETSc.Vec().createWithArray(self._sol_array, comm=system.comm)
+        self._rhs_petsc_vec = PETSc.Vec().createWithArray(self._rhs_array, comm=system.comm)
+        # and the linear vectors of the system, so that mult copies between PETSc vectors
+        self._linear_petsc_vecs = (_wrap_linear_vector(system._doutputs, system.comm),
+                                   _wrap_linear_vector(system._dresiduals, system.comm))
+
+        # EDIT-CACHE
+        # --- the cached vectors are distributed like the solver vectors, so start over ---
+        self._cache = None
+
+        # EDIT-RECYCLE
+        if self.options['recycle'] > 0 and system.comm.size > 1:
+            raise RuntimeError(f"{self.msginfo}: Krylov subspace recycling is not supported "
+                               "when the vectors are distributed over several processes.")
+        if self.options['recycle'] > 0 and self.options['native_mat']:
+            raise RuntimeError(f"{self.msginfo}: Krylov subspace recycling is not supported "
+                               "with native_mat=True.")
+
+        # EDIT-KSP
+        if self.options['warm_start'] and not self.options['use_cache']:
+            raise RuntimeError(f"{self.msginfo}: warm_start=True requires use_cache=True.")
+
+        # --- the KSP context depends on the vector sizes, so rebuild it after a new setup ---
+        self._ksp = None
+        self._ksp_tols = None
+
+        # EDIT-PC
+        self._petsc_jac = None
+        self._petsc_jac_mode = None
+        self._unscale_factors = None
+
+        # EDIT-STATS
+        self.stats.name = self.msginfo
+
     def _set_solver_print(self, level=2, type_='all'):
         """
         Control printing for solvers and subsolvers in the model.
@@ -270,6 +490,39 @@ class PETScKrylovCustom(LinearSolver):
         if self.precon is not None and type_ != 'NL':
             self.precon._set_solver_print(level=level, type_=type_)
 
+    def _apply_jac(self, in_array):
+        """
+        Apply the Jacobian matrix to an array.
+
+        Parameters
+        ----------
+        in_array : ndarray
+            Incoming array.
+
+        Returns
+        -------
+        ndarray
+            A copy of the matrix-vector product.
+        """
+        system = self._system()
+
+        if self._mode == 'fwd':
+            x_vec = system._doutputs
+            b_vec = system._dresiduals
+        else:  # rev
+            x_vec = system._dresiduals
+            b_vec = system._doutputs
+
+        # set value of x vector to provided value
+        x_vec.set_val(in_array)
+
+        # apply linear
+        scope_out, scope_in = system._get_matvec_scope()
+        system._apply_linear(self._assembled_jac, self._rel_systems, self._mode,
+                             scope_out, scope_in)
+
+        return b_vec.asarray(copy=True)
+
     def mult(self, mat, in_vec, result):
         """
         Apply Jacobian matrix (KSP Callback).
@@ -296,15 +549,24 @@ class PETScKrylovCustom(LinearSolver):
         # assign x and b vectors based on mode
         system = self._system()
 
+        # EDIT-VEC
+        doutputs_petsc, dresiduals_petsc = self._linear_petsc_vecs
+
         if self._mode == 'fwd':
             x_vec = system._doutputs
             b_vec = system._dresiduals
+            x_petsc, b_petsc = doutputs_petsc, dresiduals_petsc
         else:  # rev
             x_vec = system._dresiduals
             b_vec = system._doutputs
+            x_petsc, b_petsc = dresiduals_petsc, doutputs_petsc
 
-        # set value of x vector to KSP provided value
-        x_vec.set_val(_get_petsc_vec_array(in_vec))
+        # set value of x vector to KSP provided value. The KSP owns in_vec and result, so one copy
+        # each way is needed, but it is a single VecCopy into the wrapped memory of the vector.
+        if x_petsc is None:
+            x_vec.asarray()[:] = _get_petsc_vec_array(in_vec)
+        else:
+            in_vec.copy(x_petsc)
 
         # apply linear
         scope_out, scope_in = system._get_matvec_scope()
@@ -312,7 +574,21 @@ class PETScKrylovCustom(LinearSolver):
                              scope_out, scope_in)
 
         # stuff resulting value of b vector into result for KSP
-        result.array[:] = b_vec.asarray()
+        if b_petsc is None:
+            result.array[:] = b_vec.asarray()
+        else:
+            b_petsc.copy(result)
+
+        # EDIT-RECYCLE
+        if self._recycle_pairs is not None:
+            # keep the Krylov vector and its image to update the recycle space after the solve
+            self._recycle_pairs.append((x_vec.asarray(copy=True), b_vec.asarray(copy=True)))
+
+        if self._recycle_space is not None:
+            # deflate the recycle space out of the operator: (I - C C^T) A
+            C = self._recycle_space[1]
+            result_array = result.array
+            result_array -= C.T.dot(C.dot(result_array))
 
     def _linearize_children(self):
         """
@@ -330,14 +606,50 @@ class PETScKrylovCustom(LinearSolver):
         """
         Perform any required linearization operations such as matrix factorization.
         """
-        if self.precon is not None:
+        system = self._system()
+        pc_type = self.options['pc_type']
+
+        if self.precon is not None and pc_type == 'python':
             self.precon._linearize()
 
+        # EDIT-PC
+        # --- the native preconditioner (and matrix) is rebuilt from the new jacobian ---
+        # EDIT-MAT
+        self._petsc_jac_mode = None
+        native = pc_type != 'python' or self.options['native_mat']
+        if native:
+            feature = "native_mat=True" if pc_type == 'python' else f"pc_type '{pc_type}'"
+            if self._assembled_jac is None:
+                raise RuntimeError(f"{self.msginfo}: {feature} requires an assembled "
+                                   "jacobian (assemble_jac=True).")
+            if system.comm.size > 1:
+                raise RuntimeError(f"{self.msginfo}: {feature} is not supported when "
+                                   "the vectors are distributed over several processes.")
+
+        # EDIT-RECYCLE
+        # --- the recycle space is only valid for the current linearization ---
+        self._recycle_space = None
+
         # EDIT-CACHE
         # --- initialize cache ---
+        # The cached solutions are only valid for the current linearization.
         if self.options['use_cache']:
-            self._rhs_cache_list = []
-            self._sol_cache_list = []
+            if self._cache is None:
+                self._cache = SolutionCache(max_size=self.options['cache_size'],
+                                            max_bytes=self.options['cache_bytes'],
+                                            eviction=self.options['cache_eviction'],
+                                            mode=self.options['cache_mode'],
+                                            comm=system.comm)
+            else:
+                self._cache.clear()
+
+        # EDIT-KSP
+        # --- set up the KSP context and its preconditioner once for all the solves of this
+        # linearization ---
+        # EDIT-PC: a native preconditioner (or matrix) is set up by the first solve, once the
+        # derivative mode (and thus the matrix) is known.
+        if not system.under_complex_step and not native:
+            self._get_ksp_solver(system).setUp()
 
     def solve(self, mode, rel_systems=None):
         """
@@ -352,7 +664,7 @@ class PETScKrylovCustom(LinearSolver):
         rel_systems : set of str
             Names of systems relevant to the current solve.
         """
-        time0 = time.time()
+        time0 = time.perf_counter()
 
         self._rel_systems = rel_systems
         self._mode = mode
@@ -376,63 +688,118 @@ class PETScKrylovCustom(LinearSolver):
             x_vec = system._dresiduals
             b_vec = system._doutputs
 
-        # create numpy arrays to interface with PETSc
-        sol_array = x_vec.asarray(copy=True)
-        rhs_array = b_vec.asarray(copy=True)
+        # EDIT-VEC
+        # copy into the work arrays shared with the persistent PETSc vectors
+        sol_array = self._sol_array
+        rhs_array = self._rhs_array
+        sol_array[:] = x_vec.asarray()
+        rhs_array[:] = b_vec.asarray()
 
         # EDIT-CACHE
         # --------------------------------------------------
         # --- check if we can reuse the cached solutions ---
         if self.options['use_cache']:
-            for i, rhs_cache in enumerate(self._rhs_cache_list):
-                # Check if the RHS vector is the same as a cached vector. This part is not necessary, but is less expensive than checking if two vectors are parallel.
-                if np.allclose(rhs_array, rhs_cache, rtol=1e-12, atol=1e-12):
-                    x_vec.set_val(self._sol_cache_list[i])
-                    print('*** use caching in Krylov with scaler = 1 | time = %.2E s ***' % (time.time() - time0))
-                    return
-                # Check if the RHS vector is equal to -1 * cached vector.
-                elif np.allclose(rhs_array, -rhs_cache, rtol=1e-12, atol=1e-12):
-                    x_vec.set_val(-self._sol_cache_list[i])
-                    print('*** use caching in Krylov with scaler = -1 | time = %.2E s ***' % (time.time() - time0))
-                    return
-                
-                # Check if the RHS vector and a cached vector are parallel
-                # NOTE: the following parallel vector check may be inaccurate for some cases. maybe should tighten the tolerance?
-                dot_product = np.dot(rhs_array, rhs_cache)
-                norm1 = np.linalg.norm(rhs_array)
-                norm2 = np.linalg.norm(rhs_cache)
-                if np.isclose(abs(dot_product), norm1 * norm2, rtol=1e-12, atol=1e-12):
-                    # two vectors are parallel, thus we can use the cache.
-                    scaler = dot_product / norm2**2
-                    x_vec.set_val(self._sol_cache_list[i] * scaler)
-                    print('*** use caching in Krylov with scaler = %.2E | time = %.2E s ***' % (scaler, time.time() - time0))
-                    return
-        
-        # TODO: reset cache optimization iteration
+            # fwd and rev solutions are solutions of different systems
+            self._cache.set_deriv_mode(mode)
+            # Compare b against all cached RHS vectors at once.
+            coefs = self._cache.lookup(rhs_array)
+            if coefs is not None:
+                x_vec.set_val(self._cache.solution(coefs))
+                # EDIT-STATS
+                self.stats.record_hit(self._cache.hit_kind(coefs), time.perf_counter() - time0)
+                return
+
+            # EDIT-KSP
+            # --- otherwise start from the closest combination of cached solutions ---
+            if options['warm_start']:
+                coefs = self._cache.guess(rhs_array)
+                if coefs is not None:
+                    sol_array[:] = self._cache.solution(coefs)
         # --------------------------------------------------
 
-        # create PETSc vectors from numpy arrays
-        sol_petsc_vec = PETSc.Vec().createWithArray(sol_array, comm=system.comm)
-        rhs_petsc_vec = PETSc.Vec().createWithArray(rhs_array, comm=system.comm)
+        time0 = time.perf_counter()
+
+        # EDIT-RECYCLE
+        # --------------------------------------------------
+        # --- deflate the recycle space out of the RHS ---
+        recycle = options['recycle']
+        cache_rhs_array = rhs_array
+        if recycle > 0:
+            if self._recycle_mode != mode:
+                self._recycle_space = None
+                self._recycle_mode = mode
+
+            if self._recycle_space is not None:
+                # x = U C^T b + (I - U C^T A) y, where y solves (I - C C^T) A y = (I - C C^T) b
+                U, C = self._recycle_space
+                coefs = C.dot(rhs_array)
+                x0 = U.T.dot(coefs)
+                if options['use_cache']:
+                    # the work array is deflated in place, so keep the original RHS to cache it
+                    cache_rhs_array = rhs_array.copy()
+                rhs_array -= C.T.dot(coefs)
+
+            self._recycle_pairs = []
+        # --------------------------------------------------
 
         # run PETSc solver
         self._iter_count = 0
         ksp = self._get_ksp_solver(system)
-        ksp.setTolerances(max_it=maxiter, atol=atol, rtol=rtol)
-        ksp.solve(rhs_petsc_vec, sol_petsc_vec)
+
+        # EDIT-KSP
+        tols = (maxiter, atol, rtol)
+        if tols != self._ksp_tols:
+            ksp.setTolerances(max_it=maxiter, atol=atol, rtol=rtol)
+            self._ksp_tols = tols
+
+        # EDIT-PC
+        # --- build the native preconditioner once per linearization and mode ---
+        native_mat = options['native_mat']
+        if (native_mat or options['pc_type'] != 'python') and self._petsc_jac_mode != mode:
+            self._petsc_jac = self._get_scaled_petsc_jac(mode)
+            if native_mat:
+                # EDIT-MAT
+                # --- the matrix-vector products are computed by PETSc, mult is not called ---
+                ksp.setOperators(self._petsc_jac, self._petsc_jac)
+            else:
+                ksp.setOperators(ksp.getOperators()[0], self._petsc_jac)
+            self._petsc_jac_mode = mode
+
+        ksp.solve(self._rhs_petsc_vec, self._sol_petsc_vec)
+
+        # EDIT-RECYCLE
+        # --------------------------------------------------
+        # --- recover the full solution and update the recycle space ---
+        if recycle > 0:
+            pairs = self._recycle_pairs
+            self._recycle_pairs = None
+
+            if self._recycle_space is not None:
+                U, C = self._recycle_space
+                sol_array += x0 - U.T.dot(C.dot(self._apply_jac(sol_array)))
+
+                W = np.vstack([U] + [z for z, _ in pairs])
+                AW = np.vstack([C] + [az for _, az in pairs])
+            elif pairs:
+                W = np.array([z for z, _ in pairs])
+                AW = np.array([az for _, az in pairs])
+            else:
+                W = None
+
+            if W is not None:
+                self._recycle_space = _harmonic_ritz_space(W, AW, recycle)
+        # --------------------------------------------------
 
         # stuff the result into the x vector
         x_vec.set_val(sol_array)
 
-        sol_petsc_vec = rhs_petsc_vec = None
-
-        print('*** solved in Krylov | time = %.2E s ***' % (time.time() - time0))
+        # EDIT-STATS
+        self.stats.record_miss(time.perf_counter() - time0, iterations=self._iter_count)
 
         # EDIT-CACHE
         # --- append the current solution to the cache ---
         if self.options['use_cache']:
-            self._rhs_cache_list.append(rhs_array.copy())
-            self._sol_cache_list.append(sol_array.copy())
+            self._cache.add(cache_rhs_array, sol_array)
 
     def apply(self, mat, in_vec, result):
         """
@@ -473,8 +840,9 @@ class PETScKrylovCustom(LinearSolver):
             # stuff resulting value of x vector into result for KSP
             result.array[:] = x_vec.asarray()
         else:
-            # no preconditioner, just pass back the incoming vector
-            result.array[:] = _get_petsc_vec_array(in_vec)
+            # EDIT-VEC
+            # no preconditioner, just pass back the incoming vector (copied by PETSc)
+            in_vec.copy(result)
 
     def _get_ksp_solver(self, system):
         """
@@ -517,8 +885,60 @@ class PETScKrylovCustom(LinearSolver):
         ksp.setMonitor(Monitor(self))
         ksp.setInitialGuessNonzero(True)
 
+        # EDIT-PC
         pc_mat = ksp.getPC()
-        pc_mat.setType('python')
-        pc_mat.setPythonContext(self)
+        if self.options['pc_type'] == 'python':
+            pc_mat.setType('python')
+            pc_mat.setPythonContext(self)
+        else:
+            pc_mat.setType(self.options['pc_type'])
+            pc_mat.setFromOptions()
 
         return ksp
+
+    # EDIT-PC
+    def _get_scaled_petsc_jac(self, mode):
+        """
+        Return the assembled jacobian as a PETSc AIJ matrix acting on the scaled vectors.
+
+        Parameters
+        ----------
+        mode : str
+            'fwd' or 'rev'. In 'rev' mode the transposed jacobian is returned.
+
+        Returns
+        -------
+        PETSc.Mat
+            Jacobian, scaled like the vectors of the Krylov iterations.
+        """
+        system = self._system()
+        matrix = self._assembled_jac._int_mtx._matrix
+
+        # AssembledJacobians are unscaled: A_scaled = diag(1 / b_factor) A diag(x_factor)
+        out_factor, res_factor = self._get_unscale_factors()
+        if mode == 'fwd':
+            b_factor, x_factor = res_factor, out_factor
+        else:
+            b_factor, x_factor = out_factor, res_factor
+            matrix = matrix.T
+
+        matrix = scipy.sparse.csr_matrix(scipy.sparse.diags(1.0 / b_factor) @ matrix @
+                                         scipy.sparse.diags(x_factor))
+
+        return PETSc.Mat().createAIJ(matrix.shape,
+                                     csr=(matrix.indptr, matrix.indices, matrix.data),
+                                     comm=system.comm)
+
+    # EDIT-PC
+    def _get_unscale_factors(self):
+        """
+        Return the factors that convert scaled d_outputs and d_residuals arrays to unscaled.
+
+        Returns
+        -------
+        tuple of (ndarray, ndarray)
+            Factors for d_outputs and d_residuals.
+        """
+        if self._unscale_factors is None:
+            self._unscale_factors = get_unscale_factors(self._system())
+        return self._unscale_factors
@@ -0,0 +1,542 @@
+"""Cache of linear solutions used by the POEM_093 prototype solvers.
+
+The cached right-hand-side (RHS) vectors are stored as rows of one preallocated 2-D array
+together with their norms, so a new RHS (or a block of RHS vectors) is checked against every
+cached vector with a single matrix product.
+
+Two lookup modes are available:
+
+- 'parallel': a cached solution is reused when the new RHS is parallel to one cached RHS, i.e.
+  when the residual of the new RHS against the scaled cached RHS is below tolerance.
+- 'subspace': the cached RHS vectors are kept orthonormal (incremental Gram-Schmidt, i.e. a QR
+  factorization updated one column at a time) and the stored solutions are transformed
+  accordingly. A new RHS is projected onto their span, and the same linear combination of
+  solutions is returned when the projection residual is below tolerance.
+
+The cache can be bounded by a number of entries and/or a memory budget. When it is full, the
+least recently used ('lru') or least frequently used ('lfu') entry is evicted.
+
+When the vectors are distributed over the processes of an MPI communicator, each process only
+stores its own part of the cached vectors, and the dot products and norms are summed over the
+processes. A lookup needs a single allreduce: the local parts of the cached and new RHS vectors
+are reduced to triangular factors (QR), and stacking the factors of all processes gives a small
+matrix whose columns have the same inner products as the distributed vectors. The dot products,
+norms and residuals of the lookup are then computed on that matrix. Since every process gets the
+same stacked factors, all processes take the same decisions.
+
+Dot products are conjugated, so complex vectors are handled; complex and real vectors are never
+mixed in the cache.
+
+The module also provides get_unscale_factors, used by both solvers to convert between the scaled
+linear vectors (in which the cached vectors are stored) and the unscaled assembled jacobian.
+"""
+
+import numpy as np
+
+
+CACHE_MODES = ['parallel', 'subspace']
+
+
+class SolutionCache(object):
+    """
+    Store pairs of RHS and solution vectors and reuse them for new RHS vectors.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of rows to preallocate. The storage grows when it is full.
+    rtol : float
+        Relative tolerance on the residual of the combination of cached RHS vectors: the new
+        RHS b is reused when ||b - sum(c_i * b_i)|| <= rtol * ||b||. In 'parallel' mode this is
+        the sine of the angle between b and the nearest cached RHS.
+    max_size : int or None
+        Maximum number of cached vectors. None means no limit.
+    max_bytes : int or None
+        Maximum memory in bytes used by the cached RHS and solution vectors (over all processes).
+        None means no limit.
+    eviction : str
+        Eviction policy when the cache is full, 'lru' or 'lfu'.
+    mode : str
+        Lookup mode, 'parallel' or 'subspace'.
+    comm : MPI.Comm or None
+        Communicator over which the vectors are distributed. None for serial vectors.
+
+    Attributes
+    ----------
+    _capacity : int
+        Number of allocated rows.
+    _count : int
+        Number of cached vectors.
+    _rhs : ndarray or None
+        Local part of the cached RHS vectors, one per row. In 'subspace' mode these are
+        orthonormal.
+    _sol : ndarray or None
+        Local part of the cached solution vectors, one per row.
+    _norms : ndarray or None
+        Global norms of the cached RHS vectors.
+    _rtol : float
+        Relative tolerance of the lookup.
+    _max_size : int or None
+        Maximum number of cached vectors.
+    _max_bytes : int or None
+        Maximum memory used by the cached vectors.
+    _eviction : str
+        Eviction policy, 'lru' or 'lfu'.
+    _mode : str
+        Lookup mode, 'parallel' or 'subspace'.
+    _limit : int or None
+        Maximum number of cached vectors for the current vector size.
+    _tick : int
+        Counter incremented on every add or hit, used to order entries by last use.
+    _last_used : ndarray or None
+        Value of _tick when each entry was last added or used.
+    _hits : ndarray or None
+        Number of times each entry has been used.
+    _comm : MPI.Comm or None
+        Communicator over which the vectors are distributed.
+    _deriv_mode : str or None
+        Derivative mode ('fwd' or 'rev') of the cached solutions.
+    """
+
+    def __init__(self, capacity=16, rtol=1e-12, max_size=None, max_bytes=None, eviction='lru',
+                 mode='parallel', comm=None):
+        """
+        Initialize attributes.
+        """
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown cache eviction policy '{eviction}'. "
+                             "Must be 'lru' or 'lfu'.")
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}'. Must be one of {CACHE_MODES}.")
+
+        self._capacity = max(int(capacity), 1)
+        self._rtol = rtol
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._eviction = eviction
+        self._mode = mode
+        self._limit = None
+        self._count = 0
+        self._tick = 0
+        self._rhs = None
+        self._sol = None
+        self._norms = None
+        self._last_used = None
+        self._hits = None
+        self._comm = comm if comm is not None and comm.size > 1 else None
+        self._deriv_mode = None
+
+    def __len__(self):
+        """
+        Return the number of cached vectors.
+
+        Returns
+        -------
+        int
+            Number of cached vectors.
+        """
+        return self._count
+
+    def clear(self):
+        """
+        Remove all cached vectors, keeping the allocated storage.
+        """
+        self._count = 0
+
+    def set_deriv_mode(self, mode):
+        """
+        Clear the cache if the derivative mode differs from the mode of the cached solutions.
+
+        The solutions of fwd solves (A x = b) and rev solves (A^T x = b) on the same
+        linearization must not be mixed, so this must be called before every lookup.
+
+        Parameters
+        ----------
+        mode : str
+            'fwd' or 'rev'.
+        """
+        if mode != self._deriv_mode:
+            self._count = 0
+            self._deriv_mode = mode
+
+    def _sum(self, arr):
+        """
+        Sum an array over all processes.
+
+        Parameters
+        ----------
+        arr : ndarray
+            Local values.
+
+        Returns
+        -------
+        ndarray
+            Sum of arr over the processes of the communicator.
+        """
+        if self._comm is None:
+            return arr
+        total = np.empty_like(arr)
+        self._comm.Allreduce(np.ascontiguousarray(arr), total)
+        return total
+
+    def _condense(self, vectors):
+        """
+        Replace distributed column vectors by small columns with the same inner products.
+
+        Parameters
+        ----------
+        vectors : ndarray
+            Local part of the vectors, stored as the columns of an (n, c) array.
+
+        Returns
+        -------
+        ndarray
+            (p * c, c) array S, where p is the number of processes, such that S^H S is the
+            global V^H V for the distributed vectors V. The R factors of the local QR
+            factorizations are stacked by rank with a single allreduce.
+        """
+        ncol = vectors.shape[1]
+        local = np.zeros((self._comm.size * ncol, ncol), dtype=vectors.dtype)
+        if vectors.shape[0] > 0:
+            r = np.linalg.qr(vectors, mode='r')
+            start = self._comm.rank * ncol
+            local[start:start + r.shape[0]] = r
+        return self._sum(local)
+
+    def _get_limit(self, size, dtype):
+        """
+        Return the maximum number of cached vectors of the given size.
+
+        Parameters
+        ----------
+        size : int
+            Local length of the cached vectors.
+        dtype : dtype
+            Data type of the cached vectors.
+
+        Returns
+        -------
+        int or None
+            Maximum number of cached vectors, or None if there is no limit.
+        """
+        limit = self._max_size
+        if self._max_bytes is not None:
+            # The limit must be the same on all processes, so use the global vector size.
+            size = int(self._sum(np.array([size]))[0])
+            # Each entry stores one RHS and one solution vector.
+            nrows = self._max_bytes // (2 * size * np.dtype(dtype).itemsize)
+            limit = nrows if limit is None else min(limit, nrows)
+        return limit
+
+    def _allocate(self, size, dtype):
+        """
+        Allocate (or grow) the storage arrays.
+
+        Parameters
+        ----------
+        size : int
+            Length of the cached vectors.
+        dtype : dtype
+            Data type of the cached vectors.
+        """
+        if self._rhs is None or self._rhs.shape[1] != size or self._rhs.dtype != dtype:
+            self._count = 0
+            self._limit = limit = self._get_limit(size, dtype)
+            if limit is not None:
+                self._capacity = max(min(self._capacity, limit), 1)
+            self._rhs = np.empty((self._capacity, size), dtype=dtype)
+            self._sol = np.empty((self._capacity, size), dtype=dtype)
+            self._norms = np.empty(self._capacity)
+            self._last_used = np.zeros(self._capacity, dtype=int)
+            self._hits = np.zeros(self._capacity, dtype=int)
+        elif self._count == self._capacity and (self._limit is None or
+                                                self._capacity < self._limit):
+            self._capacity *= 2
+            if self._limit is not None:
+                self._capacity = min(self._capacity, self._limit)
+            for name in ('_rhs', '_sol', '_norms', '_last_used', '_hits'):
+                old = getattr(self, name)
+                new = np.empty((self._capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self._count] = old[:self._count]
+                setattr(self, name, new)
+
+    def _evict(self):
+        """
+        Remove one entry according to the eviction policy.
+
+        The last entry is moved into the freed row. In 'subspace' mode the remaining rows are
+        still orthonormal, so no refactorization is needed.
+        """
+        k = self._count
+        if self._eviction == 'lfu':
+            # Fewest hits first, ties broken by least recent use.
+            i = np.lexsort((self._last_used[:k], self._hits[:k]))[0]
+        else:
+            i = np.argmin(self._last_used[:k])
+
+        last = k - 1
+        if i != last:
+            for arr in (self._rhs, self._sol, self._norms, self._last_used, self._hits):
+                arr[i] = arr[last]
+        self._count = last
+
+    def add(self, rhs, sol):
+        """
+        Add a RHS vector and its solution to the cache.
+
+        A zero RHS is not cached because its solution is trivial. If the cache is full, an
+        existing entry is evicted according to the eviction policy.
+
+        Parameters
+        ----------
+        rhs : ndarray
+            RHS vector.
+        sol : ndarray
+            Solution vector for rhs.
+        """
+        norm = np.sqrt(self._sum(np.array([np.vdot(rhs, rhs).real]))[0])
+        if norm == 0.0:
+            return
+
+        self._allocate(rhs.size, rhs.dtype)
+
+        if self._limit is not None and self._count >= self._limit:
+            if self._limit < 1:
+                # The memory budget is too small to hold a single entry.
+                return
+            self._evict()
+
+        k = self._count
+
+        if self._mode == 'subspace':
+            # Orthogonalize against the cached basis (twice, for numerical stability) and
+            # apply the same operations to the solution so that A * sol = rhs still holds.
+            rhs = rhs.copy()
+            sol = sol.copy()
+            if k > 0:
+                basis = self._rhs[:k]
+                for _ in range(2):
+                    coefs = self._sum(basis.conj().dot(rhs))
+                    rhs -= basis.T.dot(coefs)
+                    sol -= self._sol[:k].T.dot(coefs)
+
+                res_norm = np.sqrt(self._sum(np.array([np.vdot(rhs, rhs).real]))[0])
+                if res_norm <= self._rtol * norm:
+                    # Already in the span of the cached vectors.
+                    return
+                norm = res_norm
+
+            rhs /= norm
+            sol /= norm
+            norm = 1.0
+
+        self._tick += 1
+        self._rhs[k] = rhs
+        self._sol[k] = sol
+        self._norms[k] = norm
+        self._last_used[k] = self._tick
+        self._hits[k] = 0
+        self._count += 1
+
+    def lookup(self, rhs):
+        """
+        Find a combination of cached solutions that solves for rhs.
+
+        Parameters
+        ----------
+        rhs : ndarray
+            New RHS vector.
+
+        Returns
+        -------
+        ndarray or None
+            Coefficients of the cached solutions, or None if rhs cannot be reused from the cache.
+        """
+        hits, coefs = self.lookup_block(rhs[:, np.newaxis])
+        if hits[0]:
+            return coefs[:, 0]
+
+    def lookup_block(self, rhs_block):
+        """
+        Find combinations of cached solutions that solve for each column of rhs_block.
+
+        Parameters
+        ----------
+        rhs_block : ndarray
+            New RHS vectors stored as the columns of an (n, m) array.
+
+        Returns
+        -------
+        ndarray of bool
+            True for each column that can be reused from the cache.
+        ndarray
+            (k, m) array of coefficients such that column j is the combination of the k
+            cached RHS vectors with coefficients coefs[:, j], for each hit.
+        """
+        ncol = rhs_block.shape[1]
+        k = self._count
+
+        # RHS vectors of another data type (e.g. complex RHS under complex step against a cache
+        # of real vectors) are never served from the cache.
+        if k == 0 or self._rhs.shape[1] != rhs_block.shape[0] or \
+                self._rhs.dtype != rhs_block.dtype:
+            return np.zeros(ncol, dtype=bool), np.zeros((k, ncol), dtype=rhs_block.dtype)
+
+        rhs = self._rhs[:k]
+
+        if self._comm is not None:
+            # Work on small vectors with the same inner products as the distributed ones, so
+            # that the whole lookup needs one allreduce.
+            condensed = self._condense(np.hstack([rhs.T, rhs_block]))
+            rhs = condensed[:, :k].T
+            rhs_block = condensed[:, k:]
+
+        dots = rhs.conj().dot(rhs_block)  # (k, m)
+        col_norms = np.sqrt(np.sum(np.abs(rhs_block) ** 2, axis=0))
+
+        if self._mode == 'parallel':
+            # Only the cached vector with the smallest angle to each new vector is combined.
+            norms = self._norms[:k]
+            best = np.argmax(np.abs(dots) / norms[:, np.newaxis], axis=0)
+            cols = np.arange(ncol)
+            coefs = np.zeros_like(dots)
+            coefs[best, cols] = dots[best, cols] / norms[best] ** 2
+            dots = coefs
+
+        # The residual is computed explicitly: deriving it from the cosine (1 - cos is quadratic
+        # in the perturbation) or from the norms (cancellation) would lose half of the digits.
+        res = rhs_block - rhs.T.dot(dots)
+        res_norms = np.sqrt(np.sum(np.abs(res) ** 2, axis=0))
+        hits = res_norms <= self._rtol * col_norms
+        dots[:, ~hits] = 0.0
+        return hits, dots
+
+    def guess(self, rhs):
+        """
+        Find the combination of cached solutions closest to the solution for rhs.
+
+        In 'subspace' mode this is the orthogonal projection of rhs onto the cached RHS vectors.
+        In 'parallel' mode this is the cached RHS vector with the smallest angle to rhs, scaled
+        to minimize the residual. Either way the residual is not larger than the norm of rhs,
+        so the result is a better initial guess for an iterative solver than zero.
+
+        Parameters
+        ----------
+        rhs : ndarray
+            New RHS vector.
+
+        Returns
+        -------
+        ndarray or None
+            Coefficients of the cached solutions, or None if rhs is orthogonal to all of them.
+        """
+        k = self._count
+
+        if k == 0 or self._rhs.shape[1] != rhs.size or self._rhs.dtype != rhs.dtype:
+            return None
+
+        dots = self._sum(self._rhs[:k].conj().dot(rhs))
+
+        if self._mode == 'parallel':
+            norms = self._norms[:k]
+            best = np.argmax(np.abs(dots) / norms)
+            coefs = np.zeros_like(dots)
+            coefs[best] = dots[best] / norms[best] ** 2
+            dots = coefs
+
+        if np.any(dots):
+            return dots
+
+    def hit_kind(self, coefs):
+        """
+        Classify a cache hit.
+
+        Parameters
+        ----------
+        coefs : ndarray
+            Coefficients of the cached solutions for one RHS, as returned by lookup.
+
+        Returns
+        -------
+        str
+            'identical' or 'negated' if the RHS is a cached RHS vector or its opposite,
+            'parallel' if it is a multiple of one cached RHS vector, and 'subspace' if it is a
+            combination of cached RHS vectors. Hits in 'subspace' mode are always 'subspace'
+            because the cached vectors are normalized.
+        """
+        nonzero = np.flatnonzero(coefs)
+        if self._mode == 'subspace' or nonzero.size > 1:
+            return 'subspace'
+        if nonzero.size == 0:
+            return 'parallel'
+
+        coef = coefs[nonzero[0]]
+        if np.isclose(coef, 1.0):
+            return 'identical'
+        if np.isclose(coef, -1.0):
+            return 'negated'
+        return 'parallel'
+
+    def solution(self, coefs):
+        """
+        Return the combination of cached solutions with the given coefficients.
+
+        This counts as a use of the entries with nonzero coefficients for the eviction policy.
+
+        Parameters
+        ----------
+        coefs : ndarray
+            Coefficients of the cached solutions, as returned by lookup (shape (k,)) or
+            lookup_block (shape (k, m)).
+
+        Returns
+        -------
+        ndarray
+            The combined solution, with shape (n,) or (n, m).
+        """
+        k = self._count
+
+        used = coefs != 0.0
+        if coefs.ndim > 1:
+            used = np.any(used, axis=1)
+        self._tick += 1
+        self._last_used[:k][used] = self._tick
+        self._hits[:k][used] += 1
+
+        return self._sol[:k].T.dot(coefs)
+
+
+def get_unscale_factors(system):
+    """
+    Return the factors that convert scaled d_outputs and d_residuals arrays to unscaled.
+
+    Linear vectors are scaled without an adder, so the factors are found by unscaling vectors of
+    ones. They only change with a new setup.
+
+    Parameters
+    ----------
+    system : System
+        System owning the linear vectors.
+
+    Returns
+    -------
+    tuple of (ndarray, ndarray)
+        Factors for d_outputs and d_residuals.
+    """
+    d_outputs = system._doutputs
+    d_residuals = system._dresiduals
+
+    # First make a backup of the vectors
+    out_data = d_outputs.asarray(copy=True)
+    res_data = d_residuals.asarray(copy=True)
+
+    d_outputs.set_val(1.0)
+    d_residuals.set_val(1.0)
+    with system._unscaled_context(outputs=[d_outputs], residuals=[d_residuals]):
+        factors = (d_outputs.asarray(copy=True).real, d_residuals.asarray(copy=True).real)
+
+    # Restore the backed-up vectors
+    d_outputs.set_val(out_data)
+    d_residuals.set_val(res_data)
+
+    return factors
@@ -0,0 +1,214 @@
+"""Performance counters of the POEM_093 prototype solvers.
+
+Each prototype solver owns a SolverStats instance (its `stats` attribute) that counts the
+solves, the cache hits by kind and the cache misses, and accumulates the time spent in
+factorizations and back-solves (or Krylov solves) together with the Krylov iteration counts.
+
+The counters can be queried at any time with `get_stats`. To aggregate them over a whole
+optimization, a recorder can be attached with `add_recorder`; it is called with the event name
+and a dictionary of data after every factorization and every solve:
+
+    def recorder(event, data):
+        print(event, data)
+
+    solver.stats.add_recorder(recorder)
+"""
+
+HIT_KINDS = ('identical', 'negated', 'parallel', 'subspace')
+
+
+class SolverStats(object):
+    """
+    Counters and timers of one solver.
+
+    Parameters
+    ----------
+    name : str
+        Name of the solver, passed to the recorders.
+
+    Attributes
+    ----------
+    name : str
+        Name of the solver, passed to the recorders.
+    num_solves : int
+        Number of solved right-hand sides, served from the cache or not.
+    num_hits : dict
+        Number of cache hits, keyed by kind of hit (see HIT_KINDS).
+    num_misses : int
+        Number of right-hand sides that were not found in the cache.
+    num_factorizations : int
+        Number of matrix factorizations.
+    num_iterations : int
+        Number of Krylov iterations.
+    factor_time : float
+        Time spent in factorizations, in seconds.
+    solve_time : float
+        Time spent in back-solves or Krylov solves, in seconds.
+    cache_time : float
+        Time spent serving right-hand sides from the cache, in seconds.
+    _recorders : list
+        Callables called with the event name and data after every event.
+    """
+
+    def __init__(self, name=''):
+        """
+        Initialize attributes.
+        """
+        self.name = name
+        self._recorders = []
+        self.reset()
+
+    def reset(self):
+        """
+        Set all counters and timers to zero. The recorders are kept.
+        """
+        self.num_solves = 0
+        self.num_hits = dict.fromkeys(HIT_KINDS, 0)
+        self.num_misses = 0
+        self.num_factorizations = 0
+        self.num_iterations = 0
+        self.factor_time = 0.0
+        self.solve_time = 0.0
+        self.cache_time = 0.0
+
+    def add_recorder(self, recorder):
+        """
+        Attach a recorder.
+
+        Parameters
+        ----------
+        recorder : callable
+            Function called as recorder(event, data) after every event, where event is
+            'factorization', 'hit' or 'miss', and data is a dictionary.
+        """
+        self._recorders.append(recorder)
+
+    def remove_recorder(self, recorder):
+        """
+        Detach a recorder.
+
+        Parameters
+        ----------
+        recorder : callable
+            Recorder previously attached with add_recorder.
+        """
+        self._recorders.remove(recorder)
+
+    def _notify(self, event, data):
+        """
+        Call the recorders.
+
+        Parameters
+        ----------
+        event : str
+            Name of the event.
+        data : dict
+            Data of the event.
+        """
+        if self._recorders:
+            data['solver'] = self.name
+            for recorder in self._recorders:
+                recorder(event, data)
+
+    def record_factorization(self, elapsed):
+        """
+        Record a matrix factorization.
+
+        Parameters
+        ----------
+        elapsed : float
+            Duration of the factorization in seconds.
+        """
+        self.num_factorizations += 1
+        self.factor_time += elapsed
+        self._notify('factorization', {'time': elapsed})
+
+    def record_hit(self, kind, elapsed, count=1):
+        """
+        Record right-hand sides served from the cache.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of hit, one of HIT_KINDS.
+        elapsed : float
+            Time spent serving them in seconds.
+        count : int
+            Number of right-hand sides.
+        """
+        self.num_solves += count
+        self.num_hits[kind] += count
+        self.cache_time += elapsed
+        self._notify('hit', {'kind': kind, 'time': elapsed, 'count': count})
+
+    def record_miss(self, elapsed, iterations=0, count=1):
+        """
+        Record right-hand sides that were solved.
+
+        Parameters
+        ----------
+        elapsed : float
+            Duration of the back-solve or Krylov solve in seconds.
+        iterations : int
+            Number of Krylov iterations.
+        count : int
+            Number of right-hand sides.
+        """
+        self.num_solves += count
+        self.num_misses += count
+        self.num_iterations += iterations
+        self.solve_time += elapsed
+        self._notify('miss', {'time': elapsed, 'iterations': iterations, 'count': count})
+
+    @property
+    def hit_rate(self):
+        """
+        Return the fraction of the right-hand sides that were served from the cache.
+
+        Returns
+        -------
+        float
+            Hit rate, or 0.0 if nothing was solved yet.
+        """
+        if self.num_solves == 0:
+            return 0.0
+        return sum(self.num_hits.values()) / self.num_solves
+
+    def get_stats(self):
+        """
+        Return a snapshot of the counters and timers.
+
+        Returns
+        -------
+        dict
+            Counters and timers keyed by name.
+        """
+        return {
+            'solver': self.name,
+            'num_solves': self.num_solves,
+            'num_hits': dict(self.num_hits),
+            'num_misses': self.num_misses,
+            'hit_rate': self.hit_rate,
+            'num_factorizations': self.num_factorizations,
+            'num_iterations': self.num_iterations,
+            'factor_time': self.factor_time,
+            'solve_time': self.solve_time,
+            'cache_time': self.cache_time,
+        }
+
+    def __str__(self):
+        """
+        Return a summary of the counters and timers.
+
+        Returns
+        -------
+        str
+            Summary.
+        """
+        hits = ', '.join(f'{kind}: {n}' for kind, n in self.num_hits.items())
+        return (f"{self.name}: {self.num_solves} solve(s), {self.num_misses} miss(es), "
+                f"hits ({hits}), hit rate {self.hit_rate:.1%}\n"
+                f"  {self.num_factorizations} factorization(s) in {self.factor_time:.2E} s, "
+                f"solves in {self.solve_time:.2E} s ({self.num_iterations} Krylov "
+                f"iteration(s)), cache in {self.cache_time:.2E} s")
+
@@ -0,0 +1,68 @@
+"""
+Solve the Sellar problem with the full-model Broyden solver, with OpenMDAO's BroydenSolver and
+DirectSolver and with BroydenSolverCustom and DirectSolverCustom(inverse_operator=True), and
+compare the solutions, iterations and computed Jacobians.
+"""
+
+import numpy as np
+import openmdao.api as om
+from openmdao.test_suite.components.sellar import SellarStateConnection
+
+# import custom Broyden and linear solvers with the inverse operator prototype
+from broyden_custom import BroydenSolverCustom
+from direct_custom import DirectSolverCustom
+
+
+def run_sellar(custom, update_broyden=True, use_cache=False):
+    prob = om.Problem()
+    nl_solver = BroydenSolverCustom() if custom else om.BroydenSolver()
+    prob.model = SellarStateConnection(nonlinear_solver=nl_solver, linear_solver=om.LinearRunOnce())
+
+    prob.setup(force_alloc_complex=True)
+
+    if custom:
+        nl_solver.linear_solver = DirectSolverCustom(inverse_operator=True, use_cache=use_cache)
+    else:
+        nl_solver.linear_solver = om.DirectSolver()
+    nl_solver.options["update_broyden"] = update_broyden
+    nl_solver.options["maxiter"] = 20
+
+    prob.set_solver_print(level=-1)
+    prob.run_model()
+
+    return prob, nl_solver
+
+
+for update_broyden in [True, False]:
+    results = {}
+    for custom in [False, True]:
+        prob, solver = run_sellar(custom, update_broyden)
+        results[custom] = (prob.get_val("y1")[0], prob.get_val("state_eq.y2_command")[0],
+                           solver._iter_count, solver._computed_jacobians)
+        print("custom" if custom else "stock ", "update_broyden =", update_broyden,
+              "y1 = %.8f, y2 = %.8f, iterations = %d, Jacobians = %d" % results[custom])
+
+    assert np.allclose(results[True][:2], [25.58830273, 12.05848819], rtol=1e-5)
+    assert results[True][2:] == results[False][2:], results
+
+# --- second solve with the Broyden-updated operator, then totals by complex step ---
+totals = {}
+for custom in [False, True]:
+    prob, solver = run_sellar(custom, use_cache=custom)
+
+    prob.set_val("x", 2.0)
+    prob.run_model()
+    if custom:
+        assert hasattr(solver.Gm, "rank_one_update")
+
+    # derivatives of the outputs with respect to x by complex step, solved with Broyden
+    model = prob.model
+    model._set_complex_step_mode(True)
+    model._outputs[model.get_source("x")] += 1e-30j
+    model.run_solve_nonlinear()
+    totals[custom] = {name: model._outputs[name].imag / 1e-30 for name in ["obj_cmp.obj", "con_cmp1.con1"]}
+    model._set_complex_step_mode(False)
+
+for key, val in totals[True].items():
+    assert np.allclose(val, totals[False][key], rtol=1e-8), (key, val, totals[False][key])
+print("complex step totals: ok")